@@ -1,7 +1,11 @@
 from .agent import AgentGraphRAGBedRock
+from .batch import AgentGraphRAGBatch
 from .manager import ChatManager
+from .metrics import llm_usage_metrics
 
 __all__ = [
     "AgentGraphRAGBedRock",
+    "AgentGraphRAGBatch",
     "ChatManager",
+    "llm_usage_metrics",
 ]
\ No newline at end of file
@@ -1,13 +1,17 @@
+import time
 from typing import Optional
 
+from langchain_aws import ChatBedrock
 from langchain_core.messages import BaseMessage
 from langchain_neo4j import Neo4jGraph
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
 
-from server import SocketManager
+from server import SocketManager, EventStreamEmitter
+from services import provision_graph
 from vectorstore import QdrantClientManager
 from .base import LLMBedRockBase, GraphState
+from .cache import RetrievalCache
 from .graph import GraphAgent
 from .manager import ChatManager
 from config import env
@@ -17,32 +21,64 @@ class AgentGraphRAGBedRock(LLMBedRockBase):
     def __init__(
         self,
         chat_id: str,
-        sio: Optional[SocketManager] = None,
+        sio: Optional[SocketManager | EventStreamEmitter] = None,
         model_id: Optional[str] = env.BEDROCK_MODEL_ID,
         region: Optional[str] = env.AWS_REGION,
         aws_access_key_id: Optional[str] = env.AWS_ACCESS_KEY_ID,
         aws_secret_access_key: Optional[str] = env.AWS_SECRET_ACCESS_KEY,
+        llm: Optional[ChatBedrock] = None,
+        graph: Optional[Neo4jGraph] = None,
+        vectorstore: Optional[QdrantClientManager] = None,
+        retrieval_cache: Optional[RetrievalCache] = None,
+        stream_answer: bool = False,
     ):
         super().__init__(
             model_id=model_id,
             region=region,
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
+            llm=llm,
         )
+        self._sio = sio
         self._chat_manager = ChatManager(chat_id)
         self._chat_histories: list[BaseMessage] = []
-        self._graph = Neo4jGraph(
+        self._graph = graph or Neo4jGraph(
             url=env.NEO4J_URL,
             username=env.NEO4J_USERNAME,
             password=env.NEO4J_PASSWORD,
         )
-        self._vectorstore = QdrantClientManager()
+        provision_graph(self._graph)
+        self._vectorstore = vectorstore or QdrantClientManager()
+        self._retrieval_cache = retrieval_cache
         self._agent = GraphAgent(
             graph=self._graph,
             vectorstore=self._vectorstore,
             llm=self._llm,
             chat_manager=self._chat_manager,
             sio=sio,
+            retrieval_cache=retrieval_cache,
+            stream_answer=stream_answer,
+        )
+        self._stream_answer = stream_answer
+
+    def for_chat(self, chat_id: str) -> "AgentGraphRAGBedRock":
+        """
+        Create an agent for another chat that shares this agent's LLM, graph, vector store and retrieval cache.
+        :param chat_id: The chat ID of the new agent.
+        :return: The new agent.
+        """
+        return AgentGraphRAGBedRock(
+            chat_id,
+            sio=self._sio,
+            model_id=self._model_id,
+            region=self._region,
+            aws_access_key_id=self._aws_access_key_id,
+            aws_secret_access_key=self._aws_secret_access_key,
+            llm=self._llm,
+            graph=self._graph,
+            vectorstore=self._vectorstore,
+            retrieval_cache=self._retrieval_cache,
+            stream_answer=self._stream_answer,
         )
 
     @staticmethod
@@ -56,12 +92,47 @@ class AgentGraphRAGBedRock(LLMBedRockBase):
             return "answer_final"
         return state["route"]
 
-    async def invoke(self, question: str, **kwargs) -> str:
+    @staticmethod
+    def start_status(state: GraphState) -> str:
+        """
+        Determine the next step after the Start node, skipping subqueries when the deadline is close.
+        :param state: The current state of the graph.
+        :return: A string indicating the routing status.
+        """
+        if state["route"] == "needs_search" and GraphAgent.is_degraded(state): # type: ignore
+            return "skip_subqueries"
+        return state["route"]
+
+    async def invoke(
+        self,
+        question: str,
+        budget: Optional[float] = None,
+        speculative: Optional[bool] = None,
+        **kwargs,
+    ) -> str:
+        """
+        Run the agent workflow for the given question.
+        :param question: The input question to generate a response for.
+        :param budget: Latency budget in seconds, defaults to AGENT_LATENCY_BUDGET. Optional steps are skipped as it runs out;
+            a budget under MIN_FULL_BUDGET_SECONDS (23 s) skips them from the start.
+        :param speculative: Generate subqueries and search the raw question while Start is running,
+            defaults to AGENT_SPECULATIVE.
+        :param kwargs: Additional parameters for the generation.
+        :return: The generated response as a string.
+        """
+        budget = budget or env.AGENT_LATENCY_BUDGET
+        if speculative is None:
+            speculative = env.AGENT_SPECULATIVE
         workflow = StateGraph(GraphState) # type: ignore
-        workflow.add_node("Start", self._agent.start) # type: ignore
+        if speculative:
+            # Subqueries are produced by the Start node itself
+            workflow.add_node("Start", self._agent.start_speculative) # type: ignore
+        else:
+            workflow.add_node("Start", self._agent.start) # type: ignore
         workflow.add_node("Route", self._agent.route) # type: ignore
         workflow.add_node("SearchGraph", self._agent.search_graph) # type: ignore
         workflow.add_node("SearchVector", self._agent.search_vector) # type: ignore
+        workflow.add_node("SearchGlobal", self._agent.search_global) # type: ignore
         workflow.add_node("Subqueries", self._agent.subqueries) # type: ignore
         workflow.add_node("Answer", self._agent.answer) # type: ignore
         # Edges
@@ -69,13 +140,15 @@ class AgentGraphRAGBedRock(LLMBedRockBase):
         workflow.add_edge("Subqueries", "Route")
         workflow.add_edge("SearchGraph", "Route")
         workflow.add_edge("SearchVector", "Route")
+        workflow.add_edge("SearchGlobal", "Route")
         workflow.add_edge("Answer", END)
         # Conditional
         workflow.add_conditional_edges(
             "Start",
-            lambda x: x['route'],
+            self.start_status,
             {
-                "needs_search": "Subqueries",
+                "needs_search": "Route" if speculative else "Subqueries",
+                "skip_subqueries": "Route",
                 "answer_final": "Answer",
             }
         )
@@ -85,6 +158,7 @@ class AgentGraphRAGBedRock(LLMBedRockBase):
             {
                 "search_graph": "SearchGraph",
                 "search_vector": "SearchVector",
+                "search_global": "SearchGlobal",
                 "answer_final": "Answer",
             }
         )
@@ -97,7 +171,8 @@ class AgentGraphRAGBedRock(LLMBedRockBase):
             "subqueries": [],
             "route": "",
             "depth": 0,
-            "answer": ""
+            "answer": "",
+            "deadline": time.monotonic() + budget if budget else None,
         }
         result = await workflow_graph.ainvoke(__initial_state) # type: ignore
         return result["answer"]
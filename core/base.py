@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import TypedDict
+from typing import TypedDict, Optional
 from langchain_aws import ChatBedrock
 
+from .metrics import llm_usage_metrics
+
 
 class LLMBase(ABC):
     @abstractmethod
@@ -24,17 +26,19 @@ class LLMBedRockBase(LLMBase):
         region: str,
         aws_access_key_id: str,
         aws_secret_access_key: str,
+        llm: Optional[ChatBedrock] = None,
     ):
         self._model_id = model_id
         self._region = region
         self._aws_access_key_id = aws_access_key_id
         self._aws_secret_access_key = aws_secret_access_key
-        self._llm = ChatBedrock(
+        self._llm = llm or ChatBedrock(
             model=self._model_id,
             region=self._region,
             aws_access_key_id=self._aws_access_key_id,          # type: ignore
             aws_secret_access_key=self._aws_secret_access_key,  # type: ignore
             temperature=0,
+            callbacks=[llm_usage_metrics],
         )
 
     @abstractmethod
@@ -81,6 +85,15 @@ class GraphNodesBase(ABC):
         """
         raise NotImplementedError("This method should be implemented in a subclass.")
 
+    @abstractmethod
+    async def search_global(self, state: dict) -> dict:
+        """
+        Search the precomputed community summaries for broad questions.
+        :param state: The current state of the graph.
+        :return: A list of Document objects.
+        """
+        raise NotImplementedError("This method should be implemented in a subclass.")
+
     @abstractmethod
     async def route(self, state: dict) -> dict:
         """
@@ -119,4 +132,5 @@ class GraphState(TypedDict):
     route: str
     subqueries: list[str]
     documents: list[str]
-    depth: int
\ No newline at end of file
+    depth: int
+    deadline: Optional[float]
\ No newline at end of file
@@ -0,0 +1,74 @@
+import asyncio
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+from schemas import AgentGraphRAGBatchResult
+from .agent import AgentGraphRAGBedRock
+from .cache import RetrievalCache
+
+
+class AgentGraphRAGBatch:
+    def __init__(self, concurrency: int = 4, budget: Optional[float] = None):
+        """
+        Answer many questions with one shared set of resources.
+        :param concurrency: The maximum number of questions answered at once.
+        :param budget: Optional latency budget in seconds for each question.
+        """
+        self._concurrency = concurrency
+        self._budget = budget
+        self._batch_id = uuid4().hex
+        self._retrieval_cache = RetrievalCache()
+        self._agent: Optional[AgentGraphRAGBedRock] = None
+
+    def _get_agent(self, chat_id: str) -> AgentGraphRAGBedRock:
+        """
+        Get an agent for the chat, sharing the LLM, graph, vector store and retrieval cache across the batch.
+        :param chat_id: The chat ID of the agent.
+        :return: The agent.
+        """
+        if self._agent is None:
+            self._agent = AgentGraphRAGBedRock(chat_id, retrieval_cache=self._retrieval_cache)
+            return self._agent
+        return self._agent.for_chat(chat_id)
+
+    async def _ask(self, index: int, question: str, semaphore: asyncio.Semaphore) -> AgentGraphRAGBatchResult:
+        """
+        Answer a single question of the batch in its own chat.
+        :param index: The position of the question in the batch.
+        :param question: The question to answer.
+        :param semaphore: The semaphore bounding the batch concurrency.
+        :return: The result of the question.
+        """
+        chat_id = f"batch-{self._batch_id}-{index}"
+        async with semaphore:
+            try:
+                agent = self._get_agent(chat_id)
+                result = await agent.invoke(question, budget=self._budget)
+                return AgentGraphRAGBatchResult(index=index, question=question, chat_id=chat_id, result=result)
+            except Exception as e:
+                print(f"Error answering batch question {index}: {e}")
+                return AgentGraphRAGBatchResult(index=index, question=question, chat_id=chat_id, error=str(e))
+
+    async def run(self, questions: list[str]) -> AsyncIterator[AgentGraphRAGBatchResult]:
+        """
+        Answer the questions, yielding each result as soon as it is ready.
+        Identical questions are answered once and their result is yielded for every position.
+        :param questions: The questions to answer.
+        :return: An async iterator of results.
+        """
+        positions: dict[str, list[int]] = {}
+        for index, question in enumerate(questions):
+            positions.setdefault(question, []).append(index)
+        semaphore = asyncio.Semaphore(self._concurrency)
+        tasks = [
+            asyncio.create_task(self._ask(indexes[0], question, semaphore))
+            for question, indexes in positions.items()
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                for index in positions[result.question]:
+                    yield result.model_copy(update={"index": index})
+        finally:
+            # The client went away or the batch failed: stop the remaining questions
+            for task in tasks: task.cancel()
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class RetrievalCache:
+    """
+    Deduplicates identical retrievals and LLM calls shared by several agent runs.
+    Concurrent requests for the same key wait on a single in-flight call.
+    """
+
+    def __init__(self):
+        self._futures: dict[Hashable, asyncio.Future] = {}
+
+    def _discard_failed(self, key: Hashable, future: asyncio.Future) -> None:
+        """
+        Forget a failed or cancelled call so that it can be retried.
+        :param key: The cache key.
+        :param future: The finished future.
+        """
+        if future.cancelled() or future.exception() is not None:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    async def get_or_run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get the result for the key, running the factory only if no call for it was made yet.
+        :param key: The cache key.
+        :param factory: A callable returning the awaitable to run on a cache miss.
+        :return: The result of the call.
+        """
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda f: self._discard_failed(key, f))
+            self._futures[key] = future
+        # Shield the shared call so a cancelled waiter does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def __len__(self) -> int:
+        return len(self._futures)
@@ -0,0 +1,121 @@
+import json
+import re
+from typing import Any
+
+from langchain_neo4j import Neo4jGraph
+from langchain_neo4j.graphs.graph_document import GraphDocument
+from langchain_neo4j.graphs.graph_store import GraphStore
+from neo4j import READ_ACCESS
+from neo4j.exceptions import Neo4jError
+
+from config import env
+
+# Trailing LIMIT with any expression (a number, a parameter, ...), optionally followed by ; or a comment
+_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+([^\s;]+)\s*;?\s*(//[^\n]*)?$", re.IGNORECASE)
+# Relationship patterns, e.g. -[r:REL*2..]-> or <-[*]-, so list expressions such as [x IN l | x*10] are left alone
+_RELATIONSHIP_PATTERN = re.compile(r"(-\s*)\[([^\[\]]*)\](\s*-)")
+# Variable-length part of a relationship pattern, e.g. *, *2.., *..10, before the properties if any
+_VAR_LENGTH_PATTERN = re.compile(r"\*\s*(\d*)\s*(\.\.)?\s*(\d*)(?=\s*(?:\{|$))")
+
+
+def is_timeout(error: Neo4jError) -> bool:
+    """
+    Check whether a Neo4j error was caused by the transaction timeout.
+    :param error: The Neo4j error.
+    :return: True if the transaction timed out.
+    """
+    return "TransactionTimedOut" in (error.code or "")
+
+
+def enforce_limits(query: str, max_rows: int, max_hops: int) -> str:
+    """
+    Bound a generated Cypher query: cap its LIMIT and the length of variable-length paths.
+    :param query: The generated Cypher query.
+    :param max_rows: The maximum number of rows the query may return.
+    :param max_hops: The maximum length of variable-length paths.
+    :return: The bounded query.
+    """
+    def _bound_hops(match: re.Match) -> str:
+        lower, dots, upper = match.groups()
+        if not dots:
+            # Exact length (*3) or unbounded (*)
+            return f"*{min(int(lower), max_hops)}" if lower else f"*1..{max_hops}"
+        upper_ = min(int(upper), max_hops) if upper else max_hops
+        lower_ = min(int(lower), upper_) if lower else 1
+        return f"*{lower_}..{upper_}"
+
+    def _bound_relationship(match: re.Match) -> str:
+        left, pattern, right = match.groups()
+        return f"{left}[{_VAR_LENGTH_PATTERN.sub(_bound_hops, pattern, count=1)}]{right}"
+
+    query = _RELATIONSHIP_PATTERN.sub(_bound_relationship, query.strip())
+    match = _LIMIT_PATTERN.search(query)
+    if match is None:
+        return f"{query.rstrip(';').rstrip()}\nLIMIT {max_rows}"
+    # Non-numeric limits are kept: the rows are capped again while they are read
+    if match.group(1).isdigit() and int(match.group(1)) > max_rows:
+        return f"{query[:match.start()]}LIMIT {max_rows}"
+    return query
+
+
+class BoundedCypherGraph(GraphStore):
+    def __init__(
+        self,
+        graph: Neo4jGraph,
+        timeout: float = env.NEO4J_QUERY_TIMEOUT,
+        max_rows: int = env.NEO4J_QUERY_MAX_ROWS,
+        max_chars: int = env.NEO4J_QUERY_MAX_CHARS,
+        max_hops: int = env.NEO4J_QUERY_MAX_HOPS,
+    ):
+        """
+        Graph store that runs generated Cypher in read-only, time-limited transactions with bounded results.
+        :param graph: The Neo4j graph whose driver and schema are used.
+        :param timeout: The transaction timeout in seconds.
+        :param max_rows: The maximum number of rows returned.
+        :param max_chars: The maximum serialized size of the returned rows.
+        :param max_hops: The maximum length of variable-length paths.
+        """
+        self._graph = graph
+        self._timeout = timeout
+        self._max_rows = max_rows
+        self._max_chars = max_chars
+        self._max_hops = max_hops
+
+    @property
+    def get_schema(self) -> str:
+        return self._graph.get_schema
+
+    @property
+    def get_structured_schema(self) -> dict[str, Any]:
+        return self._graph.get_structured_schema
+
+    def refresh_schema(self) -> None:
+        self._graph.refresh_schema()
+
+    def add_graph_documents(self, graph_documents: list[GraphDocument], include_source: bool = False) -> None:
+        raise NotImplementedError("BoundedCypherGraph is read-only.")
+
+    def query(self, query: str, params: dict = {}) -> list[dict[str, Any]]:
+        """
+        Run the query in a read-only transaction, stopping at the row and size caps.
+        :param query: The Cypher query.
+        :param params: The query parameters.
+        :return: The resulting rows.
+        """
+        query = enforce_limits(query, self._max_rows, self._max_hops)
+        rows: list[dict[str, Any]] = []
+        size = 0
+        # The driver of Neo4jGraph is reused so no extra connection pool is opened
+        with self._graph._driver.session(  # noqa
+            database=self._graph._database,  # noqa
+            default_access_mode=READ_ACCESS,
+        ) as session:
+            with session.begin_transaction(timeout=self._timeout) as tx:
+                for record in tx.run(query, params):
+                    row = record.data()
+                    size += len(json.dumps(row, default=str, ensure_ascii=False))
+                    if len(rows) >= self._max_rows or size > self._max_chars:
+                        print(f"Cypher result truncated at {len(rows)} rows.")
+                        break
+                    rows.append(row)
+        return rows
@@ -1,25 +1,62 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Optional, Any, Awaitable, Callable, Literal
 
 from langchain_aws import ChatBedrock
-from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_neo4j import Neo4jGraph, GraphCypherQAChain
-from neo4j.exceptions import CypherSyntaxError
+from neo4j.exceptions import CypherSyntaxError, Neo4jError
 
-from schemas import AgentGraphSubquery, AgentGraphRoute, AgentGraphStart
-from server import SocketManager
+from config import env
+from schemas import (
+    AgentGraphSubquery,
+    AgentGraphRoute,
+    AgentGraphStart,
+    AgentGraphGlobalPoint,
+    AgentGraphGlobalPoints,
+)
+from server import SocketManager, EventStreamEmitter
 from vectorstore import QdrantClientManager
 from .base import GraphNodesBase
+from .cache import RetrievalCache
+from .cypher import BoundedCypherGraph, is_timeout
 from .manager import ChatManager
+from .retriever import GraphTemplateRetriever
 from .prompt import (
     QA_PROMPT,
-    CYPHER_PROMPT,
     SUBQUERIES_PROMPT,
     ROUTING_PROMPT,
-    ASSISTANT_PROMPT,
+    ASSISTANT_INSTRUCTIONS,
+    ASSISTANT_CONTEXT_TEMPLATE,
     ROUTING_CONSTANTS,
     START_PROMPT,
+    GLOBAL_MAP_PROMPT,
+    cached_system_message,
+    cypher_prompt,
 )
 
+# Seconds kept aside for the Answer node when the request has a latency budget.
+ANSWER_RESERVE_SECONDS = 8.0
+# Minimum seconds left to still run optional LLM steps (subqueries, routing).
+OPTIONAL_STEP_MIN_SECONDS = 15.0
+# Budgets below this floor (23 s) skip every optional step from the start and only search the raw question.
+MIN_FULL_BUDGET_SECONDS = ANSWER_RESERVE_SECONDS + OPTIONAL_STEP_MIN_SECONDS
+# Number of queries searched when the deadline is close.
+DEGRADED_FANOUT = 1
+# Number of community summaries given to each map call of the global search.
+GLOBAL_MAP_BATCH_SIZE = 10
+# Number of points kept as context by the global search.
+GLOBAL_SEARCH_TOP_POINTS = 20
+
+# Latest version of the community summaries, largest communities first
+COMMUNITIES_QUERY = """
+MATCH (c:__Community__)
+WITH max(c.version) AS version
+MATCH (c:__Community__ {version: version})
+RETURN c.title AS title, c.summary AS summary, c.size AS size
+ORDER BY c.size DESC LIMIT $limit
+"""
+
 
 class GraphAgent(GraphNodesBase):
     def __init__(
@@ -28,9 +65,18 @@ class GraphAgent(GraphNodesBase):
         vectorstore: QdrantClientManager,
         llm: ChatBedrock,
         chat_manager: ChatManager,
-        sio: Optional[SocketManager] = None
+        sio: Optional[SocketManager | EventStreamEmitter] = None,
+        retrieval_cache: Optional[RetrievalCache] = None,
+        stream_answer: bool = False,
+        graph_search_strategy: Literal["cypher", "template"] = env.GRAPH_SEARCH_STRATEGY,
     ):
         self._chat_manager = chat_manager
+        self._stream_answer = stream_answer
+        self._graph_search_strategy = graph_search_strategy
+        self._graph_retriever = GraphTemplateRetriever(graph, hops=env.GRAPH_SEARCH_HOPS)
+        # Generated Cypher only ever runs read-only, time-limited and with bounded results
+        self._cypher_graph = BoundedCypherGraph(graph)
+        self._retrieval_cache = retrieval_cache
         self._graph = graph
         self._vectorstore = vectorstore
         self._llm = llm
@@ -44,6 +90,82 @@ class GraphAgent(GraphNodesBase):
         """
         if self._sio: await self._sio.emit(event, data)
 
+    async def _cached(self, key: tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run a retrieval or LLM call through the shared retrieval cache, if any.
+        :param key: The cache key identifying the call.
+        :param factory: A callable returning the awaitable to run.
+        :return: The result of the call.
+        """
+        if self._retrieval_cache is None:
+            return await factory()
+        return await self._retrieval_cache.get_or_run(key, factory)
+
+    def _asearch(self, query: str) -> Awaitable[list]:
+        """
+        Search the vector database for the query, deduplicated through the retrieval cache.
+        :param query: The query to search for.
+        :return: An awaitable with the Document objects found.
+        """
+        return self._cached(
+            ("vector", query),
+            lambda: self._vectorstore.asearch(
+                query=query,
+                k=10,
+                filters=None, # TODO: Implement filters if needed
+            ),
+        )
+
+    @staticmethod
+    def time_left(state: dict) -> Optional[float]:
+        """
+        Seconds left before the Answer node must start.
+        :param state: The current state of the graph.
+        :return: The remaining seconds, or None if the request has no deadline.
+        """
+        deadline: Optional[float] = state.get("deadline")
+        if deadline is None:
+            return None
+        return deadline - time.monotonic() - ANSWER_RESERVE_SECONDS
+
+    @classmethod
+    def is_degraded(cls, state: dict) -> bool:
+        """
+        Check whether the deadline is close enough to skip optional steps.
+        :param state: The current state of the graph.
+        :return: True if optional steps should be skipped.
+        """
+        remaining = cls.time_left(state)
+        return remaining is not None and remaining < OPTIONAL_STEP_MIN_SECONDS
+
+    def _queries(self, state: dict) -> list[str]:
+        """
+        Get the queries to search, capping the fan-out when the deadline is close.
+        :param state: The current state of the graph.
+        :return: A list of queries.
+        """
+        queries: list[str] = state["subqueries"] or [state["question"]]
+        if self.is_degraded(state):
+            return queries[:DEGRADED_FANOUT]
+        return queries
+
+    @staticmethod
+    def _vector_context(query: str, result: list) -> list[dict]:
+        """
+        Convert vector search results into context entries.
+        :param query: The query used for the search.
+        :param result: The Document objects returned by the vector store.
+        :return: A list of context entries.
+        """
+        return [
+            {
+                "query": query,
+                "content": doc.page_content,
+                "source": doc.metadata['source']
+            }
+            for doc in result
+        ]
+
     async def start(self, state: dict) -> dict:
         """
         Start the agent and initialize the state.
@@ -57,6 +179,40 @@ class GraphAgent(GraphNodesBase):
         result: AgentGraphStart = await route_chain.ainvoke(state)  # type: ignore
         return {"route": result.route}
 
+    async def start_speculative(self, state: dict) -> dict:
+        """
+        Start the agent while generating subqueries and searching the raw question in parallel.
+        The speculative work is cancelled if the question can be answered directly.
+        :param state: The current state of the graph.
+        :return: The route, plus the subqueries and documents when a search is needed.
+        """
+        question: str = state["question"]
+        speculative: list[asyncio.Task] = [
+            asyncio.create_task(self._asearch(question))
+        ]
+        if not self.is_degraded(state):
+            speculative.append(asyncio.create_task(self.subqueries(state)))
+        try:
+            result = await self.start(state)
+        except BaseException:
+            for task in speculative: task.cancel()
+            raise
+        if result["route"] == "answer_final":
+            print("--DISCARDING SPECULATIVE RETRIEVAL--")
+            for task in speculative: task.cancel()
+            await asyncio.gather(*speculative, return_exceptions=True)
+            return result
+        retrieval, *subqueries = await asyncio.gather(*speculative, return_exceptions=True)
+        if isinstance(retrieval, BaseException):
+            print(f"Error during speculative vector search: {retrieval}")
+            retrieval = []
+        result["documents"] = state["documents"] + self._vector_context(question, retrieval)
+        if subqueries and not isinstance(subqueries[0], BaseException):
+            result.update(subqueries[0])
+        elif subqueries:
+            print(f"Error generating speculative subqueries: {subqueries[0]}")
+        return result
+
     async def search_vector(self, state: dict) -> dict:
         """
         Search the vector database based on the current state and return a list of Document objects.
@@ -69,24 +225,24 @@ class GraphAgent(GraphNodesBase):
         information_text = 'Buscando vetores no banco de dados...'
         await self._emit("agent_updated", {"status": information_text})
         documents: list[dict] = state["documents"]
-        for q in state["subqueries"]:
+        # Queries already answered by speculative retrieval are not searched again
+        searched = {d["query"] for d in documents if isinstance(d, dict) and "content" in d}
+        for q in self._queries(state):
+            if q in searched:
+                continue
+            remaining = self.time_left(state)
+            if remaining is not None and remaining <= 0:
+                information_text += "\n- Tempo esgotado, ignorando as demais consultas."
+                break
             print(f"Processing query: {q}")
             information_text += f"\n- Consultando: {q}"
             try:
-                result = await self._vectorstore.asearch(
-                    query=q,
-                    k=10,
-                    filters=None, # TODO: Implement filters if needed
-                )
-                documents.extend([
-                    {
-                        "query": q,
-                        "content": doc.page_content,
-                        "source": doc.metadata['source']
-                    }
-                    for doc in result
-                ])
+                result = await asyncio.wait_for(self._asearch(q), timeout=remaining)
+                documents.extend(self._vector_context(q, result))
                 information_text += " **OK**"
+            except asyncio.TimeoutError:
+                print(f"Vector search timed out: {q}")
+                information_text += "\n- Tempo esgotado na busca vetorial."
             except Exception as e:
                 print(f"Error during vector search: {e}")
                 information_text += f"\n- Erro ao buscar vetores: {e}"
@@ -104,34 +260,135 @@ class GraphAgent(GraphNodesBase):
         await self._emit("agent_updated", {"status": information_text})
         documents: list[dict] = state["documents"]
         depth: int = state["depth"]
-        cypher_prompt_copy = CYPHER_PROMPT.model_copy()
-        cypher_prompt_copy.template = cypher_prompt_copy.template.replace(
-            "{{chat_history}}", await self._chat_manager.get_history_as_string())
-        # Search the graph using the LLM
-        for q in state["subqueries"]:
+        chat_history, cypher_prompt_ = "", None
+        if self._graph_search_strategy == "cypher":
+            # The instructions and schema form the cached prefix, the chat history is not cached
+            chat_history = await self._chat_manager.get_history_as_string()
+            cypher_prompt_ = cypher_prompt(
+                schema=self._graph.get_schema,
+                chat_history=chat_history,
+            )
+        for q in self._queries(state):
+            remaining = self.time_left(state)
+            if remaining is not None and remaining <= 0:
+                information_text += "\n- Tempo esgotado, ignorando as demais consultas."
+                break
             print(f"Processing query: {q}")
             information_text += f"\n- Consultando: {q}"
             try:
-                cypher_chain = GraphCypherQAChain.from_llm(
-                    self._llm,
-                    graph=self._graph,
-                    qa_prompt=QA_PROMPT,
-                    cypher_prompt=cypher_prompt_copy,
-                    verbose=True,
-                    top_k=10,
-                    allow_dangerous_requests=True,
-                    validate_cypher=True,
-                )
-                document = await cypher_chain.ainvoke(q)
+                if cypher_prompt_ is None:
+                    # Link the entities and expand their neighbourhood without the LLM
+                    search = self._cached(("graph_template", q), lambda: self._search_graph_template(q))
+                else:
+                    # Search the graph using the LLM
+                    cypher_chain = GraphCypherQAChain.from_llm(
+                        self._llm,
+                        graph=self._cypher_graph,
+                        qa_prompt=QA_PROMPT,
+                        cypher_prompt=cypher_prompt_,
+                        verbose=True,
+                        top_k=10,
+                        allow_dangerous_requests=True,
+                        validate_cypher=True,
+                    )
+                    search = self._cached(("graph", q, chat_history), lambda: cypher_chain.ainvoke(q))
+                document = await asyncio.wait_for(search, timeout=remaining)
                 documents.append(document)
                 information_text += " **OK**"
+            except asyncio.TimeoutError:
+                print(f"Graph search timed out: {q}")
+                information_text += "\n- Tempo esgotado na consulta ao grafo."
             except CypherSyntaxError as e:
                 print(f"Cypher syntax error: {e}")
                 information_text += f"\n- Erro de sintaxe Cypher: {e}"
+            except Neo4jError as e:
+                if is_timeout(e):
+                    print(f"Graph query timed out: {q}")
+                    information_text += "\n- Tempo esgotado na consulta ao grafo."
+                else:
+                    print(f"Graph search error: {e}")
+                    information_text += f"\n- Erro ao consultar o grafo: {e}"
             await self._emit("agent_updated", {"status": information_text})
         depth += 1
         return {"documents": documents, "depth": depth}
 
+    async def _search_graph_template(self, query: str) -> dict:
+        """
+        Search the graph through entity linking and the neighbourhood template, without the LLM.
+        :param query: The query to search for.
+        :return: A document with the query and the relationships found.
+        """
+        rows = await self._graph_retriever.asearch(query)
+        return {"query": query, "result": self._graph_retriever.to_context(rows)}
+
+    async def search_global(self, state: dict) -> dict:
+        """
+        Answer broad questions with a map step over the precomputed community summaries.
+        The most relevant points are kept as context for the Answer node, which does the reduce step.
+        :param state: The current state of the graph.
+        :return: The documents with the selected points.
+        """
+        print("--SEARCHING GLOBAL--")
+        information_text = 'Consultando os resumos das comunidades do grafo...'
+        await self._emit("agent_updated", {"status": information_text})
+        documents: list[dict] = state["documents"]
+        depth: int = state["depth"] + 1
+        try:
+            communities = await self._cached(
+                ("communities",),
+                lambda: asyncio.to_thread(
+                    self._graph.query,
+                    COMMUNITIES_QUERY,
+                    params={"limit": env.GLOBAL_SEARCH_COMMUNITIES},
+                ),
+            )
+        except Neo4jError as e:
+            print(f"Error loading community summaries: {e}")
+            information_text += f"\n- Erro ao carregar os resumos: {e}"
+            await self._emit("agent_updated", {"status": information_text})
+            return {"documents": documents, "depth": depth}
+        if not communities:
+            information_text += "\n- Nenhum resumo de comunidade disponível."
+            await self._emit("agent_updated", {"status": information_text})
+            return {"documents": documents, "depth": depth}
+        # Map: extract scored points from each group of summaries in parallel
+        structured = self._llm.with_structured_output(AgentGraphGlobalPoints)
+        map_chain = GLOBAL_MAP_PROMPT | structured
+        inputs = [
+            {
+                "question": state["question"],
+                "summaries": "\n\n".join(
+                    f"# {c['title']}\n{c['summary']}"
+                    for c in communities[i:i + GLOBAL_MAP_BATCH_SIZE]
+                ),
+            }
+            for i in range(0, len(communities), GLOBAL_MAP_BATCH_SIZE)
+        ]
+        try:
+            results = await asyncio.wait_for(
+                map_chain.abatch(inputs, return_exceptions=True),
+                timeout=self.time_left(state),
+            )
+        except asyncio.TimeoutError:
+            print("Global search timed out")
+            information_text += "\n- Tempo esgotado na consulta aos resumos."
+            results = []
+        points: list[AgentGraphGlobalPoint] = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error during global search: {result}")
+                continue
+            points.extend(p for p in result.points if p.score > 0)
+        # Reduce: keep the most important points as context for the answer
+        points.sort(key=lambda p: p.score, reverse=True)
+        documents.extend(
+            {"query": state["question"], "content": p.description, "source": "community_summaries"}
+            for p in points[:GLOBAL_SEARCH_TOP_POINTS]
+        )
+        information_text += f"\n- {len(communities)} resumos consultados, {len(points)} pontos relevantes."
+        await self._emit("agent_updated", {"status": information_text})
+        return {"documents": documents, "depth": depth}
+
     async def route(self, state: dict) -> dict:
         """
         Route the state to the appropriate nodes in the graph.
@@ -139,6 +396,13 @@ class GraphAgent(GraphNodesBase):
         :return:
         """
         print("--ROUTING--")
+        remaining = self.time_left(state)
+        if state["depth"] >= 1 or (remaining is not None and remaining <= 0):
+            # A search already ran or the budget is spent: the answer is next anyway.
+            return {"route": "answer_final"}
+        if self.is_degraded(state):
+            # Not enough time for a routing call, fall back to the cheaper vector search.
+            return {"route": "search_vector"}
         information_text = 'Roteando o estado para os nós apropriados...'
         await self._emit("agent_updated", {"status": information_text})
         structured = self._llm.with_structured_output(AgentGraphRoute)
@@ -160,7 +424,10 @@ class GraphAgent(GraphNodesBase):
         information_text = 'Gerando sub-consultas...'
         structured = self._llm.with_structured_output(AgentGraphSubquery)
         subquery_chain = SUBQUERIES_PROMPT | structured
-        result: AgentGraphSubquery = await subquery_chain.ainvoke(state) # type: ignore
+        result: AgentGraphSubquery = await self._cached(
+            ("subqueries", state["question"], tuple(state["subqueries"])),
+            lambda: subquery_chain.ainvoke(state),
+        )
         information_text += f"\n- Sub-consultas geradas: {', '.join(result.subquestions)}"
         await self._emit("agent_updated", {"status": information_text})
         return {"subqueries": result.subquestions}
@@ -174,7 +441,10 @@ class GraphAgent(GraphNodesBase):
         print("--ANSWERING--")
         await self._chat_manager.add_message(state["question"], role="user")
         messages = await self._chat_manager.get_history()
-        system_prompt = SystemMessagePromptTemplate(prompt=ASSISTANT_PROMPT)
+        system_prompt = cached_system_message(
+            ASSISTANT_INSTRUCTIONS,
+            ASSISTANT_CONTEXT_TEMPLATE.format(context=state["documents"]),
+        )
         prompt = ChatPromptTemplate.from_messages(
             [
                 system_prompt,
@@ -182,6 +452,16 @@ class GraphAgent(GraphNodesBase):
             ]
         )
         chain = prompt | self._llm
-        response = await chain.ainvoke({"context": state["documents"]})
-        await self._chat_manager.add_message(response.content, role="agent")
-        return {"answer": response.content}
+        if not self._stream_answer:
+            response = await chain.ainvoke({})
+            await self._chat_manager.add_message(response.content, role="agent")
+            return {"answer": response.content}
+        # Emit the answer token by token as it is generated
+        content = ""
+        async for chunk in chain.astream({}):
+            if not isinstance(chunk.content, str) or not chunk.content:
+                continue
+            content += chunk.content
+            await self._emit("answer_token", {"token": chunk.content})
+        await self._chat_manager.add_message(content, role="agent")
+        return {"answer": content}
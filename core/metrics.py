@@ -0,0 +1,76 @@
+from threading import Lock
+from typing import Any
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+class LLMUsageMetrics(BaseCallbackHandler):
+    """
+    Callback handler that accumulates LLM token usage, including Bedrock prompt-cache reads and writes.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: dict[str, int] = {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+        }
+
+    @staticmethod
+    def _usage(response: LLMResult) -> dict[str, int]:
+        """
+        Extract the token usage from an LLM result.
+        :param response: The LLM result.
+        :return: The token counts of the call.
+        """
+        usage: dict[str, int] = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage_metadata = getattr(message, "usage_metadata", None)
+                if not usage_metadata:
+                    continue
+                details = usage_metadata.get("input_token_details") or {}
+                usage["input_tokens"] = usage.get("input_tokens", 0) + usage_metadata.get("input_tokens", 0)
+                usage["output_tokens"] = usage.get("output_tokens", 0) + usage_metadata.get("output_tokens", 0)
+                usage["cache_read_input_tokens"] = (
+                    usage.get("cache_read_input_tokens", 0) + details.get("cache_read", 0))
+                usage["cache_creation_input_tokens"] = (
+                    usage.get("cache_creation_input_tokens", 0) + details.get("cache_creation", 0))
+        if usage:
+            return usage
+        # Older Bedrock responses only report usage in the LLM output
+        llm_usage: dict[str, Any] = (response.llm_output or {}).get("usage") or {}
+        return {
+            "input_tokens": llm_usage.get("prompt_tokens", llm_usage.get("input_tokens", 0)),
+            "output_tokens": llm_usage.get("completion_tokens", llm_usage.get("output_tokens", 0)),
+            "cache_read_input_tokens": llm_usage.get("cache_read_input_tokens", 0),
+            "cache_creation_input_tokens": llm_usage.get("cache_creation_input_tokens", 0),
+        }
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        """
+        Accumulate the token usage of a finished LLM call.
+        :param response: The LLM result.
+        """
+        usage = self._usage(response)
+        with self._lock:
+            self._counters["calls"] += 1
+            for k, v in usage.items():
+                self._counters[k] += v or 0
+
+    def snapshot(self) -> dict[str, int]:
+        """
+        Get a copy of the accumulated counters.
+        :return: The token usage counters.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+# Process-wide usage counters shared by every LLM client
+llm_usage_metrics = LLMUsageMetrics()
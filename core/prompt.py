@@ -1,39 +1,102 @@
 from langchain.prompts import PromptTemplate
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+
+from config import env
+from services import ENTITY_INDEX_NAME, DOCUMENT_INDEX_NAME
+
+
+def cache_checkpoint(text: str) -> str | list[dict]:
+    """
+    Build message content that marks the given static text as a Bedrock prompt-cache checkpoint.
+    Everything up to and including this block is cached when prompt caching is enabled.
+    :param text: The static text to cache.
+    :return: The message content, with a cache checkpoint when BEDROCK_PROMPT_CACHING is set.
+    """
+    if not env.BEDROCK_PROMPT_CACHING:
+        return text
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+def cached_system_message(prefix: str, suffix: str = "") -> SystemMessage:
+    """
+    Build a system message whose static prefix is cached and whose dynamic suffix is not.
+    :param prefix: The static part of the system prompt.
+    :param suffix: The already formatted dynamic part of the system prompt.
+    :return: The system message.
+    """
+    content = cache_checkpoint(prefix)
+    if not suffix:
+        return SystemMessage(content=content)
+    if isinstance(content, str):
+        return SystemMessage(content=f"{content}\n\n{suffix}")
+    return SystemMessage(content=[*content, {"type": "text", "text": suffix}])
+
+
+def cached_prompt(prefix: str, template: str) -> ChatPromptTemplate:
+    """
+    Build a chat prompt made of a cached static prefix followed by a templated question.
+    :param prefix: The static instructions, sent as a cached system message.
+    :param template: The template with the dynamic inputs, sent as a human message.
+    :return: The chat prompt template.
+    """
+    return ChatPromptTemplate.from_messages([
+        cached_system_message(prefix),
+        HumanMessagePromptTemplate.from_template(template),
+    ])
+
+
+def cypher_prompt(schema: str, chat_history: str) -> ChatPromptTemplate:
+    """
+    Build the Cypher generation prompt, caching the instructions together with the graph schema.
+    :param schema: The Neo4j graph schema.
+    :param chat_history: The chat history as a string.
+    :return: The chat prompt template expecting a question.
+    """
+    return ChatPromptTemplate.from_messages([
+        cached_system_message(f"{CYPHER_INSTRUCTIONS}\n\nSchema:\n{schema}"),
+        HumanMessagePromptTemplate.from_template(CYPHER_QUESTION_TEMPLATE),
+    ]).partial(chat_history=chat_history)
+
 
 
 ROUTING_CONSTANTS = {
     "search_graph": "Consultando os relacionamentos do grafo",
     "search_vector": "Consultando o contexto semântico",
+    "search_global": "Consultando os resumos globais do grafo",
     "generate_subqueries": "Gerando novas sub-consultas",
     "answer_final": "Concluído! Gerando resposta final",
 }
 
 
-CYPHER_PROMPT = PromptTemplate(
-    template="""You are an expert at generating Cypher queries for Neo4j.
+CYPHER_INSTRUCTIONS = """You are an expert at generating Cypher queries for Neo4j.
 Use the following schema to generate a Cypher query that answers the given question.
-Make the query flexible by using case-insensitive matching and partial string matching where appropriate.
+Make the query flexible by using case-insensitive and partial matching through the full-text indexes below.
 Focus on searching paper titles as they contain the most relevant information.
 
+To find entities by name, use the full-text index instead of CONTAINS or toLower() on node ids, for example:
+CALL db.index.fulltext.queryNodes('{entity_index}', 'Maria Silva') YIELD node, score
+To search the text of the source documents, use:
+CALL db.index.fulltext.queryNodes('{document_index}', 'danos morais') YIELD node, score
+
 Note: Do not include any explanations or apologies in your responses.
 Do not respond to any questions that might ask anything else than for you to construct a Cypher statement.
 Do not include any text except the generated Cypher statement.
-Do not use any other relationship types or properties that are not provided.
+Do not use any other relationship types or properties that are not provided.""".format(
+    entity_index=ENTITY_INDEX_NAME,
+    document_index=DOCUMENT_INDEX_NAME,
+)
 
-Chat history:
+CYPHER_QUESTION_TEMPLATE = """Chat history:
 ---
-{{chat_history}}
+{chat_history}
 ---
 
-Schema:
-{schema}
-
 The question is: 
 {question}
 
-Cypher:""",
-    input_variables=["schema", "question"],
-)
+Cypher:"""
+
 
 QA_PROMPT = PromptTemplate(
     template="""You are a legal evaluator.
@@ -52,8 +115,7 @@ Classification:""",
     input_variables=["question", "context"],
 )
 
-START_PROMPT = PromptTemplate(
-    template="""You are a legal expert assistant.  
+START_INSTRUCTIONS = """You are a legal expert assistant.  
 Your task is to decide if the user’s legal question can be answered directly using existing knowledge or if it requires retrieving additional information from external sources.  
 
 You have two options:  
@@ -68,20 +130,21 @@ You have two options:
 
 Return only **'needs_search'** or **'answer_final'**.
 
----
+---"""
 
-**Question:**  
+START_PROMPT = cached_prompt(
+    START_INSTRUCTIONS,
+    """**Question:**  
 {question}""",
-    input_variables=["question"],
 )
 
-ROUTING_PROMPT = PromptTemplate(
-    template="""You are a legal expert specializing in routing a user’s legal question to the most appropriate next action.
+ROUTING_INSTRUCTIONS = """You are a legal expert specializing in routing a user’s legal question to the most appropriate next action.
 
-You have three options:
+You have four options:
 1. **'search_graph'** — Use when the question requires structured, explicit relationships between legal entities, such as people, courts, or articles, or when the answer depends on navigating clear links in the knowledge graph.
 2. **'search_vector'** — Use when the question is open-ended, vague, uses synonyms or natural language, and would benefit from semantic similarity matching to find relevant context not directly connected in the graph.
-3. **'answer_final'** — Use only if the information is already complete and no further search is needed.
+3. **'search_global'** — Use when the question asks for an overview across many cases or documents, such as the main themes, theses or trends of a court, subject or set of appeals.
+4. **'answer_final'** — Use only if the information is already complete and no further search is needed.
 
 ---
 
@@ -89,42 +152,66 @@ You have three options:
 
 * Prefer **'search_graph'** for specific, explicit relationships (e.g., *"Which articles relate to this law?"*, *"Who filed the appeal?"*).
 * Prefer **'search_vector'** for broad, general, or ambiguous questions (e.g., *"What does this concept mean?"*, *"Explain the context of this case."*).
+* Prefer **'search_global'** for questions about the whole knowledge base (e.g., *"What are the main theses across the TJSP appeals?"*).
 * Use **'answer_final'** only if the information is sufficient and no more search is required.
 
----
+---"""
 
-**Documents to consider:**
+ROUTING_PROMPT = cached_prompt(
+    ROUTING_INSTRUCTIONS,
+    """**Documents to consider:**
 {documents}
 
 **Question to route:**
 {question}""",
-    input_variables=["documents", "question"],
 )
 
-SUBQUERIES_PROMPT = PromptTemplate(
-    template="""You are a legal assistant that breaks down a complex legal question into smaller, clear, and specific sub-questions.
+SUBQUERIES_INSTRUCTIONS = """You are a legal assistant that breaks down a complex legal question into smaller, clear, and specific sub-questions.
 Generate only sub-questions that help clarify or expand the main question into logical parts.
 Each sub-question must be unique and must not repeat the same meaning as another already generated.
 If the main question is already simple and does not need to be broken down, return an empty list.
-Do not add any explanations or extra text.
+Do not add any explanations or extra text."""
 
-Main legal question:
+SUBQUERIES_PROMPT = cached_prompt(
+    SUBQUERIES_INSTRUCTIONS,
+    """Main legal question:
 {question}
 
 Already generated sub-questions:
 {subqueries}""",
-    input_variables=["question", "subqueries"],
 )
 
-ASSISTANT_PROMPT = PromptTemplate(
-    template="""Você é um assistente jurídico responsável por fornecer respostas claras, objetivas e fundamentadas a perguntas legais.
+ASSISTANT_INSTRUCTIONS = """Você é um assistente jurídico responsável por fornecer respostas claras, objetivas e fundamentadas a perguntas legais.
 Utilize exclusivamente as informações do contexto fornecido para elaborar sua resposta.
 Caso o contexto esteja vazio ou não contenha detalhes suficientes, informe educadamente que não há informações suficientes para responder à pergunta.
-Caso houver as fontes utilizadas, informe-as ao final da resposta.
+Caso houver as fontes utilizadas, informe-as ao final da resposta."""
+
+ASSISTANT_CONTEXT_TEMPLATE = """Informações disponíveis:
+{context}"""
+
+GLOBAL_MAP_INSTRUCTIONS = """You are a legal analyst answering a broad question from summaries of communities of related legal entities.
+Extract from the summaries below the key points that help answer the question.
+Give each point a score from 0 to 100 for how important it is to answer the question.
+Use only the information in the summaries. If they are not relevant to the question, return an empty list.
+Mention the community titles that support each point."""
+
+GLOBAL_MAP_PROMPT = cached_prompt(
+    GLOBAL_MAP_INSTRUCTIONS,
+    """**Community summaries:**
+{summaries}
+
+**Question:**
+{question}""",
+)
 
-Informações disponíveis:
-{context}""",
-    input_variables=["context"],
+COMMUNITY_SUMMARY_PROMPT = cached_prompt(
+    """You are a legal analyst specialized in the Brazilian legal domain.
+You receive the entities and relationships of a community from a legal knowledge graph.
+Write a short title naming its main entities and a summary describing who and what is involved,
+how they are related and the main legal theses, decisions and subjects of the community.
+Use only the provided relationships. Do not guess or hallucinate. Write in Portuguese.""",
+    """**Relationships:**
+{relationships}""",
 )
 
 EXTRACT_ENTITIES_PROMPT = PromptTemplate(
@@ -0,0 +1,116 @@
+import asyncio
+import re
+
+from langchain_neo4j import Neo4jGraph
+
+from schemas import RELATIONSHIP_TYPES
+from services import ENTITY_INDEX_NAME, provision_graph
+
+# Words ignored when building the full-text query
+STOPWORDS: set[str] = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "por", "para", "com", "que", "quem", "qual", "quais", "como", "onde", "quando",
+    "the", "of", "and", "to", "in", "is", "are", "who", "what", "which", "with", "for", "case",
+    "processo", "caso", "está", "foi", "ao", "aos", "se", "sobre", "entre", "ligado", "ligados",
+    "relacionado", "relacionados", "conectado", "conectados",
+}
+
+# Link mentions through the full-text index, then expand the k-hop neighbourhood
+# following only the allowed relationship types.
+NEIGHBORHOOD_QUERY = """
+CALL db.index.fulltext.queryNodes($index, $query, {limit: $entities}) YIELD node, score
+WITH node, score WHERE score >= $min_score
+MATCH path = (node)-[rels*1..%d]-(neighbor:__Entity__)
+WHERE all(r IN rels WHERE type(r) IN $relationship_types)
+WITH path, score ORDER BY score DESC LIMIT $limit
+UNWIND relationships(path) AS r
+WITH DISTINCT startNode(r) AS s, r, endNode(r) AS t
+RETURN s.id AS source, [l IN labels(s) WHERE l <> '__Entity__'][0] AS source_type,
+       type(r) AS relationship,
+       t.id AS target, [l IN labels(t) WHERE l <> '__Entity__'][0] AS target_type
+LIMIT $limit
+"""
+
+
+class GraphTemplateRetriever:
+    def __init__(
+        self,
+        graph: Neo4jGraph,
+        hops: int = 1,
+        entities: int = 5,
+        limit: int = 50,
+        min_score: float = 0.5,
+    ):
+        """
+        Retrieve graph context without the LLM, by entity linking and a parameterized neighbourhood query.
+        :param graph: The Neo4j graph.
+        :param hops: The number of hops to expand around each linked entity.
+        :param entities: The maximum number of entities linked per question.
+        :param limit: The maximum number of paths returned.
+        :param min_score: The minimum full-text score for an entity to be linked.
+        """
+        self._graph = graph
+        self._hops = max(1, int(hops))
+        self._entities = entities
+        self._limit = limit
+        self._min_score = min_score
+
+    @staticmethod
+    def build_query(question: str) -> str:
+        """
+        Build a Lucene full-text query from the question mentions.
+        :param question: The user question.
+        :return: The full-text query, or an empty string if the question has no usable terms.
+        """
+        terms: list[str] = []
+        # Case numbers (e.g. CNJ numbers) are matched as exact phrases
+        for number in re.findall(r"\d[\d.\-/]{5,}\d", question):
+            terms.append(f'"{number}"')
+        for word in re.findall(r"\w+", question.lower()):
+            if len(word) < 3 or word in STOPWORDS or word.isdigit():
+                continue
+            terms.append(word)
+        return " OR ".join(dict.fromkeys(terms))
+
+    def search(self, question: str) -> list[dict]:
+        """
+        Retrieve the relationships around the entities mentioned in the question.
+        :param question: The user question.
+        :return: A list of relationships with their source and target entities.
+        """
+        query = self.build_query(question)
+        if not query:
+            return []
+        # The entity full-text index must exist before it can be queried
+        provision_graph(self._graph)
+        return self._graph.query(
+            NEIGHBORHOOD_QUERY % self._hops,
+            params={
+                "index": ENTITY_INDEX_NAME,
+                "query": query,
+                "entities": self._entities,
+                "min_score": self._min_score,
+                "relationship_types": RELATIONSHIP_TYPES,
+                "limit": self._limit,
+            },
+        )
+
+    async def asearch(self, question: str) -> list[dict]:
+        """
+        Asynchronous wrapper for the search method.
+        :param question: The user question.
+        :return: A list of relationships with their source and target entities.
+        """
+        return await asyncio.to_thread(self.search, question)
+
+    @staticmethod
+    def to_context(rows: list[dict]) -> str:
+        """
+        Format retrieved relationships as context for the answer.
+        :param rows: The relationships returned by the search.
+        :return: One relationship per line.
+        """
+        return "\n".join(
+            f"({r['source']}:{r['source_type']})-[{r['relationship']}]->({r['target']}:{r['target_type']})"
+            for r in rows
+        )
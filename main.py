@@ -1,22 +1,29 @@
+import asyncio
 import os
-import tempfile
 from uuid import uuid4
 
+from config import env
 from services import S3Client
 from botocore.exceptions import ClientError
 
-from fastapi import FastAPI, Depends, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 
 from schemas import (
-    KnowledgeUploadSchema, KnowledgeUpdateResponse,
+    KnowledgeUploadSchema, KnowledgeFileStatus, KnowledgeUpdateResponse,
+    KnowledgePresignRequest, KnowledgePresignedPart, KnowledgePresignResponse, KnowledgeCompleteRequest,
     AgentGraphRAGRequest, AgentGraphRAGResponse,
+    AgentGraphRAGBatchRequest,
+    LLMUsageMetricsResponse,
+    IngestionJobStatusResponse, IngestionMetricsResponse,
 )
 
-from core import AgentGraphRAGBedRock, ChatManager
-from server import SocketManager
-from workers import aupload_knowledge_base
+from core import AgentGraphRAGBedRock, AgentGraphRAGBatch, ChatManager, llm_usage_metrics
+from server import SocketManager, EventStreamEmitter
+from workers import aupload_knowledge_base, aget_job_status, aget_ingestion_metrics
 
 app = FastAPI(
     title="Chat GraphRAG API",
@@ -26,6 +33,12 @@ app = FastAPI(
 sio = SocketManager()
 sio.mount_to("/socket.io", app)
 
+# Uploaded knowledge files are stored under this prefix until ingested
+KNOWLEDGE_PREFIX = "knowledge/"
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.md')
+# S3 multipart uploads accept at most 10,000 parts of at least 5 MB, except for the last one
+MAX_UPLOAD_PARTS = 10000
+
 path__ = os.path.dirname(os.path.abspath(__file__))
 
 app.mount("/public", StaticFiles(directory="%s/public" % path__), name="static")
@@ -73,8 +86,16 @@ async def invoke_agent(sid, data):
     if not question:
         return await sio.emit("error", {"message": "Question is required."}, room=sid)
 
+    # Same validation as the HTTP endpoint: the budget must be a positive number of seconds up to the limit
+    try:
+        request = AgentGraphRAGRequest(question=question, budget=data.get("budget"))
+    except ValidationError as e:
+        error = e.errors()[0]
+        return await sio.emit(
+            "error", {"message": f"Invalid {'.'.join(map(str, error['loc']))}: {error['msg']}."}, room=sid)
+
     agent = AgentGraphRAGBedRock(chat_id, sio)
-    response = await agent.invoke(question)
+    response = await agent.invoke(request.question, budget=request.budget)
 
     return await sio.emit(
         "agent_response",
@@ -91,6 +112,23 @@ async def root(request: Request):
     return templates.TemplateResponse(request, "index.html", {})
 
 
+@app.post("/chat/batch")
+async def chat_batch(data: AgentGraphRAGBatchRequest) -> StreamingResponse:
+    """
+    Endpoint to answer many questions at once with shared resources and bounded concurrency.
+    Results are streamed as newline-delimited JSON in the order they finish.
+    :param data: The questions and the batch settings.
+    :return: A streaming response with one JSON result per line.
+    """
+    batch = AgentGraphRAGBatch(concurrency=data.concurrency, budget=data.budget)
+
+    async def results():
+        async for result in batch.run(data.questions):
+            yield result.model_dump_json() + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 @app.post("/chat/{chat_id}", response_model=AgentGraphRAGResponse)
 async def chat(chat_id: str, data: AgentGraphRAGRequest) -> AgentGraphRAGResponse:
     """
@@ -100,14 +138,96 @@ async def chat(chat_id: str, data: AgentGraphRAGRequest) -> AgentGraphRAGRespons
     :return: A response containing the processed message.
     """
     agent = AgentGraphRAGBedRock(chat_id)
-    response = await agent.invoke(data.question)
+    response = await agent.invoke(data.question, budget=data.budget)
     return AgentGraphRAGResponse(**{"result": response})
 
 
+@app.get("/metrics/llm", response_model=LLMUsageMetricsResponse)
+async def llm_metrics() -> LLMUsageMetricsResponse:
+    """
+    Endpoint to get the accumulated LLM token usage, including prompt-cache reads and writes.
+    :return: The LLM usage counters of this process.
+    """
+    return LLMUsageMetricsResponse(**llm_usage_metrics.snapshot())
+
+
+@app.get("/metrics/ingestion", response_model=IngestionMetricsResponse)
+async def ingestion_metrics() -> IngestionMetricsResponse:
+    """
+    Endpoint to get the ingestion metrics: jobs by stage, and the totals and time per chunk
+    of each stage over the completed documents.
+    :return: The ingestion metrics.
+    """
+    return IngestionMetricsResponse(**await aget_ingestion_metrics())
+
+
+@app.post("/chat/{chat_id}/stream")
+async def chat_stream(chat_id: str, data: AgentGraphRAGRequest, request: Request) -> StreamingResponse:
+    """
+    Endpoint to handle chat messages for clients without Socket.IO, using Server-Sent Events.
+    Streams "agent_updated" node status, "answer_token" answer tokens and a final "agent_response" or "error".
+    :param chat_id: The chat ID.
+    :param data: The data containing the chat message and any additional information.
+    :param request: The HTTP request, used to cancel the agent when the client disconnects.
+    :return: A streaming response of Server-Sent Events.
+    """
+    emitter = EventStreamEmitter()
+    agent = AgentGraphRAGBedRock(chat_id, emitter, stream_answer=True)
+    return StreamingResponse(
+        emitter.stream(agent.invoke(data.question, budget=data.budget), request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _knowledge_key(filename: str) -> str:
+    """
+    Create a unique S3 key for a knowledge file under the knowledge/ prefix.
+    :param filename: The name of the uploaded file.
+    :return: The S3 object key.
+    """
+    ext = filename.split('.')[-1]
+    return f"{KNOWLEDGE_PREFIX}{filename}-{str(uuid4())}.{ext}"
+
+
+async def _upload_knowledge_file(s3_client: S3Client, file: UploadFile, semaphore: asyncio.Semaphore) -> str:
+    """
+    Stream an uploaded file to S3 off the event loop and enqueue its ingestion.
+    If either step fails, the object is deleted so it is not left under the knowledge prefix without a job.
+    :param s3_client: The S3 client.
+    :param file: The uploaded file, spooled to disk by the multipart parser.
+    :param semaphore: Bounds the number of files uploaded at once.
+    :return: The ingestion job ID.
+    """
+    key = _knowledge_key(file.filename)
+    try:
+        async with semaphore:
+            await asyncio.to_thread(s3_client.upload_fileobj, file.file, key)
+        return await aupload_knowledge_base(key=key, size=_file_size(file))
+    except Exception:
+        await asyncio.to_thread(s3_client.delete_object, key)
+        raise
+
+
+def _file_size(file: UploadFile) -> int:
+    """
+    Get the size of an uploaded file without reading it.
+    :param file: The uploaded file.
+    :return: The size in bytes.
+    """
+    if file.size is not None:
+        return file.size
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(0)
+    return size
+
+
 @app.post("/knowledge/update", response_model=KnowledgeUpdateResponse)
 async def update_knowledge(upload: KnowledgeUploadSchema = Depends(KnowledgeUploadSchema)) -> KnowledgeUpdateResponse:
     """
-    Endpoint to update the knowledge base with a new document.
+    Endpoint to update the knowledge base with new documents.
+    Files are validated first, then streamed to S3 with multipart uploads in worker threads,
+    several at a time, so large batches do not block the event loop.
     :param upload: The uploaded files containing the knowledge base document.
     :return: A confirmation message.
     """
@@ -116,36 +236,148 @@ async def update_knowledge(upload: KnowledgeUploadSchema = Depends(KnowledgeUplo
             success=False,
             message="No files uploaded."
         )
-    job_ids: list[str] = []
-    s3_client = S3Client()
     for file in upload.files:
-        if not file.filename.endswith(('.pdf', '.txt', '.md')):
+        if not file.filename.endswith(SUPPORTED_EXTENSIONS):
             return KnowledgeUpdateResponse(
                 success=False,
                 message="Unsupported file type. Only PDF, TXT, and MD files are allowed."
             )
-        ext = file.filename.split('.')[-1]
-        key = f"knowledge/{file.filename}-{str(uuid4())}.{ext}"
-        try:
-            temp = tempfile.NamedTemporaryFile(delete=False)
-            with open(temp.name, 'wb') as f:
-                f.write(file.file.read())
-            s3_client.upload_file(temp.name, key)
-            os.remove(temp.name)
-        except ClientError as e:
-            return KnowledgeUpdateResponse(
-                success=False,
-                message=f"Failed to upload file to S3: {e}"
-            )
-        except FileNotFoundError as e:
+        if _file_size(file) > env.UPLOAD_MAX_FILE_SIZE * 1024 * 1024:
             return KnowledgeUpdateResponse(
                 success=False,
-                message=f"File not found: {e}"
+                message=f"File {file.filename} exceeds the maximum size of {env.UPLOAD_MAX_FILE_SIZE} MB."
             )
-        job_id = await aupload_knowledge_base(key=key)
-        job_ids.append(job_id)
+    s3_client = S3Client()
+    semaphore = asyncio.Semaphore(env.UPLOAD_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_upload_knowledge_file(s3_client, file, semaphore) for file in upload.files),
+        return_exceptions=True,
+    )
+    files = [
+        KnowledgeFileStatus(filename=file.filename, success=True, job_id=result) if isinstance(result, str)
+        else KnowledgeFileStatus(filename=file.filename, success=False, message=str(result))
+        for file, result in zip(upload.files, results)
+    ]
+    job_ids = [status.job_id for status in files if status.success]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        if not isinstance(error, ClientError):
+            print(f"Error uploading knowledge file: {error!r}")
+    if errors:
+        return KnowledgeUpdateResponse(
+            success=False,
+            message=f"Failed to upload {len(errors)} of {len(files)} files: {errors[0]}",
+            job_ids=job_ids,
+            files=files,
+        )
     return KnowledgeUpdateResponse(
         success=True,
         message="Knowledge base updated successfully.",
-        job_ids=job_ids
+        job_ids=job_ids,
+        files=files,
     )
+
+
+@app.post("/knowledge/uploads", response_model=KnowledgePresignResponse)
+async def presign_knowledge_upload(data: KnowledgePresignRequest) -> KnowledgePresignResponse:
+    """
+    Endpoint to start a direct-to-S3 multipart upload, so the file bytes never pass through the API.
+    The client PUTs each part to its presigned URL, then calls /knowledge/uploads/complete with the ETags.
+    :param data: The name and size of the file to upload.
+    :return: The object key, the upload ID and a presigned URL per part.
+    """
+    if not data.filename.endswith(SUPPORTED_EXTENSIONS):
+        return KnowledgePresignResponse(
+            success=False,
+            message="Unsupported file type. Only PDF, TXT, and MD files are allowed."
+        )
+    if data.size > env.UPLOAD_MAX_FILE_SIZE * 1024 * 1024:
+        return KnowledgePresignResponse(
+            success=False,
+            message=f"File {data.filename} exceeds the maximum size of {env.UPLOAD_MAX_FILE_SIZE} MB."
+        )
+    part_size = max(env.S3_MULTIPART_CHUNK_SIZE * 1024 * 1024, -(-data.size // MAX_UPLOAD_PARTS))
+    key = _knowledge_key(data.filename)
+    s3_client = S3Client()
+    try:
+        upload_id = await asyncio.to_thread(s3_client.create_multipart_upload, key)
+    except ClientError as e:
+        return KnowledgePresignResponse(
+            success=False,
+            message=f"Failed to start the upload to S3: {e}"
+        )
+    parts = [
+        KnowledgePresignedPart(
+            part_number=part_number,
+            url=s3_client.presign_upload_part(key, upload_id, part_number, env.S3_PRESIGNED_URL_EXPIRES),
+        )
+        for part_number in range(1, -(-data.size // part_size) + 1)
+    ]
+    return KnowledgePresignResponse(
+        success=True,
+        key=key,
+        upload_id=upload_id,
+        part_size=part_size,
+        parts=parts,
+    )
+
+
+@app.post("/knowledge/uploads/complete", response_model=KnowledgeUpdateResponse)
+async def complete_knowledge_upload(data: KnowledgeCompleteRequest) -> KnowledgeUpdateResponse:
+    """
+    Endpoint to complete a direct-to-S3 multipart upload and enqueue the ingestion of the object.
+    :param data: The object key, the upload ID and the ETag of each uploaded part.
+    :return: A confirmation message with the ingestion job ID.
+    """
+    if not data.key.startswith(KNOWLEDGE_PREFIX) or ".." in data.key:
+        return KnowledgeUpdateResponse(
+            success=False,
+            message=f"Invalid key. Uploads must be under the {KNOWLEDGE_PREFIX} prefix."
+        )
+    s3_client = S3Client()
+    try:
+        await asyncio.to_thread(
+            s3_client.complete_multipart_upload,
+            data.key,
+            data.upload_id,
+            [{"PartNumber": part.part_number, "ETag": part.etag} for part in data.parts],
+        )
+        size = await asyncio.to_thread(s3_client.get_object_size, data.key)
+    except ClientError as e:
+        return KnowledgeUpdateResponse(
+            success=False,
+            message=f"Failed to complete the upload to S3: {e}"
+        )
+    if size is None:
+        return KnowledgeUpdateResponse(
+            success=False,
+            message=f"Object {data.key} not found."
+        )
+    # The presigned request only declared the size and name, so the stored object is checked again
+    if not data.key.endswith(SUPPORTED_EXTENSIONS) or size > env.UPLOAD_MAX_FILE_SIZE * 1024 * 1024:
+        await asyncio.to_thread(s3_client.delete_object, data.key)
+        return KnowledgeUpdateResponse(
+            success=False,
+            message=f"Object {data.key} must be one of {', '.join(SUPPORTED_EXTENSIONS)} "
+                    f"and at most {env.UPLOAD_MAX_FILE_SIZE} MB."
+        )
+    job_id = await aupload_knowledge_base(key=data.key, size=size)
+    return KnowledgeUpdateResponse(
+        success=True,
+        message="Knowledge base updated successfully.",
+        job_ids=[job_id]
+    )
+
+
+@app.get("/knowledge/jobs/{job_id}", response_model=IngestionJobStatusResponse)
+async def knowledge_job_status(job_id: str) -> IngestionJobStatusResponse:
+    """
+    Endpoint to get the progress of an ingestion job: its stage, chunks processed, throughput,
+    and the time, LLM tokens and queue wait recorded per stage.
+    :param job_id: The job ID returned by the upload endpoints.
+    :return: The job status.
+    """
+    status = await aget_job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return IngestionJobStatusResponse(**status)
@@ -1,8 +1,26 @@
 from .api_rest_schema import (
     KnowledgeUploadSchema,
+    KnowledgeFileStatus,
     KnowledgeUpdateResponse,
+    KnowledgePresignRequest,
+    KnowledgePresignedPart,
+    KnowledgePresignResponse,
+    KnowledgeUploadedPart,
+    KnowledgeCompleteRequest,
     AgentGraphRAGResponse,
     AgentGraphRAGRequest,
+    AgentGraphRAGBatchRequest,
+    AgentGraphRAGBatchResult,
+    LLMUsageMetricsResponse,
+    IngestionJobStatusResponse,
+    IngestionMetricsResponse,
 )
-from .agent_schema import AgentGraphSubquery, AgentGraphRoute, AgentGraphStart
-from .document_schema import LegalDocumentMetadata
\ No newline at end of file
+from .agent_schema import (
+    AgentGraphSubquery,
+    AgentGraphRoute,
+    AgentGraphStart,
+    AgentGraphGlobalPoint,
+    AgentGraphGlobalPoints,
+)
+from .document_schema import LegalDocumentMetadata, LegalTriple, LegalChunkExtraction, CommunitySummary
+from .graph_schema import NODE_LABELS, RELATIONSHIP_TYPES
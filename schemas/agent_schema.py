@@ -15,6 +15,7 @@ class AgentGraphRoute(BaseModel):
     route: Literal[
         "search_graph",
         "search_vector",
+        "search_global",
         "answer_final"
     ] = Field(
         default="",
@@ -31,4 +32,24 @@ class AgentGraphStart(BaseModel):
         default="needs_search",
         title="Route",
         description="Determines if the question needs further search or can be answered directly."
-    )
\ No newline at end of file
+    )
+
+class AgentGraphGlobalPoint(BaseModel):
+    description: str = Field(
+        ...,
+        title="Description",
+        description="A key point from the community summaries that helps answer the question."
+    )
+    score: int = Field(
+        default=0,
+        title="Score",
+        description="How important the point is to answer the question, from 0 (irrelevant) to 100.",
+    )
+
+
+class AgentGraphGlobalPoints(BaseModel):
+    points: list[AgentGraphGlobalPoint] = Field(
+        default_factory=list,
+        title="Points",
+        description="Key points relevant to the question. Empty if the summaries are not relevant.",
+    )
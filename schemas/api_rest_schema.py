@@ -1,22 +1,109 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from fastapi import UploadFile
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+# Largest latency budget accepted for a question, in seconds
+MAX_LATENCY_BUDGET: float = 300.0
 
 
 class KnowledgeUploadSchema(BaseModel):
     files: list[UploadFile]
 
 
+class KnowledgeFileStatus(BaseModel):
+    filename: str
+    success: bool
+    job_id: Optional[str] = None
+    message: Optional[str] = None
+
+
 class KnowledgeUpdateResponse(BaseModel):
     success: bool
     message: Optional[str] = None
     job_ids: list[str] = []
+    files: list[KnowledgeFileStatus] = []
+
+
+class KnowledgePresignRequest(BaseModel):
+    filename: str
+    size: int = Field(..., gt=0, description="Size of the file in bytes.")
+
+
+class KnowledgePresignedPart(BaseModel):
+    part_number: int
+    url: str
+
+
+class KnowledgePresignResponse(BaseModel):
+    success: bool
+    message: Optional[str] = None
+    key: Optional[str] = None
+    upload_id: Optional[str] = None
+    part_size: Optional[int] = None
+    parts: list[KnowledgePresignedPart] = []
+
+
+class KnowledgeUploadedPart(BaseModel):
+    part_number: int = Field(..., ge=1, le=10000)
+    etag: str
+
+
+class KnowledgeCompleteRequest(BaseModel):
+    key: str
+    upload_id: str
+    parts: list[KnowledgeUploadedPart] = Field(..., min_length=1)
 
 
 class AgentGraphRAGRequest(BaseModel):
     question: str
+    budget: Optional[float] = Field(
+        None, gt=0, le=MAX_LATENCY_BUDGET, description="Latency budget in seconds for answering the question."
+    )
 
 
 class AgentGraphRAGResponse(BaseModel):
     result: str
+
+
+class AgentGraphRAGBatchRequest(BaseModel):
+    questions: list[str] = Field(..., min_length=1, description="Questions to answer.")
+    concurrency: int = Field(4, ge=1, le=32, description="Maximum number of questions answered at once.")
+    budget: Optional[float] = Field(
+        None, gt=0, le=MAX_LATENCY_BUDGET, description="Latency budget in seconds for answering each question."
+    )
+
+
+class AgentGraphRAGBatchResult(BaseModel):
+    index: int
+    question: str
+    chat_id: str
+    result: Optional[str] = None
+    error: Optional[str] = None
+
+
+class LLMUsageMetricsResponse(BaseModel):
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+
+class IngestionJobStatusResponse(BaseModel):
+    job_id: str
+    key: str
+    status: Literal["queued", "running", "done", "failed"]
+    stage: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    total_chunks: Optional[int] = None
+    processed_chunks: float = 0
+    elapsed_seconds: Optional[float] = None
+    chunks_per_second: Optional[float] = None
+    metrics: dict[str, float] = {}
+
+
+class IngestionMetricsResponse(BaseModel):
+    stages: dict[str, int] = {}
+    totals: dict[str, float] = {}
+    seconds_per_chunk: dict[str, float] = {}
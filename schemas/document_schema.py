@@ -46,3 +46,22 @@ class LegalDocumentMetadata(BaseModel):
     decision: Optional[str] = Field(None, description="Decision content")
     case_value: Optional[str] = Field(None, description="Value attributed to the case")
     attorney_fees: Optional[str] = Field(None, description="Agreed or court-appointed attorney fees")
+
+
+class LegalTriple(BaseModel):
+    head: str = Field(..., description="Text of the head entity")
+    head_type: str = Field(..., description="Type of the head entity")
+    relation: str = Field(..., description="Type of the relation between head and tail")
+    tail: str = Field(..., description="Text of the tail entity")
+    tail_type: str = Field(..., description="Type of the tail entity")
+
+
+class LegalChunkExtraction(BaseModel):
+    triples: list[LegalTriple] = Field(default_factory=list, description="Legal entities and relations in the text")
+    metadata: LegalDocumentMetadata = Field(
+        default_factory=LegalDocumentMetadata, description="Legal document fields found in the text")
+
+
+class CommunitySummary(BaseModel):
+    title: str = Field(..., description="Short title naming the main entities of the community")
+    summary: str = Field(..., description="Summary of the entities, their relationships and the main legal theses")
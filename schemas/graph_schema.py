@@ -0,0 +1,37 @@
+# Node labels allowed in the legal knowledge graph
+NODE_LABELS: list[str] = [
+    "Person",
+    "Organization",
+    "Court",
+    "Legal_Case",
+    "Legal_Action",
+    "Legal_Document",
+    "Law",
+    "Law_Article",
+    "Legal_Concept",
+    "Evidence",
+    "Event",
+    "Location",
+    "Contract",
+    "Penalty",
+    "Appeal",
+]
+
+# Relationship types allowed in the legal knowledge graph
+RELATIONSHIP_TYPES: list[str] = [
+    "PARTY_TO",
+    "REPRESENTS",
+    "EMPLOYED_BY",
+    "HANDLED_BY",
+    "LOCATED_IN",
+    "REFERS_TO",
+    "EVIDENCE_IN",
+    "DOCUMENT_OF",
+    "HAS_ACTION",
+    "HELD_ON",
+    "RELATED_TO",
+    "DECIDED_BY",
+    "APPEALED_TO",
+    "RESULTS_IN",
+    "CITES",
+]
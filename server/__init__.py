@@ -1 +1,2 @@
-from .socketio_manager import SocketManager
\ No newline at end of file
+from .socketio_manager import SocketManager
+from .event_stream import EventStreamEmitter
\ No newline at end of file
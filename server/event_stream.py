@@ -0,0 +1,71 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable
+
+from fastapi import Request
+from loguru import logger
+
+# Seconds between keep-alive comments while the agent is working
+KEEPALIVE_INTERVAL = 15
+
+
+class EventStreamEmitter:
+    """
+    Collects agent events and serves them as Server-Sent Events.
+    Exposes the same ``emit`` coroutine as SocketManager so it can be handed to the agent instead.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def emit(self, event: str, data: Any, **kwargs) -> None:
+        """
+        Queue an event to be sent to the client.
+        :param event: The event name.
+        :param data: The JSON serializable event data.
+        """
+        await self._queue.put((event, data))
+
+    @staticmethod
+    def format(event: str, data: Any) -> str:
+        """
+        Format an event as a Server-Sent Events message.
+        :param event: The event name.
+        :param data: The JSON serializable event data.
+        :return: The formatted message.
+        """
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream(self, run: Awaitable[str], request: Request) -> AsyncIterator[str]:
+        """
+        Run the agent and stream its events, ending with the final response or an error.
+        The agent run is cancelled as soon as the client disconnects.
+        :param run: The agent invocation to run.
+        :param request: The HTTP request, used to detect client disconnects.
+        :return: An async iterator of Server-Sent Events messages.
+        """
+        task = asyncio.ensure_future(run)
+        # Wake the consumer up once the run is over
+        task.add_done_callback(lambda _: self._queue.put_nowait(None))
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        logger.info("Event stream client disconnected, cancelling agent run")
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield self.format(*item)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                logger.error(f"Agent run failed: {task.exception()}")
+                yield self.format("error", {"message": str(task.exception())})
+                return
+            yield self.format("agent_response", {"result": task.result()})
+        finally:
+            task.cancel()
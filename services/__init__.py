@@ -1 +1,3 @@
-from .s3_client import S3Client
\ No newline at end of file
+from .s3_client import S3Client
+from .neo4j_indexes import provision_graph, ENTITY_INDEX_NAME, DOCUMENT_INDEX_NAME
+from .mongo_client import get_database, DocumentMetadataStore
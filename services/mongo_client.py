@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from config import env
+
+_client: Optional[MongoClient] = None
+
+
+def get_database() -> Database:
+    """
+    Get the MongoDB database, sharing one client per process.
+    :return: The MongoDB database.
+    """
+    global _client
+    if _client is None:
+        _client = MongoClient(env.MONGO_URI)
+    return _client[env.MONGO_DB_NAME]
+
+
+class DocumentMetadataStore:
+    COLLECTION_NAME: str = "documents"
+
+    def __init__(self):
+        """
+        Store the metadata of each ingested document once, instead of in every chunk payload.
+        """
+        self._collection = get_database()[self.COLLECTION_NAME]
+
+    def save(self, document_id: str, **fields: Any) -> None:
+        """
+        Create or replace the record of a document.
+        :param document_id: The document ID, shared by all its chunks.
+        :param fields: The document fields, e.g. source, document_hash and metadata.
+        """
+        self._collection.replace_one(
+            {"_id": document_id},
+            {**fields, "updated_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+
+    def get_many(self, document_ids: list[str]) -> dict[str, dict[str, Any]]:
+        """
+        Get the records of the documents.
+        :param document_ids: The document IDs.
+        :return: A mapping from document ID to its record, for the documents found.
+        """
+        return {item["_id"]: item for item in self._collection.find({"_id": {"$in": list(set(document_ids))}})}
@@ -0,0 +1,80 @@
+from threading import Lock
+
+from langchain_neo4j import Neo4jGraph
+from neo4j.exceptions import Neo4jError
+
+from schemas import NODE_LABELS
+
+# Full-text index over entity names, used for entity linking and by generated Cypher
+ENTITY_INDEX_NAME = "entity_ids"
+# Full-text index over the text of source documents
+DOCUMENT_INDEX_NAME = "document_text"
+
+_provisioned = False
+_lock = Lock()
+
+
+def _labels() -> list[str]:
+    """
+    Get the node labels to index, including the capitalized form written by the graph transformer.
+    :return: The distinct node labels.
+    """
+    labels = ["__Entity__", "Document"]
+    for label in NODE_LABELS:
+        labels.extend([label, label.capitalize()])
+    return list(dict.fromkeys(labels))
+
+
+def graph_schema_statements() -> list[tuple[str, str]]:
+    """
+    Build the statements that provision the constraints and indexes of the graph.
+    :return: A list of (constraint, fallback index) statement pairs; the fallback is used when
+        the constraint cannot be created because of existing duplicates.
+    """
+    statements: list[tuple[str, str]] = []
+    for label in _labels():
+        # Names keep the case of the label: Legal_Case and Legal_case need distinct constraints,
+        # and IF NOT EXISTS would silently skip the second one under a shared name
+        name = label.strip("_")
+        statements.append((
+            f"CREATE CONSTRAINT {name}_id_unique IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.id IS UNIQUE",
+            f"CREATE RANGE INDEX {name}_id IF NOT EXISTS FOR (n:`{label}`) ON (n.id)",
+        ))
+    statements.append((
+        "CREATE RANGE INDEX community_version IF NOT EXISTS FOR (n:__Community__) ON (n.version)",
+        "",
+    ))
+    statements.append((
+        f"CREATE FULLTEXT INDEX {ENTITY_INDEX_NAME} IF NOT EXISTS FOR (n:__Entity__) ON EACH [n.id]",
+        "",
+    ))
+    statements.append((
+        f"CREATE FULLTEXT INDEX {DOCUMENT_INDEX_NAME} IF NOT EXISTS FOR (n:Document) ON EACH [n.text]",
+        "",
+    ))
+    return statements
+
+
+def provision_graph(graph: Neo4jGraph, force: bool = False) -> None:
+    """
+    Create the uniqueness constraints, range indexes and full-text indexes used by ingestion and search.
+    Runs once per process unless forced; every statement is idempotent.
+    :param graph: The Neo4j graph.
+    :param force: Run the statements even if the graph was already provisioned by this process.
+    """
+    global _provisioned
+    with _lock:
+        if _provisioned and not force:
+            return
+        for statement, fallback in graph_schema_statements():
+            try:
+                graph.query(statement)
+            except Neo4jError as e:
+                if not fallback:
+                    raise
+                print(f"Could not create constraint, falling back to an index: {e}")
+                try:
+                    graph.query(fallback)
+                except Neo4jError as e_:
+                    print(f"Could not create index: {e_}")
+        _provisioned = True
@@ -1,6 +1,13 @@
+import hashlib
+from typing import BinaryIO, Optional
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from config import env
 
+MB = 1024 * 1024
+
 
 class S3Client:
     def __init__(self, bucket_name: str = env.S3_BUCKET_NAME):
@@ -10,7 +17,7 @@ class S3Client:
             aws_secret_access_key=env.AWS_SECRET_ACCESS_KEY,
             region_name=env.AWS_REGION,
         )
-        self._client = self._session.client('s3')
+        self._client = self._session.client('s3', endpoint_url=env.S3_ENDPOINT_URL or None)
 
     def upload_file(self, file_path: str, object_name: str) -> None:
         """
@@ -24,6 +31,86 @@ class S3Client:
         except Exception as e:
             print(f"Error uploading file: {e}")
 
+    def upload_fileobj(self, fileobj: BinaryIO, object_name: str) -> None:
+        """
+        Stream a file object to the S3 bucket, using a multipart upload for large files,
+        so the file is never held in memory at once.
+        :param fileobj: The readable binary file object.
+        :param object_name: The name of the object in the S3 bucket.
+        :raises botocore.exceptions.ClientError: If the upload fails.
+        """
+        config = TransferConfig(
+            multipart_threshold=env.S3_MULTIPART_CHUNK_SIZE * MB,
+            multipart_chunksize=env.S3_MULTIPART_CHUNK_SIZE * MB,
+            max_concurrency=env.S3_MULTIPART_CONCURRENCY,
+        )
+        self._client.upload_fileobj(fileobj, self._bucket_name, object_name, Config=config)
+        print(f"File uploaded to {self._bucket_name}/{object_name}.")
+
+    def create_multipart_upload(self, object_name: str) -> str:
+        """
+        Start a multipart upload that the client sends directly to S3.
+        :param object_name: The name of the object in the S3 bucket.
+        :return: The upload ID.
+        """
+        return self._client.create_multipart_upload(Bucket=self._bucket_name, Key=object_name)["UploadId"]
+
+    def presign_upload_part(self, object_name: str, upload_id: str, part_number: int, expires_in: int) -> str:
+        """
+        Create a presigned URL to PUT a part of a multipart upload.
+        :param object_name: The name of the object in the S3 bucket.
+        :param upload_id: The upload ID.
+        :param part_number: The part number, starting at 1.
+        :param expires_in: The seconds the URL stays valid.
+        :return: The presigned URL.
+        """
+        return self._client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": self._bucket_name,
+                "Key": object_name,
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            },
+            ExpiresIn=expires_in,
+        )
+
+    def complete_multipart_upload(self, object_name: str, upload_id: str, parts: list[dict]) -> None:
+        """
+        Assemble the uploaded parts into the object.
+        :param object_name: The name of the object in the S3 bucket.
+        :param upload_id: The upload ID.
+        :param parts: The parts, as dicts with PartNumber and ETag.
+        :raises botocore.exceptions.ClientError: If the upload cannot be completed.
+        """
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket_name,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])},
+        )
+
+    def get_object_size(self, object_name: str) -> Optional[int]:
+        """
+        Get the size of an object in the S3 bucket.
+        :param object_name: The name of the object in the S3 bucket.
+        :return: The size in bytes, or None if the object does not exist.
+        """
+        try:
+            return self._client.head_object(Bucket=self._bucket_name, Key=object_name)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def download_file(self, key: str, file_path: str) -> None:
+        """
+        Download an object from the S3 bucket to a local file.
+        :param key: The key of the object.
+        :param file_path: The local path to write to.
+        """
+        self._client.download_file(self._bucket_name, key, file_path)
+
     def delete_object(self, file_path: str) -> None:
         """
         Delete a file from the S3 bucket.
@@ -35,6 +122,19 @@ class S3Client:
         except Exception as e:
             print(f"Error deleting file: {e}")
 
+    def calc_object_hash(self, key: str, chunk_size: int = 1024 * 1024) -> str:
+        """
+        Calculate the SHA-256 of an object, streaming its body.
+        :param key: The key of the object.
+        :param chunk_size: The size of the chunks read from the body.
+        :return: The hex digest of the object contents.
+        """
+        body = self._client.get_object(Bucket=self._bucket_name, Key=key)["Body"]
+        digest = hashlib.sha256()
+        for chunk in body.iter_chunks(chunk_size):
+            digest.update(chunk)
+        return digest.hexdigest()
+
     @property
     def bucket_name(self) -> str:
         """
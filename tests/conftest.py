@@ -28,6 +28,15 @@ def mock_aupload_knowledge_base():
     """
     Mock the aupload_knowledge_base function.
     """
-    with patch("workers.tasks.aupload_knowledge_base", new_callable=AsyncMock) as mock:
+    with patch("main.aupload_knowledge_base", new_callable=AsyncMock) as mock:
         mock.return_value = "test-job-id"
-        yield mock
\ No newline at end of file
+        yield mock
+
+
+@pytest.fixture
+def mock_s3_client():
+    """
+    Mock the S3 client used by the upload endpoints.
+    """
+    with patch("main.S3Client") as mock:
+        yield mock.return_value
\ No newline at end of file
@@ -1,5 +1,13 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
 from fastapi.testclient import TestClient
 
+import main
+from config import env
+
 
 def test_root_endpoint(test_client: TestClient):
     """
@@ -21,7 +29,110 @@ def test_chat_endpoint(test_client: TestClient, mock_agent_invoke):
     
     assert response.status_code == 200
     assert response.json() == {"result": "This is a test response"}
-    mock_agent_invoke.assert_called_once_with("What is GraphRAG?")
+    mock_agent_invoke.assert_called_once_with("What is GraphRAG?", budget=None)
+
+
+def test_chat_endpoint_with_budget(test_client: TestClient, mock_agent_invoke):
+    """
+    Test the chat endpoint forwards the latency budget to the agent.
+    """
+    request_data = {"question": "What is GraphRAG?", "budget": 12.5}
+
+    response = test_client.post("/chat/test-chat-id", json=request_data)
+
+    assert response.status_code == 200
+    mock_agent_invoke.assert_called_once_with("What is GraphRAG?", budget=12.5)
+
+
+def test_chat_endpoint_invalid_budget(test_client: TestClient, mock_agent_invoke):
+    """
+    Test the chat endpoint rejects a non-positive latency budget.
+    """
+    response = test_client.post("/chat/test-chat-id", json={"question": "What is GraphRAG?", "budget": 0})
+
+    assert response.status_code == 422
+    mock_agent_invoke.assert_not_called()
+
+
+@pytest.mark.parametrize("budget", ["fast", 0, -5, 10_000])
+def test_invoke_agent_socket_invalid_budget(budget):
+    """
+    Test the socket handler rejects a budget the HTTP endpoint would reject, with an error event.
+    """
+    with patch("main.AgentGraphRAGBedRock") as agent, patch("main.sio") as sio:
+        sio.emit = AsyncMock()
+        asyncio.run(main.invoke_agent("sid", {"chat_id": "test-chat-id", "question": "Q?", "budget": budget}))
+
+    agent.assert_not_called()
+    assert sio.emit.call_args.args[0] == "error"
+    assert "budget" in sio.emit.call_args.args[1]["message"]
+
+
+def test_invoke_agent_socket_budget():
+    """
+    Test the socket handler forwards a valid budget to the agent.
+    """
+    with patch("main.AgentGraphRAGBedRock") as agent, patch("main.sio") as sio:
+        sio.emit = AsyncMock()
+        agent.return_value.invoke = AsyncMock(return_value="This is a test response")
+        asyncio.run(main.invoke_agent("sid", {"chat_id": "test-chat-id", "question": "Q?", "budget": 12.5}))
+
+    agent.return_value.invoke.assert_called_once_with("Q?", budget=12.5)
+    assert sio.emit.call_args.args[0] == "agent_response"
+
+
+def test_chat_stream_endpoint(test_client: TestClient, mock_agent_invoke):
+    """
+    Test the Server-Sent Events chat endpoint ends with the agent response.
+    """
+    response = test_client.post("/chat/test-chat-id/stream", json={"question": "What is GraphRAG?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert 'event: agent_response\ndata: {"result": "This is a test response"}' in response.text
+    mock_agent_invoke.assert_called_once_with("What is GraphRAG?", budget=None)
+
+
+def test_chat_batch_endpoint(test_client: TestClient, mock_agent_invoke):
+    """
+    Test the batch chat endpoint answers duplicated questions once and streams every result.
+    """
+    request_data = {"questions": ["Who are the parties?", "What was decided?", "Who are the parties?"]}
+
+    response = test_client.post("/chat/batch", json=request_data)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    assert all(r["result"] == "This is a test response" for r in results)
+    assert mock_agent_invoke.call_count == 2
+
+
+def test_chat_batch_endpoint_no_questions(test_client: TestClient, mock_agent_invoke):
+    """
+    Test the batch chat endpoint rejects an empty batch.
+    """
+    response = test_client.post("/chat/batch", json={"questions": []})
+
+    assert response.status_code == 422
+    mock_agent_invoke.assert_not_called()
+
+
+def test_llm_metrics_endpoint(test_client: TestClient):
+    """
+    Test the LLM metrics endpoint exposes the prompt-cache counters.
+    """
+    response = test_client.get("/metrics/llm")
+
+    assert response.status_code == 200
+    assert {
+        "calls",
+        "input_tokens",
+        "output_tokens",
+        "cache_read_input_tokens",
+        "cache_creation_input_tokens",
+    } <= set(response.json())
 
 
 def test_knowledge_update_no_files(test_client: TestClient):
@@ -34,7 +145,8 @@ def test_knowledge_update_no_files(test_client: TestClient):
     assert response.json() == {
         "success": False,
         "message": "No files uploaded.",
-        "job_ids": []
+        "job_ids": [],
+        "files": [],
     }
 
 
@@ -50,11 +162,27 @@ def test_knowledge_update_unsupported_file_type(test_client: TestClient):
     assert response.json() == {
         "success": False,
         "message": "Unsupported file type. Only PDF, TXT, and MD files are allowed.",
-        "job_ids": []
+        "job_ids": [],
+        "files": [],
     }
 
 
-def test_knowledge_update_success(test_client: TestClient, mock_aupload_knowledge_base):
+def test_knowledge_update_file_too_large(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
+    """
+    Test the knowledge update endpoint rejects files above the size limit before uploading anything.
+    """
+    files = {"files": ("test.pdf", b"test content", "application/pdf")}
+
+    with patch.object(env, "UPLOAD_MAX_FILE_SIZE", 0):
+        response = test_client.post("/knowledge/update", files=files)
+
+    assert response.status_code == 200
+    assert response.json()["success"] is False
+    mock_s3_client.upload_fileobj.assert_not_called()
+    mock_aupload_knowledge_base.assert_not_called()
+
+
+def test_knowledge_update_success(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
     """
     Test the knowledge update endpoint with a valid file.
     """
@@ -66,6 +194,138 @@ def test_knowledge_update_success(test_client: TestClient, mock_aupload_knowledg
     assert response.json() == {
         "success": True,
         "message": "Knowledge base updated successfully.",
-        "job_ids": ["test-job-id"]
+        "job_ids": ["test-job-id"],
+        "files": [{"filename": "test.pdf", "success": True, "job_id": "test-job-id", "message": None}],
     }
-    mock_aupload_knowledge_base.assert_called_once()
\ No newline at end of file
+    mock_s3_client.upload_fileobj.assert_called_once()
+    mock_aupload_knowledge_base.assert_called_once()
+
+
+def test_knowledge_update_partial_failure(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
+    """
+    Test a file that fails after its upload is deleted from S3 and reported, while the others are enqueued.
+    """
+    def _enqueue(key: str, size: int) -> str:
+        if "second" in key:
+            raise RuntimeError("broker unavailable")
+        return "test-job-id"
+
+    mock_aupload_knowledge_base.side_effect = _enqueue
+    files = [
+        ("files", ("first.pdf", b"test content", "application/pdf")),
+        ("files", ("second.pdf", b"test content", "application/pdf")),
+    ]
+
+    response = test_client.post("/knowledge/update", files=files)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is False
+    assert data["job_ids"] == ["test-job-id"]
+    assert [(f["filename"], f["success"], f["message"]) for f in data["files"]] == [
+        ("first.pdf", True, None),
+        ("second.pdf", False, "broker unavailable"),
+    ]
+    deleted = mock_s3_client.delete_object.call_args.args[0]
+    assert deleted.startswith("knowledge/second.pdf")
+    mock_s3_client.delete_object.assert_called_once()
+
+
+def test_knowledge_presigned_upload(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
+    """
+    Test the presigned upload flow: a URL per part, then completion enqueues the ingestion.
+    """
+    mock_s3_client.create_multipart_upload.return_value = "test-upload-id"
+    mock_s3_client.presign_upload_part.return_value = "https://s3.local/part"
+    mock_s3_client.get_object_size.return_value = 12 * 1024 * 1024
+
+    with patch.object(env, "S3_MULTIPART_CHUNK_SIZE", 5):
+        response = test_client.post("/knowledge/uploads", json={"filename": "test.pdf", "size": 12 * 1024 * 1024})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["key"].startswith("knowledge/")
+    assert [part["part_number"] for part in data["parts"]] == [1, 2, 3]
+
+    response = test_client.post("/knowledge/uploads/complete", json={
+        "key": data["key"],
+        "upload_id": data["upload_id"],
+        "parts": [{"part_number": part["part_number"], "etag": "etag"} for part in data["parts"]],
+    })
+
+    assert response.status_code == 200
+    assert response.json()["job_ids"] == ["test-job-id"]
+    mock_s3_client.complete_multipart_upload.assert_called_once()
+    mock_aupload_knowledge_base.assert_called_once_with(key=data["key"], size=12 * 1024 * 1024)
+
+
+def test_knowledge_complete_upload_outside_prefix(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
+    """
+    Test the completion endpoint refuses keys outside the knowledge/ prefix.
+    """
+    response = test_client.post("/knowledge/uploads/complete", json={
+        "key": "other/test.pdf",
+        "upload_id": "test-upload-id",
+        "parts": [{"part_number": 1, "etag": "etag"}],
+    })
+
+    assert response.status_code == 200
+    assert response.json()["success"] is False
+    mock_s3_client.complete_multipart_upload.assert_not_called()
+    mock_aupload_knowledge_base.assert_not_called()
+
+
+def test_knowledge_complete_upload_invalid_object(test_client: TestClient, mock_s3_client, mock_aupload_knowledge_base):
+    """
+    Test the completion endpoint deletes, without ingesting, objects larger than the declared limit
+    or with an unsupported extension.
+    """
+    for key, size in (("knowledge/test.pdf", 300 * 1024 * 1024), ("knowledge/test.exe", 1024)):
+        mock_s3_client.get_object_size.return_value = size
+        mock_s3_client.delete_object.reset_mock()
+
+        with patch.object(env, "UPLOAD_MAX_FILE_SIZE", 200):
+            response = test_client.post("/knowledge/uploads/complete", json={
+                "key": key,
+                "upload_id": "test-upload-id",
+                "parts": [{"part_number": 1, "etag": "etag"}],
+            })
+
+        assert response.status_code == 200
+        assert response.json()["success"] is False
+        mock_s3_client.delete_object.assert_called_once_with(key)
+    mock_aupload_knowledge_base.assert_not_called()
+
+
+def test_knowledge_job_status(test_client: TestClient):
+    """
+    Test the job status endpoint reports the progress of a running job.
+    """
+    status = {
+        "job_id": "test-job-id",
+        "key": "knowledge/test.pdf",
+        "status": "running",
+        "stage": "split",
+        "total_chunks": 100,
+        "processed_chunks": 50,
+        "elapsed_seconds": 10.0,
+        "chunks_per_second": 5.0,
+        "metrics": {"extract_seconds": 8.0, "input_tokens": 1000},
+    }
+    with patch("main.aget_job_status", new_callable=AsyncMock, return_value=status):
+        response = test_client.get("/knowledge/jobs/test-job-id")
+
+    assert response.status_code == 200
+    assert response.json()["processed_chunks"] == 50
+    assert response.json()["metrics"]["extract_seconds"] == 8.0
+
+
+def test_knowledge_job_status_not_found(test_client: TestClient):
+    """
+    Test the job status endpoint returns 404 for unknown jobs.
+    """
+    with patch("main.aget_job_status", new_callable=AsyncMock, return_value=None):
+        response = test_client.get("/knowledge/jobs/unknown")
+
+    assert response.status_code == 404
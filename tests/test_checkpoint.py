@@ -0,0 +1,39 @@
+from unittest.mock import MagicMock, patch
+
+from workers import checkpoint as checkpoint_module
+from workers.checkpoint import IngestionCheckpoint
+
+
+def test_chunk_rows_are_scoped_to_the_job():
+    """
+    Test two jobs of the same file write the same chunk ID to different rows, keeping the chunk ID as a field.
+    """
+    database = MagicMock()
+    database.__getitem__.return_value.find_one.return_value = None
+
+    with patch("workers.checkpoint.get_database", return_value=database):
+        for key in ("knowledge/a.pdf", "knowledge/b.pdf"):
+            IngestionCheckpoint(key).save_chunks({"chunk-1": {"index": 0, "text": "text"}})
+
+    chunks = database[IngestionCheckpoint.CHUNKS_COLLECTION_NAME]
+    updates = [call.args[0][0] for call in chunks.bulk_write.call_args_list]
+    assert [update._filter for update in updates] == [
+        {"_id": "knowledge/a.pdf:chunk-1"},
+        {"_id": "knowledge/b.pdf:chunk-1"},
+    ]
+    assert all(update._doc["$set"]["chunk_id"] == "chunk-1" for update in updates)
+
+
+def test_indexes_are_created_once():
+    """
+    Test the indexes are created on the first call only, and not when a checkpoint is loaded.
+    """
+    database = MagicMock()
+
+    with patch("workers.checkpoint.get_database", return_value=database), \
+            patch.object(checkpoint_module, "_indexed", False):
+        IngestionCheckpoint.create_indexes()
+        IngestionCheckpoint.create_indexes()
+        IngestionCheckpoint("knowledge/a.pdf")
+
+    assert database.__getitem__.return_value.create_index.call_count == 5
@@ -0,0 +1,21 @@
+import pytest
+
+from core.cypher import enforce_limits
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("MATCH (a)-[*]->(b) RETURN b", "MATCH (a)-[*1..3]->(b) RETURN b\nLIMIT 100"),
+    ("MATCH (a)-[r:CITES*2..10]->(b) RETURN b", "MATCH (a)-[r:CITES*2..3]->(b) RETURN b\nLIMIT 100"),
+    ("MATCH (a)<-[*..9 {x: 1}]-(b) RETURN b", "MATCH (a)<-[*1..3 {x: 1}]-(b) RETURN b\nLIMIT 100"),
+    ("MATCH (a)-[*5]-(b) RETURN a", "MATCH (a)-[*3]-(b) RETURN a\nLIMIT 100"),
+    ("MATCH (n) RETURN [x IN n.vals | x*10]", "MATCH (n) RETURN [x IN n.vals | x*10]\nLIMIT 100"),
+    ("MATCH (n) RETURN n LIMIT 500", "MATCH (n) RETURN n LIMIT 100"),
+    ("MATCH (n) RETURN n LIMIT 5;", "MATCH (n) RETURN n LIMIT 5;"),
+    ("MATCH (n) RETURN n LIMIT $k", "MATCH (n) RETURN n LIMIT $k"),
+    ("MATCH (n) RETURN n LIMIT 5 // top five", "MATCH (n) RETURN n LIMIT 5 // top five"),
+])
+def test_enforce_limits(query: str, expected: str):
+    """
+    Test hop bounds are only applied to relationship patterns and any trailing LIMIT is recognized.
+    """
+    assert enforce_limits(query, max_rows=100, max_hops=3) == expected
@@ -0,0 +1,51 @@
+import pytest
+
+from workers.entities import identifier_key, normalize_identifiers, normalize_key
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Processo 1020304-55.2023.8.26.0100", "Processo 1020304-55.2023.8.26.0100"),
+    ("Processo 10203045520238260100", "Processo 1020304-55.2023.8.26.0100"),
+    ("OAB/SP 123.456", "OAB/SP 123456"),
+    ("OAB-SP nº 123456", "OAB/SP 123456"),
+    ("123.456 OAB/SP", "OAB/SP 123456"),
+    ("CPF 12345678901", "CPF 123.456.789-01"),
+    ("CNPJ 12345678000195", "CNPJ 12.345.678/0001-95"),
+    ("Maria Silva", "Maria Silva"),
+])
+def test_normalize_identifiers(text: str, expected: str):
+    """
+    Test CNJ, OAB, CPF and CNPJ numbers are rewritten in their canonical punctuation.
+    """
+    assert normalize_identifiers(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Processo 1020304-55.2023.8.26.0100", "cnj:10203045520238260100"),
+    ("Processo 10203045520238260100", "cnj:10203045520238260100"),
+    ("OAB/SP 123.456", "oab:SP:123456"),
+    ("123.456 OAB/SP", "oab:SP:123456"),
+    ("123.456.789-01", "cpf:12345678901"),
+    ("12.345.678/0001-95", "cnpj:12345678000195"),
+    ("Maria Silva", None),
+])
+def test_identifier_key(text: str, expected):
+    """
+    Test variants of the same identifier share a key and names without one have none.
+    """
+    assert identifier_key(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Maria Silva", "maria silva"),
+    ("MARIA SILVA", "maria silva"),
+    ("Sra. Maria Silva", "maria silva"),
+    ("Dr. José Araújo", "jose araujo"),
+    ("Dr.", "dr"),
+    ("Processo 10203045520238260100", "cnj:10203045520238260100"),
+])
+def test_normalize_key(text: str, expected: str):
+    """
+    Test names are compared without case, accents, punctuation and honorifics, and identifiers win over names.
+    """
+    assert normalize_key(text) == expected
@@ -0,0 +1,24 @@
+from unittest.mock import MagicMock, patch
+
+from langchain_community.graphs.graph_document import GraphDocument
+from langchain_core.documents import Document
+
+from workers.graph_writer import DOCUMENTS_QUERY, GraphWriter
+
+
+def test_document_nodes_are_keyed_by_chunk_id():
+    """
+    Test Document nodes take the chunk ID, shared with the Qdrant point, so chunks with
+    the same text in different documents stay distinct.
+    """
+    batch = [
+        GraphDocument(nodes=[], relationships=[], source=Document(id=chunk_id, page_content="Same text."))
+        for chunk_id in ("chunk-a", "chunk-b")
+    ]
+    writer = GraphWriter(MagicMock(), max_sessions=1)
+
+    with patch.object(writer, "_run") as run:
+        writer._write(batch)
+
+    rows = next(call.args[1] for call in run.call_args_list if call.args[0] == DOCUMENTS_QUERY)
+    assert [row["id"] for row in rows] == ["chunk-a", "chunk-b"]
@@ -0,0 +1,106 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from langchain_community.graphs.graph_document import GraphDocument
+from langchain_core.documents import Document
+
+from schemas import LegalChunkExtraction, LegalTriple, NODE_LABELS, RELATIONSHIP_TYPES
+from workers.knowledge import KnowledgeService, LLMGraph
+
+
+def _llm_graph(function_call: bool) -> LLMGraph:
+    """
+    Build an LLMGraph with the strict-mode settings of the ingestion, without a language model.
+    """
+    llm_graph = LLMGraph.__new__(LLMGraph)
+    llm_graph.strict_mode = True
+    llm_graph.allowed_nodes = NODE_LABELS
+    llm_graph.allowed_relationships = RELATIONSHIP_TYPES
+    llm_graph._relationship_type = "string"
+    llm_graph._function_call = function_call
+    return llm_graph
+
+
+def test_to_graph_document_combined_extraction():
+    """
+    Test the triples of a combined extraction become formatted nodes and relationships,
+    with or without function calling, and that disallowed types are dropped.
+    """
+    extraction = LegalChunkExtraction(triples=[
+        LegalTriple(head="maria silva", head_type="Person", relation="PARTY_TO",
+                    tail="Processo 1020304-55.2023.8.26.0100", tail_type="Legal_Case"),
+        LegalTriple(head="maria silva", head_type="Person", relation="represents",
+                    tail="Souza & Associados", tail_type="Organization"),
+        LegalTriple(head="maria silva", head_type="Pet", relation="OWNS", tail="Rex", tail_type="Pet"),
+    ])
+    document = Document(page_content="chunk")
+
+    for function_call in (True, False):
+        graph_document = _llm_graph(function_call)._to_graph_document(extraction, document)
+
+        assert {(node.id, node.type) for node in graph_document.nodes} == {
+            ("Maria Silva", "Person"),
+            ("Processo 1020304-55.2023.8.26.0100", "Legal_case"),
+            ("Souza & Associados", "Organization"),
+        }
+        assert {(rel.source.id, rel.type, rel.target.id) for rel in graph_document.relationships} == {
+            ("Maria Silva", "PARTY_TO", "Processo 1020304-55.2023.8.26.0100"),
+            ("Maria Silva", "REPRESENTS", "Souza & Associados"),
+        }
+        assert graph_document.source is document
+
+
+def test_prepare_skips_same_text_with_different_bytes():
+    """
+    Test a file whose bytes are new but whose text was already ingested is completed as a duplicate
+    right after splitting, before any extraction.
+    """
+    service = KnowledgeService.__new__(KnowledgeService)
+    service._splitter = MagicMock(split_sections=lambda text, path: [(text, path)])
+    checkpoint = MagicMock(job={})
+    checkpoint.reached.return_value = False
+    checkpoint.find_ingested.side_effect = lambda **hashes: (
+        {"_id": "knowledge/original.pdf", "document_id": "original-id"} if "document_hash" in hashes else None
+    )
+
+    with patch("workers.knowledge.IngestionCheckpoint", return_value=checkpoint), \
+            patch("workers.knowledge.S3Client") as s3_client, \
+            patch.object(KnowledgeService, "_read_pages", return_value=iter(["page one", "page two"])):
+        s3_client.return_value.calc_object_hash.return_value = "new-file-hash"
+        windows = service.prepare("knowledge/resaved.pdf")
+
+    assert windows is None
+    checkpoint.complete.assert_called_once()
+    assert checkpoint.complete.call_args.kwargs["duplicate_of"] == "knowledge/original.pdf"
+    assert checkpoint.complete.call_args.kwargs["document_id"] == "original-id"
+    s3_client.return_value.delete_object.assert_called_once_with("knowledge/resaved.pdf")
+
+
+def test_aprocess_batch_result_callback_does_not_hold_a_slot():
+    """
+    Test the result callback is awaited without holding an extraction slot: with a single slot,
+    the callback of the first chunk can wait for the extraction of the second one.
+    """
+    llm_graph = _llm_graph(function_call=True)
+    documents = [Document(id="first", page_content="first"), Document(id="second", page_content="second")]
+    second_extracted = asyncio.Event()
+    handled: list[str] = []
+
+    async def _aextract_document(document, config=None):
+        if document.id == "second":
+            second_extracted.set()
+        return GraphDocument(nodes=[], relationships=[], source=document), {}
+
+    async def _on_result(graph_document, metadata):
+        if graph_document.source.id == "first":
+            await second_extracted.wait()
+        handled.append(graph_document.source.id)
+
+    llm_graph.aextract_document = _aextract_document
+    results = asyncio.run(asyncio.wait_for(
+        llm_graph.aprocess_batch(documents, max_concurrency=1, on_progress=lambda *_: None, on_result=_on_result),
+        timeout=5,
+    ))
+
+    assert [result.source.id for result in results] == ["first", "second"]
+    assert sorted(handled) == ["first", "second"]
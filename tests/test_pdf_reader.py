@@ -0,0 +1,72 @@
+import ctypes
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+import pytest
+
+from workers.pdf_reader import OCRBackend, PdfReader, has_text_layer
+
+PAGE_TEXT = "Art. 1 Esta lei entra em vigor na data de sua publicação."
+
+
+class RecordingOCR(OCRBackend):
+    def __init__(self):
+        """
+        OCR backend that records the images it receives and recognizes a fixed text.
+        """
+        self.images: list[bytes] = []
+
+    def ocr(self, image: bytes) -> str:
+        self.images.append(image)
+        return "scanned page"
+
+
+def _write_pdf(path: str, pages: list[str]) -> None:
+    """
+    Write a PDF with a text layer holding each given text, one page per text, an empty text making a blank page.
+    """
+    pdf = pdfium.PdfDocument.new()
+    for text in pages:
+        page = pdf.new_page(612, 792)
+        if text:
+            obj = pdfium_c.FPDFPageObj_NewTextObj(pdf.raw, b"Helvetica", 12.0)
+            buffer = ctypes.create_string_buffer((text + "\x00").encode("utf-16-le"))
+            pdfium_c.FPDFText_SetText(obj, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+            pdfium_c.FPDFPageObj_Transform(obj, 1, 0, 0, 1, 72, 700)
+            pdfium_c.FPDFPage_InsertObject(page.raw, obj)
+            pdfium_c.FPDFPage_GenerateContent(page.raw)
+    pdf.save(path)
+    pdf.close()
+
+
+def test_read_file_sends_only_blank_pages_to_ocr(tmp_path):
+    """
+    Test the pages are read in order and only the page without a text layer is rendered for OCR.
+    """
+    path = str(tmp_path / "test.pdf")
+    _write_pdf(path, [PAGE_TEXT, ""])
+    ocr = RecordingOCR()
+
+    pages = list(PdfReader(ocr=ocr, max_workers=1).read_file(path))
+
+    assert [page.strip() for page in pages] == [PAGE_TEXT, "scanned page"]
+    assert len(ocr.images) == 1
+    assert ocr.images[0].startswith(b"\x89PNG")
+
+
+@pytest.mark.parametrize("text, min_chars, expected", [
+    (PAGE_TEXT, 20, True),
+    ("", 20, False),
+    ("Art. 1", 20, False),
+    ("Art. 1", 4, True),
+    # Extraction garbage from a bad font mapping is mostly punctuation
+    ("§§ ## ~~ ¤¤ ¦¦ ab12", 4, False),
+    ("a" * 20, 20, True),
+    ("a" * 19, 20, False),
+])
+def test_has_text_layer(text: str, min_chars: int, expected: bool):
+    """
+    Test the text layer of a page is used only past the minimum of alphanumeric characters,
+    and only if they are at least half of its characters.
+    """
+    assert has_text_layer(text, min_chars=min_chars) is expected
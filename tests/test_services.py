@@ -0,0 +1,18 @@
+import re
+
+from services.neo4j_indexes import graph_schema_statements, _labels
+
+
+def test_graph_schema_statement_names_are_unique():
+    """
+    Test every constraint and index gets its own name, including the capitalized label variants.
+    """
+    names = [
+        re.match(r"CREATE (?:CONSTRAINT|RANGE INDEX|FULLTEXT INDEX) (\w+)", statement).group(1)
+        for pair in graph_schema_statements()
+        for statement in pair
+        if statement
+    ]
+
+    assert len(names) == len(set(names))
+    assert len(names) == 2 * len(_labels()) + 3
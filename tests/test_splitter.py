@@ -0,0 +1,91 @@
+import pytest
+
+from workers.knowledge import KnowledgeService
+from workers.splitter import LegalTextSplitter, format_path
+
+
+def _filler(tokens: int) -> str:
+    """
+    Build body text of a known size: " a" is a single token.
+    """
+    return " a" * tokens
+
+
+@pytest.fixture
+def splitter() -> LegalTextSplitter:
+    """
+    A splitter where any unit of about 40 tokens fits in a chunk, but never two of them.
+    """
+    return LegalTextSplitter(chunk_size=60, min_chunk_size=0, chunk_overlap=0)
+
+
+def test_split_sections_paths(splitter: LegalTextSplitter):
+    """
+    Test each unit carries the path of its enclosing headings, articles, paragraphs, incisos and alíneas,
+    and that a new unit drops the deeper levels of the previous one.
+    """
+    markers = ["EMENTA", "Art. 5º", "§ 1º", "I - a soberania;", "a) a cidadania;", "Art. 6º"]
+    text = "\n".join(f"{marker}\n{_filler(40)}" for marker in markers)
+
+    paths = [format_path(path) for _, path in splitter.split_sections(text)]
+
+    assert paths == [
+        "EMENTA",
+        "EMENTA > Art. 5º",
+        "EMENTA > Art. 5º > § 1º",
+        "EMENTA > Art. 5º > § 1º > I",
+        "EMENTA > Art. 5º > § 1º > I > a)",
+        "EMENTA > Art. 6º",
+    ]
+
+
+@pytest.mark.parametrize("min_chunk_size, expected", [
+    (50, ["EMENTA"]),
+    (5, ["EMENTA", "RELATÓRIO"]),
+])
+def test_split_sections_heading_min_chunk_size(min_chunk_size: int, expected: list[str]):
+    """
+    Test a heading closes the current chunk only once it reaches the minimum size.
+    """
+    splitter = LegalTextSplitter(chunk_size=800, min_chunk_size=min_chunk_size, chunk_overlap=0)
+    text = f"EMENTA\n{_filler(10)}\nRELATÓRIO\n{_filler(10)}"
+
+    chunks = splitter.split_sections(text)
+
+    assert [format_path(path) for _, path in chunks] == expected
+    assert "RELATÓRIO" in chunks[-1][0]
+
+
+def test_split_sections_oversized_unit(splitter: LegalTextSplitter):
+    """
+    Test a unit larger than the chunk size is cut by the fallback splitter, each piece keeping its path,
+    after the chunk before it is closed.
+    """
+    text = f"Art. 1º\n{_filler(10)}\nArt. 2º\n{_filler(300)}"
+
+    chunks = splitter.split_sections(text)
+
+    assert format_path(chunks[0][1]) == "Art. 1º"
+    assert "Art. 2º" not in chunks[0][0]
+    assert len(chunks) >= 6
+    assert all(format_path(path) == "Art. 2º" for _, path in chunks[1:])
+    assert all(splitter._length_function(chunk) <= 60 for chunk, _ in chunks)
+
+
+def test_split_pages_carries_path_across_pages():
+    """
+    Test the unfinished chunk of a page is carried over with its path, so the next page
+    continues the paragraph of the previous one and its incisos keep the enclosing article.
+    """
+    service = KnowledgeService()
+    service._splitter = LegalTextSplitter(chunk_size=80, min_chunk_size=0, chunk_overlap=0)
+    pages = [
+        f"Art. 5º\n{_filler(60)}\n§ 1º\n{_filler(25)}",
+        f"{_filler(10)}\nI - a soberania;\n{_filler(50)}",
+    ]
+
+    chunks = list(service._split_pages(pages))
+
+    assert [section for _, section in chunks] == ["Art. 5º", "Art. 5º > § 1º", "Art. 5º > § 1º > I"]
+    assert chunks[1][0].startswith("§ 1º")
+    assert chunks[1][0].count(" a") == 35
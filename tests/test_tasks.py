@@ -0,0 +1,35 @@
+import asyncio
+from unittest.mock import patch
+
+from config import env
+from workers.tasks import _process_window, aget_job_status
+
+
+def test_process_window_retries_with_backoff():
+    """
+    Test the window task retries any error with backoff, up to the configured number of times.
+    """
+    assert _process_window.autoretry_for == (Exception,)
+    assert _process_window.retry_backoff is True
+    assert _process_window.max_retries == env.INGESTION_MAX_RETRIES
+
+
+def test_job_status_failed():
+    """
+    Test a job marked as failed by the chord error callback is reported as failed, not running.
+    """
+    job = {
+        "_id": "knowledge/test.pdf",
+        "task_id": "test-job-id",
+        "stage": "failed",
+        "failed_stage": "split",
+        "started_at": 100.0,
+        "total_chunks": 100,
+        "metrics": {"chunks_processed": 50},
+    }
+    with patch("workers.tasks.IngestionCheckpoint.find_by_task", return_value=job):
+        status = asyncio.run(aget_job_status("test-job-id"))
+
+    assert status["status"] == "failed"
+    assert status["stage"] == "failed"
+    assert status["processed_chunks"] == 50
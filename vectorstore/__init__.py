@@ -1,5 +1,6 @@
-from .qdrant_client import QdrantClientManager
+from .qdrant_client import QdrantClientManager, FILTER_METADATA_KEYS
 
 __all__ = [
-    "QdrantClientManager"
+    "QdrantClientManager",
+    "FILTER_METADATA_KEYS",
 ]
\ No newline at end of file
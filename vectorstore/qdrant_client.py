@@ -1,13 +1,19 @@
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import batched
+from typing import Optional, Sequence
+from uuid import uuid4
 
 from langchain_aws import BedrockEmbeddings
 from langchain_core.documents import Document
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient, models
 from .base import VectorDBManagerBase
 from config import env
 
 COLLECTION_NAME = "documents"
+# Document metadata copied into every chunk payload, with a keyword index, so searches can filter on them
+FILTER_METADATA_KEYS: list[str] = ["case_number", "court", "case_class", "type"]
 
 embeddings = BedrockEmbeddings(
     model_id=env.BEDROCK_EMBEDDING_MODEL_ID,
@@ -15,6 +21,12 @@ embeddings = BedrockEmbeddings(
     aws_access_key_id=env.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=env.AWS_SECRET_ACCESS_KEY,
 )
+# Bedrock embeds one text per request: the limit is shared by every embedding of the process
+embedding_rate_limiter: Optional[InMemoryRateLimiter] = InMemoryRateLimiter(
+    requests_per_second=env.EMBEDDING_RATE_LIMIT,
+    check_every_n_seconds=0.05,
+    max_bucket_size=env.EMBEDDING_BATCH_SIZE,
+) if env.EMBEDDING_RATE_LIMIT > 0 else None
 
 try:
     QdrantClient(
@@ -31,6 +43,21 @@ try:
 except Exception: # noqa
     pass
 
+try:
+    _client = QdrantClient(
+        url=env.QDRANT_URL,
+        api_key=env.QDRANT_API_KEY,
+        prefer_grpc=True,
+    )
+    for _key in ["document_id", *FILTER_METADATA_KEYS]:
+        _client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=f"metadata.{_key}",
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+except Exception: # noqa
+    pass
+
 class QdrantClientManager(VectorDBManagerBase):
     def __init__(self):
         self._vectorstore = QdrantVectorStore.from_existing_collection(
@@ -45,7 +72,113 @@ class QdrantClientManager(VectorDBManagerBase):
         return self._vectorstore.similarity_search(query, k=k, filter=filters)
 
     def add_documents(self, documents: list[Document]) -> None:
-        self._vectorstore.add_documents(documents)
+        """
+        Embed and upsert documents as a pipeline: batches are embedded concurrently under the rate limit,
+        and each batch is upserted as soon as its embeddings are ready, while the next ones are embedded.
+        :param documents: The documents to add; those without an ID get a random one.
+        """
+        documents = [
+            doc if doc.id else Document(id=uuid4().hex, page_content=doc.page_content, metadata=doc.metadata)
+            for doc in documents
+        ]
+        with (
+            ThreadPoolExecutor(max_workers=env.EMBEDDING_CONCURRENCY) as embedder,
+            ThreadPoolExecutor(max_workers=env.QDRANT_UPSERT_CONCURRENCY) as writer,
+        ):
+            embeddings_ = {
+                embedder.submit(self._embed_batch, [doc.page_content for doc in batch]): batch
+                for batch in batched(documents, env.EMBEDDING_BATCH_SIZE)
+            }
+            upserts = [
+                writer.submit(self._upsert, self._points(embeddings_[future], future.result()))
+                for future in as_completed(embeddings_)
+            ]
+            for upsert in upserts:
+                upsert.result()
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a batch of texts, waiting for the rate limiter once per text.
+        :param texts: The texts to embed.
+        :return: One embedding per text.
+        """
+        if embedding_rate_limiter is not None:
+            for _ in texts:
+                embedding_rate_limiter.acquire()
+        return self._vectorstore.embeddings.embed_documents(texts)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed texts with the embedding model of the vector store, in batches embedded concurrently.
+        :param texts: The texts to embed.
+        :return: One embedding per text, in the same order.
+        """
+        batches = [list(batch) for batch in batched(texts, env.EMBEDDING_BATCH_SIZE)]
+        if len(batches) <= 1:
+            return self._embed_batch(texts) if texts else []
+        with ThreadPoolExecutor(max_workers=env.EMBEDDING_CONCURRENCY) as pool:
+            return [vector for vectors in pool.map(self._embed_batch, batches) for vector in vectors]
+
+    def _points(self, documents: Sequence[Document], vectors: list[list[float]]) -> list[models.PointStruct]:
+        """
+        Build the Qdrant points of documents, with the payload layout of QdrantVectorStore.
+        :param documents: The documents, each with an ID.
+        :param vectors: The embedding of each document, in the same order.
+        :return: The points.
+        """
+        return [
+            models.PointStruct(
+                id=doc.id,
+                vector=vector,
+                payload={
+                    self._vectorstore.content_payload_key: doc.page_content,
+                    self._vectorstore.metadata_payload_key: doc.metadata,
+                },
+            )
+            for doc, vector in zip(documents, vectors)
+        ]
+
+    def _upsert(self, points: list[models.PointStruct]) -> None:
+        """
+        Upsert points without waiting for them to be applied: Qdrant acknowledges once the update
+        is in its write-ahead log, and applies the updates of a collection in order.
+        :param points: The points to upsert.
+        """
+        self._vectorstore.client.upsert(collection_name=COLLECTION_NAME, points=points, wait=False)
+
+    def add_embeddings(self, documents: list[Document], vectors: list[list[float]]) -> None:
+        """
+        Upsert documents with precomputed embeddings; points with the same ID are overwritten.
+        The points are sent in batches, several in flight at once.
+        :param documents: The documents to add, each with an ID.
+        :param vectors: The embedding of each document, in the same order.
+        """
+        points = self._points(documents, vectors)
+        with ThreadPoolExecutor(max_workers=env.QDRANT_UPSERT_CONCURRENCY) as pool:
+            for future in [
+                pool.submit(self._upsert, list(batch)) for batch in batched(points, env.QDRANT_UPSERT_BATCH_SIZE)
+            ]:
+                future.result()
+
+    def set_document_payload(self, document_id: str, payload: dict) -> None:
+        """
+        Update the metadata of every chunk of a document.
+        :param document_id: The document ID stored in the chunk metadata.
+        :param payload: The metadata fields to set.
+        """
+        self._vectorstore.client.set_payload(
+            collection_name=COLLECTION_NAME,
+            payload=payload,
+            key=self._vectorstore.metadata_payload_key,
+            points=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key=f"{self._vectorstore.metadata_payload_key}.document_id",
+                        match=models.MatchValue(value=document_id),
+                    )
+                ]
+            ),
+        )
 
     async def asearch(self, query: str, k: int = 10, filters: Optional[models.Filter] = None) -> list[Document]:
         """
@@ -1,5 +1,7 @@
-from .tasks import aupload_knowledge_base
+from .tasks import aupload_knowledge_base, aget_job_status, aget_ingestion_metrics
 
 __all__ = [
     "aupload_knowledge_base",
+    "aget_job_status",
+    "aget_ingestion_metrics",
 ]
\ No newline at end of file
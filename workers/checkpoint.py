@@ -0,0 +1,301 @@
+import hashlib
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Iterator, Optional
+
+from pymongo import UpdateOne
+
+from services import get_database
+from .instrumentation import METRIC_NAMES
+
+# Ingestion stages, in the order they are completed; "read" means every page of the document is saved,
+# "split" that every chunk is saved
+STAGES: tuple[str, ...] = ("read", "split", "done")
+# Stage of a job whose tasks gave up; the last completed stage is kept in failed_stage, so a new attempt resumes
+FAILED_STAGE: str = "failed"
+
+_indexed = False
+_lock = Lock()
+
+
+class IngestionCheckpoint:
+    JOBS_COLLECTION_NAME: str = "ingestion_jobs"
+    CHUNKS_COLLECTION_NAME: str = "ingestion_chunks"
+    PAGES_COLLECTION_NAME: str = "ingestion_pages"
+
+    def __init__(self, key: str):
+        """
+        Persist the progress of the ingestion of an S3 object, so a redelivered task resumes where it stopped.
+        :param key: The S3 object key, which identifies the job.
+        """
+        self._key = key
+        database = get_database()
+        self._jobs = database[self.JOBS_COLLECTION_NAME]
+        self._chunks = database[self.CHUNKS_COLLECTION_NAME]
+        self._pages = database[self.PAGES_COLLECTION_NAME]
+        self._job: dict[str, Any] = self._jobs.find_one({"_id": key}) or {}
+
+    @classmethod
+    def create_indexes(cls) -> None:
+        """
+        Create the indexes of the job, chunk and page collections.
+        Runs once per process; every statement is idempotent.
+        """
+        global _indexed
+        with _lock:
+            if _indexed:
+                return
+            database = get_database()
+            database[cls.CHUNKS_COLLECTION_NAME].create_index([("job", 1), ("index", 1)])
+            database[cls.PAGES_COLLECTION_NAME].create_index([("job", 1), ("index", 1)])
+            jobs = database[cls.JOBS_COLLECTION_NAME]
+            jobs.create_index("file_hash")
+            jobs.create_index("document_hash")
+            jobs.create_index("task_id")
+            _indexed = True
+
+    @property
+    def job(self) -> dict[str, Any]:
+        """
+        Get the persisted state of the job.
+        :return: The job document, empty if the job never ran.
+        """
+        return self._job
+
+    def find_ingested(self, **hashes: str) -> Optional[dict[str, Any]]:
+        """
+        Find another job that already ingested the same content.
+        :param hashes: The hash fields to match, e.g. file_hash or document_hash.
+        :return: The completed job, or None if the content was never ingested.
+        """
+        return self._jobs.find_one({
+            "_id": {"$ne": self._key},
+            "stage": "done",
+            "duplicate_of": {"$exists": False},
+            "$or": [{name: value} for name, value in hashes.items()],
+        })
+
+    def reached(self, stage: str) -> bool:
+        """
+        Check whether the job already completed a stage.
+        :param stage: The stage name.
+        :return: True if the stage, or a later one, was completed.
+        """
+        current = self._job.get("stage")
+        if current == FAILED_STAGE:
+            current = self._job.get("failed_stage")
+        return current is not None and STAGES.index(current) >= STAGES.index(stage)
+
+    def save(self, stage: Optional[str] = None, **fields: Any) -> None:
+        """
+        Update the job, optionally marking a stage as completed.
+        :param stage: The stage just completed.
+        :param fields: Additional fields to store on the job.
+        """
+        if stage is not None:
+            fields["stage"] = stage
+        fields["updated_at"] = datetime.now(timezone.utc)
+        self._jobs.update_one({"_id": self._key}, {"$set": fields}, upsert=True)
+        self._job.update(fields)
+
+    def fail(self, **fields: Any) -> None:
+        """
+        Mark the job as failed, keeping the last completed stage so a new attempt resumes from it.
+        :param fields: Additional fields to store on the job.
+        """
+        if self._job.get("stage") != FAILED_STAGE:
+            fields["failed_stage"] = self._job.get("stage")
+        self.save(FAILED_STAGE, **fields)
+
+    def resume(self) -> None:
+        """
+        Restore the last completed stage of a failed job, before it is attempted again.
+        """
+        if self._job.get("stage") != FAILED_STAGE:
+            return
+        stage = self._job.get("failed_stage")
+        self._jobs.update_one(
+            {"_id": self._key},
+            {"$set": {"stage": stage, "updated_at": datetime.now(timezone.utc)}, "$unset": {"failed_stage": ""}},
+        )
+        self._job["stage"] = stage
+        self._job.pop("failed_stage", None)
+
+    def add_metrics(self, values: dict[str, float], **fields: Any) -> None:
+        """
+        Add timings and counters to the job, atomically, as the tasks of a job may run on several workers.
+        :param values: The amounts to add to each metric.
+        :param fields: Additional fields to store on the job.
+        """
+        fields["updated_at"] = datetime.now(timezone.utc)
+        update: dict[str, Any] = {"$set": fields}
+        if values:
+            update["$inc"] = {f"metrics.{name}": value for name, value in values.items()}
+        self._jobs.update_one({"_id": self._key}, update, upsert=True)
+        self._job.update(fields)
+
+    @classmethod
+    def find_by_task(cls, task_id: str) -> Optional[dict[str, Any]]:
+        """
+        Find a job by the ID of the Celery task that started it.
+        :param task_id: The task ID returned when the upload was enqueued.
+        :return: The job document, or None if not found.
+        """
+        return get_database()[cls.JOBS_COLLECTION_NAME].find_one({"task_id": task_id})
+
+    @classmethod
+    def summary(cls) -> dict[str, Any]:
+        """
+        Summarize the jobs: how many are at each stage and the metrics summed over the completed ones.
+        Duplicates are left out of the totals, since they were not processed.
+        :return: The job counts by stage ("queued" for jobs not started) and the metric totals.
+        """
+        jobs = get_database()[cls.JOBS_COLLECTION_NAME]
+        counts = {
+            row["_id"] or "queued": row["count"]
+            for row in jobs.aggregate([{"$group": {"_id": "$stage", "count": {"$sum": 1}}}])
+        }
+        totals = next(jobs.aggregate([
+            {"$match": {"stage": "done", "duplicate_of": {"$exists": False}}},
+            {"$group": {
+                "_id": None,
+                "documents": {"$sum": 1},
+                **{name: {"$sum": f"$metrics.{name}"} for name in METRIC_NAMES},
+            }},
+        ]), {})
+        totals.pop("_id", None)
+        return {"stages": counts, "totals": totals}
+
+    def pages(self) -> Iterator[str]:
+        """
+        Iterate over the saved pages of the document, in order, without loading them all at once.
+        :return: An iterator of page texts.
+        """
+        for page in self._pages.find({"job": self._key}, sort=[("index", 1)]):
+            yield page["text"]
+
+    def save_page(self, index: int, text: str) -> None:
+        """
+        Save a page of the document, so a redelivered task does not read it from S3 again.
+        :param index: The position of the page in the document.
+        :param text: The page text.
+        """
+        self._pages.update_one(
+            {"_id": f"{self._key}:{index}"},
+            {"$set": {"job": self._key, "index": index, "text": text}},
+            upsert=True,
+        )
+
+    def _chunk_row_id(self, chunk_id: str) -> str:
+        """
+        Get the ID of the row of a chunk. Chunk IDs only depend on the file, so the rows are scoped
+        to the job, same as the pages, for concurrent jobs of the same file not to share them.
+        :param chunk_id: The deterministic chunk ID.
+        :return: The row ID.
+        """
+        return f"{self._key}:{chunk_id}"
+
+    def chunks(self, chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+        """
+        Get the persisted results of chunks of the job.
+        :param chunk_ids: The IDs of the chunks.
+        :return: A mapping from chunk ID to its stored results, for the chunks found.
+        """
+        rows = self._chunks.find({"_id": {"$in": [self._chunk_row_id(chunk_id) for chunk_id in chunk_ids]}})
+        return {chunk["chunk_id"]: chunk for chunk in rows}
+
+    def chunk_range(self, start: int, stop: int) -> list[dict[str, Any]]:
+        """
+        Get a range of chunks of the job, by position in the document.
+        :param start: The index of the first chunk.
+        :param stop: The index after the last chunk.
+        :return: The chunks, in order, each with its chunk_id.
+        """
+        return list(self._chunks.find({"job": self._key, "index": {"$gte": start, "$lt": stop}}, sort=[("index", 1)]))
+
+    def chunk_metadata(self) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over the metadata extracted from the chunks of the job.
+        :return: An iterator of chunk metadata.
+        """
+        for chunk in self._chunks.find({"job": self._key, "metadata": {"$exists": True}}, {"metadata": 1}):
+            yield chunk["metadata"]
+
+    def save_chunk(self, chunk_id: str, **fields: Any) -> None:
+        """
+        Store results of a single chunk.
+        :param chunk_id: The deterministic chunk ID.
+        :param fields: The results to store, e.g. graph, metadata or embedding.
+        """
+        self._chunks.update_one(
+            {"_id": self._chunk_row_id(chunk_id)},
+            {"$set": {"job": self._key, "chunk_id": chunk_id, **fields}},
+            upsert=True,
+        )
+
+    def save_chunks(self, results: dict[str, dict[str, Any]]) -> None:
+        """
+        Store results of many chunks in a single round trip.
+        :param results: A mapping from chunk ID to the results to store.
+        """
+        if not results:
+            return
+        self._chunks.bulk_write([
+            UpdateOne(
+                {"_id": self._chunk_row_id(chunk_id)},
+                {"$set": {"job": self._key, "chunk_id": chunk_id, **fields}},
+                upsert=True,
+            )
+            for chunk_id, fields in results.items()
+        ], ordered=False)
+
+    def complete(self, **fields: Any) -> None:
+        """
+        Mark the job as done and drop the intermediate results that are no longer needed.
+        :param fields: Additional fields to store on the job.
+        """
+        self._chunks.delete_many({"job": self._key})
+        self._pages.delete_many({"job": self._key})
+        self.save("done", **fields)
+
+
+class ChunkCache:
+    COLLECTION_NAME: str = "chunk_cache"
+
+    def __init__(self, kind: str, model: str):
+        """
+        Content-addressed cache of per-chunk results, shared across documents and jobs.
+        :param kind: The kind of result, e.g. graph, metadata or embedding.
+        :param model: The model producing the result; changing it invalidates the cache.
+        """
+        self._prefix = f"{kind}:{model}:"
+        self._collection = get_database()[self.COLLECTION_NAME]
+
+    def chunk_hash(self, text: str) -> str:
+        """
+        Calculate the cache key of a chunk.
+        :param text: The chunk text.
+        :return: The hex digest of the kind, model and text.
+        """
+        return hashlib.sha256(f"{self._prefix}{text}".encode()).hexdigest()
+
+    def get_many(self, texts: list[str]) -> dict[str, Any]:
+        """
+        Look up the cached results of the chunks.
+        :param texts: The chunk texts.
+        :return: A mapping from chunk text to its cached result, for the chunks found.
+        """
+        hashes = {self.chunk_hash(text): text for text in texts}
+        return {hashes[item["_id"]]: item["value"] for item in self._collection.find({"_id": {"$in": list(hashes)}})}
+
+    def set_many(self, results: dict[str, Any]) -> None:
+        """
+        Store the results of the chunks.
+        :param results: A mapping from chunk text to its result.
+        """
+        if not results:
+            return
+        self._collection.bulk_write([
+            UpdateOne({"_id": self.chunk_hash(text)}, {"$set": {"value": value}}, upsert=True)
+            for text, value in results.items()
+        ], ordered=False)
@@ -0,0 +1,196 @@
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
+from langchain_neo4j import Neo4jGraph
+
+from config import env
+from core.prompt import COMMUNITY_SUMMARY_PROMPT
+from schemas import CommunitySummary, RELATIONSHIP_TYPES
+from services import provision_graph
+
+# Maximum number of relationships given to the LLM to summarize a community
+MAX_COMMUNITY_RELATIONSHIPS = 100
+# Number of communities written per UNWIND statement
+WRITE_BATCH_SIZE = 100
+
+EDGES_QUERY = """
+MATCH (a:__Entity__)-[r]->(b:__Entity__)
+WHERE type(r) IN $relationship_types
+RETURN elementId(a) AS source, a.id AS source_name, type(r) AS type,
+       elementId(b) AS target, b.id AS target_name
+"""
+
+WRITE_COMMUNITIES_QUERY = """
+UNWIND $communities AS c
+CREATE (n:__Community__ {
+    id: c.id, version: $version, title: c.title, summary: c.summary, size: c.size
+})
+WITH n, c
+UNWIND c.members AS member
+MATCH (e:__Entity__) WHERE elementId(e) = member
+CREATE (e)-[:IN_COMMUNITY]->(n)
+"""
+
+# Versions are zero-padded timestamps, so they sort in time order: an overlapping rebuild only
+# deletes the versions older than its own and never the summaries of a newer run
+DELETE_OLD_COMMUNITIES_QUERY = """
+MATCH (n:__Community__) WHERE n.version < $version
+CALL (n) { DETACH DELETE n } IN TRANSACTIONS OF 1000 ROWS
+"""
+
+GRAPH_STATE_QUERY = """
+MERGE (s:__GraphState__ {id: 'state'})
+RETURN s.updated_at AS updated_at, s.communities_built_at AS communities_built_at
+"""
+
+MARK_GRAPH_UPDATED_QUERY = """
+MERGE (s:__GraphState__ {id: 'state'}) SET s.updated_at = $timestamp
+"""
+
+MARK_COMMUNITIES_BUILT_QUERY = """
+MERGE (s:__GraphState__ {id: 'state'})
+SET s.communities_built_at = CASE
+    WHEN coalesce(s.communities_built_at, 0) < $timestamp THEN $timestamp ELSE s.communities_built_at
+END
+"""
+
+
+def detect_communities(edges: list[tuple[str, str]], max_iterations: int = 20, seed: int = 0) -> dict[str, int]:
+    """
+    Detect communities with asynchronous label propagation.
+    Nodes are visited in a shuffled order and ties are broken at random, with a fixed seed so
+    that the same graph always yields the same communities.
+    :param edges: The (source, target) node pairs of the graph.
+    :param max_iterations: The maximum number of propagation rounds.
+    :param seed: The seed of the random generator.
+    :return: A mapping from node to community number.
+    """
+    neighbors: dict[str, list[str]] = defaultdict(list)
+    for a, b in edges:
+        if a == b: continue
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    rng = random.Random(seed)
+    nodes = sorted(neighbors)
+    labels = {node: node for node in nodes}
+    for _ in range(max_iterations):
+        changed = False
+        rng.shuffle(nodes)
+        for node in nodes:
+            counts = Counter(labels[n] for n in neighbors[node])
+            best = max(counts.values())
+            # Keep the current label when it is among the most frequent
+            if counts.get(labels[node], 0) == best:
+                continue
+            labels[node] = rng.choice(sorted(label for label, count in counts.items() if count == best))
+            changed = True
+        if not changed:
+            break
+    numbers: dict[str, int] = {}
+    return {node: numbers.setdefault(label, len(numbers)) for node, label in sorted(labels.items())}
+
+
+def mark_graph_updated(graph: Neo4jGraph) -> None:
+    """
+    Record that the entity graph changed, so the next community build is not skipped.
+    :param graph: The Neo4j graph.
+    """
+    graph.query(MARK_GRAPH_UPDATED_QUERY, params={"timestamp": datetime.now(timezone.utc).timestamp()})
+
+
+class CommunityService:
+    def __init__(self, llm, min_size: int = env.COMMUNITY_MIN_SIZE, max_concurrency: int = 4):
+        """
+        Detect communities in the entity graph and store an LLM-written summary for each one.
+        :param llm: The language model used to summarize the communities.
+        :param min_size: The minimum number of entities for a community to be summarized.
+        :param max_concurrency: The maximum number of concurrent summary calls.
+        """
+        self._llm = llm
+        self._min_size = min_size
+        self._max_concurrency = max_concurrency
+        self._graph = Neo4jGraph(url=env.NEO4J_URL, username=env.NEO4J_USERNAME, password=env.NEO4J_PASSWORD)
+        provision_graph(self._graph)
+
+    def _summarize(self, communities: list[list[dict]], config: Optional[RunnableConfig] = None) -> list[dict]:
+        """
+        Summarize the communities with the LLM.
+        :param communities: The relationships of each community.
+        :param config: Optional runnable configuration.
+        :return: The title and summary of each community, in the same order.
+        """
+        chain = COMMUNITY_SUMMARY_PROMPT | self._llm.with_structured_output(CommunitySummary)
+        inputs = [
+            {
+                "relationships": "\n".join(
+                    f"({e['source_name']})-[{e['type']}]->({e['target_name']})"
+                    for e in edges[:MAX_COMMUNITY_RELATIONSHIPS]
+                )
+            }
+            for edges in communities
+        ]
+        config = RunnableConfig(**(config or {}), max_concurrency=self._max_concurrency)
+        results = chain.batch(inputs, config=config, return_exceptions=True)
+        summaries: list[dict] = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error summarizing community: {result}")
+                summaries.append({"title": None, "summary": None})
+                continue
+            summaries.append(result.model_dump())
+        return summaries
+
+    def process(self, requested_at: Optional[float] = None) -> Optional[str]:
+        """
+        Rebuild the communities and their summaries under a new version, then drop the previous version.
+        :param requested_at: When the rebuild was requested; the build is skipped if a newer one already ran.
+        :return: The new version, or None if the build was skipped.
+        """
+        state = self._graph.query(GRAPH_STATE_QUERY)[0]
+        built_at = state.get("communities_built_at")
+        updated_at = state.get("updated_at") or 0
+        # Several ingestions in a row queue several rebuilds, only the first one has work to do
+        if requested_at is not None and built_at is not None and (built_at >= requested_at or updated_at <= built_at):
+            print("Communities are already up to date, skipping rebuild.")
+            return None
+        started_at = datetime.now(timezone.utc)
+        version = started_at.strftime("%Y%m%d%H%M%S%f")
+
+        edges = self._graph.query(EDGES_QUERY, params={"relationship_types": RELATIONSHIP_TYPES})
+        membership = detect_communities([(e["source"], e["target"]) for e in edges])
+        members: dict[int, list[str]] = defaultdict(list)
+        for node, community in membership.items():
+            members[community].append(node)
+        community_edges: dict[int, list[dict]] = defaultdict(list)
+        for e in edges:
+            community = membership.get(e["source"])
+            if community is not None and community == membership.get(e["target"]):
+                community_edges[community].append(e)
+        selected = [c for c, nodes in members.items() if len(nodes) >= self._min_size]
+        print(f"{len(members)} communities detected, {len(selected)} to summarize.")
+
+        summaries = self._summarize([community_edges[c] for c in selected])
+        communities = [
+            {
+                "id": f"{version}-{c}",
+                "title": summary["title"],
+                "summary": summary["summary"],
+                "size": len(members[c]),
+                "members": members[c],
+            }
+            for c, summary in zip(selected, summaries)
+            if summary["summary"]
+        ]
+        for batch in range(0, len(communities), WRITE_BATCH_SIZE):
+            self._graph.query(
+                WRITE_COMMUNITIES_QUERY,
+                params={"communities": communities[batch:batch + WRITE_BATCH_SIZE], "version": version},
+            )
+        # Readers always use the latest version, so the older ones can go once the new one is complete
+        self._graph.query(DELETE_OLD_COMMUNITIES_QUERY, params={"version": version})
+        self._graph.query(MARK_COMMUNITIES_BUILT_QUERY, params={"timestamp": started_at.timestamp()})
+        print(f"Communities version {version} built with {len(communities)} summaries.")
+        return version
@@ -1,18 +1,63 @@
+from typing import Optional
+
 from config import env
 from celery import Celery
 
+DEFAULT_QUEUE = 'default'
+# Small uploads, served by their own workers so they are searchable within seconds during backfills
+INTERACTIVE_QUEUE = 'interactive'
+# Large uploads and backfills
+BULK_QUEUE = 'bulk'
+
 broker_transport_options = {
     'region': env.AWS_REGION,
     'visibility_timeout': 3600,     # 1 hour
-    'polling_interval': 5,          # seconds
+    # Long polling: a receive returns as soon as a message arrives instead of sleeping between polls
+    'wait_time_seconds': env.SQS_WAIT_TIME_SECONDS,
+    'polling_interval': 0,          # seconds
     'predefined_queues': {
-        'default': {
+        DEFAULT_QUEUE: {
             'url': env.SQS_DEFAULT_QUEUE_URL,
-        }
+        },
+        INTERACTIVE_QUEUE: {
+            'url': env.SQS_INTERACTIVE_QUEUE_URL or env.SQS_DEFAULT_QUEUE_URL,
+        },
+        BULK_QUEUE: {
+            'url': env.SQS_BULK_QUEUE_URL or env.SQS_DEFAULT_QUEUE_URL,
+        },
     },
 }
 app = Celery("tasks")
 
 app.conf.broker_url = env.SQS_BROKER_URL
 app.conf.broker_transport_options = broker_transport_options
-app.conf.task_default_queue = 'default'
\ No newline at end of file
+app.conf.task_default_queue = DEFAULT_QUEUE
+# Ingestion tasks are routed per upload with ingestion_queue, the remaining ones use the default queue
+app.conf.task_routes = {
+    'knowledge.build_communities': {'queue': DEFAULT_QUEUE},
+}
+# Tasks run for minutes: reserve one message per process, so idle workers pick up the next ones,
+# and acknowledge them only once done, so a lost worker's tasks are redelivered
+app.conf.worker_prefetch_multiplier = 1
+app.conf.task_acks_late = True
+app.conf.task_reject_on_worker_lost = True
+# Chords need a result backend to know when every window of a document is processed
+app.conf.result_backend = env.CELERY_RESULT_BACKEND or env.MONGO_URI
+app.conf.mongodb_backend_settings = {
+    'database': env.MONGO_DB_NAME,
+    'taskmeta_collection': 'celery_taskmeta',
+}
+app.conf.result_expires = 86400     # 1 day
+
+
+def ingestion_queue(size: Optional[int]) -> str:
+    """
+    Choose the queue of an ingestion by the size of the uploaded file.
+    Workers are started per queue with their own concurrency, e.g.
+    `celery -A workers.tasks worker -Q interactive,default -c 8` and `celery -A workers.tasks worker -Q bulk -c 2`.
+    :param size: The size of the file in bytes, or None if unknown.
+    :return: The queue name.
+    """
+    if size is not None and size <= env.INTERACTIVE_MAX_FILE_SIZE * 1024 * 1024:
+        return INTERACTIVE_QUEUE
+    return BULK_QUEUE
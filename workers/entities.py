@@ -0,0 +1,255 @@
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Optional
+
+from langchain_community.graphs.graph_document import GraphDocument, Node, Relationship
+from langchain_neo4j import Neo4jGraph
+
+from config import env
+from services import ENTITY_INDEX_NAME
+
+# Unified CNJ case number: NNNNNNN-DD.AAAA.J.TR.OOOO, with or without punctuation
+CNJ_PATTERN = re.compile(r"(?<!\d)(\d{7})-?(\d{2})\.?(\d{4})\.?(\d)\.?(\d{2})\.?(\d{4})(?!\d)")
+# Bar registration, e.g. OAB/SP 123.456, OAB-SP nº 123456 or 123.456 OAB/SP
+OAB_PATTERN = re.compile(
+    r"OAB\s*[/\-]?\s*([A-Z]{2})\s*(?:n[º°o]?\.?\s*)?(\d[\d.]*\d|\d)|(\d[\d.]*\d|\d)\s*OAB\s*[/\-]\s*([A-Z]{2})",
+    re.IGNORECASE,
+)
+CPF_PATTERN = re.compile(r"(?<![\d./-])(\d{3})\.?(\d{3})\.?(\d{3})-?(\d{2})(?![\d./-])")
+CNPJ_PATTERN = re.compile(r"(?<![\d./-])(\d{2})\.?(\d{3})\.?(\d{3})/?(\d{4})-?(\d{2})(?![\d./-])")
+
+# Titles and honorifics ignored when comparing names
+HONORIFICS: set[str] = {
+    "sr", "sra", "srta", "dr", "dra", "exmo", "exma", "ilmo", "ilma", "des", "desembargador",
+    "desembargadora", "juiz", "juiza", "min", "ministro", "ministra", "adv", "advogado", "advogada",
+    "prof", "profa", "mr", "mrs", "ms",
+}
+
+# Entities of a type whose name shares the blocking token, through the full-text index on entity ids
+CANDIDATES_QUERY = """
+CALL db.index.fulltext.queryNodes($index, $query) YIELD node, score
+WHERE $label IN labels(node)
+WITH node ORDER BY score DESC LIMIT $limit
+RETURN node.id AS id, coalesce(node.aliases, []) AS aliases
+"""
+# Maximum number of existing entities loaded per blocking token
+MAX_CANDIDATES = 50
+# Characters with a meaning in Lucene queries
+LUCENE_SPECIAL_PATTERN = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+
+
+def normalize_identifiers(text: str) -> str:
+    """
+    Rewrite CNJ, OAB, CPF and CNPJ numbers in their canonical punctuation.
+    :param text: The entity text.
+    :return: The text with canonical identifiers.
+    """
+    text = CNJ_PATTERN.sub(lambda m: "{}-{}.{}.{}.{}.{}".format(*m.groups()), text)
+    text = OAB_PATTERN.sub(
+        lambda m: f"OAB/{(m.group(1) or m.group(4)).upper()} {(m.group(2) or m.group(3)).replace('.', '')}",
+        text,
+    )
+    text = CNPJ_PATTERN.sub(lambda m: "{}.{}.{}/{}-{}".format(*m.groups()), text)
+    return CPF_PATTERN.sub(lambda m: "{}.{}.{}-{}".format(*m.groups()), text)
+
+
+def identifier_key(text: str) -> Optional[str]:
+    """
+    Get a key from the identifier an entity carries, so its variants resolve to the same node.
+    :param text: The entity text.
+    :return: The identifier key, or None if the text has no known identifier.
+    """
+    for name, pattern in (("cnj", CNJ_PATTERN), ("cnpj", CNPJ_PATTERN), ("cpf", CPF_PATTERN)):
+        match = pattern.search(text)
+        if match:
+            return f"{name}:{''.join(match.groups())}"
+    match = OAB_PATTERN.search(text)
+    if match:
+        return f"oab:{(match.group(1) or match.group(4)).upper()}:{(match.group(2) or match.group(3)).replace('.', '')}"
+    return None
+
+
+def _escape_lucene(text: str) -> str:
+    """
+    Escape the characters of a Lucene full-text query.
+    :param text: The text to search.
+    :return: The escaped text.
+    """
+    return LUCENE_SPECIAL_PATTERN.sub(r"\\\1", text)
+
+
+def identifier_text(text: str) -> Optional[str]:
+    """
+    Get the identifier an entity carries, as written in the text.
+    :param text: The entity text, with canonical identifiers.
+    :return: The identifier text, or None if the text has no known identifier.
+    """
+    for pattern in (CNJ_PATTERN, CNPJ_PATTERN, CPF_PATTERN, OAB_PATTERN):
+        match = pattern.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+
+def normalize_key(text: str) -> str:
+    """
+    Get the comparison key of an entity name: identifier key if any, otherwise the name without
+    accents, case, punctuation and honorifics.
+    :param text: The entity text.
+    :return: The normalized key.
+    """
+    key = identifier_key(text)
+    if key is not None:
+        return key
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    tokens = re.findall(r"\w+", text)
+    return " ".join(token for token in tokens if token not in HONORIFICS) or " ".join(tokens)
+
+
+class EntityCanonicalizer:
+    def __init__(
+        self,
+        graph: Neo4jGraph,
+        threshold: float = env.ENTITY_MATCH_THRESHOLD,
+        max_candidates: int = MAX_CANDIDATES,
+    ):
+        """
+        Resolve extracted entities to canonical names before they are written, matching them
+        against the entities already in the graph and those seen earlier in the ingestion.
+        Existing entities are looked up per blocking token through the full-text index, so memory
+        grows with the names extracted rather than with the graph.
+        Every name merged into a different canonical name is recorded as an alias.
+        :param graph: The Neo4j graph.
+        :param threshold: The minimum similarity for two names of the same type to be merged.
+        :param max_candidates: The maximum number of existing entities loaded per blocking token.
+        """
+        self._graph = graph
+        self._threshold = threshold
+        self._max_candidates = max_candidates
+        # Per node type: normalized key -> canonical id
+        self._index: dict[str, dict[str, str]] = defaultdict(dict)
+        # Per node type: first key token -> keys, to limit fuzzy comparisons
+        self._blocks: dict[str, dict[str, list[str]]] = defaultdict(lambda: defaultdict(list))
+        # (node type, blocking token) pairs already looked up in the graph
+        self._looked_up: set[tuple[str, str]] = set()
+        self.merged = 0
+
+    def _lookup(self, type_: str, name: str, key: str) -> None:
+        """
+        Load the existing entities of a type that may match a name, with their aliases.
+        Names with an identifier are looked up by the identifier, the others by their first
+        key token, allowing one edit so accents and typos still match.
+        :param type_: The node type.
+        :param name: The entity name, with canonical identifiers.
+        :param key: The normalized key of the name.
+        """
+        block = key if ":" in key else key.split(" ", 1)[0]
+        if not block or (type_, block) in self._looked_up:
+            return
+        self._looked_up.add((type_, block))
+        identifier = identifier_text(name) if ":" in key else None
+        if identifier is not None:
+            query = f'"{_escape_lucene(identifier)}"'
+        else:
+            query = f"{_escape_lucene(block)}~1" if len(block) >= 4 else _escape_lucene(block)
+        rows = self._graph.query(CANDIDATES_QUERY, params={
+            "index": ENTITY_INDEX_NAME,
+            "query": query,
+            "label": type_,
+            "limit": self._max_candidates,
+        })
+        for row in rows:
+            if row["id"] is None:
+                continue
+            for name_ in [row["id"], *row["aliases"]]:
+                self._register(type_, normalize_key(str(name_)), str(row["id"]))
+
+    def _register(self, type_: str, key: str, canonical: str) -> None:
+        """
+        Add a key to the index of a type.
+        :param type_: The node type.
+        :param key: The normalized key.
+        :param canonical: The canonical id the key resolves to.
+        """
+        if key in self._index[type_]:
+            return
+        self._index[type_][key] = canonical
+        self._blocks[type_][key.split(" ", 1)[0]].append(key)
+
+    def _match(self, type_: str, key: str) -> Optional[str]:
+        """
+        Find the most similar known key of the same type, ignoring identifier keys and names
+        with different numbers, e.g. "Artigo 927" and "Artigo 928".
+        :param type_: The node type.
+        :param key: The normalized key.
+        :return: The matching key, or None.
+        """
+        if ":" in key:
+            return None
+        digits = re.findall(r"\d+", key)
+        best, best_ratio = None, self._threshold
+        for candidate in self._blocks[type_].get(key.split(" ", 1)[0], []):
+            if re.findall(r"\d+", candidate) != digits:
+                continue
+            matcher = SequenceMatcher(None, key, candidate)
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def resolve(self, node: Node) -> str:
+        """
+        Get the canonical id of an extracted node.
+        :param node: The extracted node.
+        :return: The canonical id.
+        """
+        name = normalize_identifiers(" ".join(str(node.id).split()))
+        key = normalize_key(name)
+        canonical = self._index[node.type].get(key)
+        if canonical is None:
+            self._lookup(node.type, name, key)
+            canonical = self._index[node.type].get(key)
+        if canonical is None:
+            match = self._match(node.type, key)
+            canonical = self._index[node.type][match] if match is not None else name
+            self._register(node.type, key, canonical)
+        return canonical
+
+    def canonicalize(self, graph_document: GraphDocument) -> GraphDocument:
+        """
+        Rewrite the nodes and relationships of a graph document with canonical ids.
+        :param graph_document: The extracted graph document.
+        :return: A graph document with merged nodes, carrying the merged names as aliases.
+        """
+        nodes: dict[tuple[str, str], Node] = {}
+
+        def _canonical(node: Node) -> Node:
+            canonical = self.resolve(node)
+            node_ = nodes.get((node.type, canonical))
+            if node_ is None:
+                node_ = nodes[(node.type, canonical)] = Node(
+                    id=canonical, type=node.type, properties={**node.properties, "aliases": []})
+            if str(node.id) != canonical and str(node.id) not in node_.properties["aliases"]:
+                node_.properties["aliases"].append(str(node.id))
+                self.merged += 1
+            return node_
+
+        for node in graph_document.nodes:
+            _canonical(node)
+        relationships: dict[tuple[str, str, str], Relationship] = {}
+        for rel in graph_document.relationships:
+            source, target = _canonical(rel.source), _canonical(rel.target)
+            # Variants of the same entity linked to each other collapse into nothing
+            if source is target:
+                continue
+            relationships.setdefault(
+                (f"{source.type}:{source.id}", rel.type, f"{target.type}:{target.id}"),
+                Relationship(source=source, target=target, type=rel.type, properties=rel.properties),
+            )
+        return GraphDocument(
+            nodes=list(nodes.values()), relationships=list(relationships.values()), source=graph_document.source)
@@ -0,0 +1,227 @@
+import hashlib
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Optional
+
+from langchain_community.graphs.graph_document import GraphDocument
+from langchain_neo4j import Neo4jGraph
+
+from config import env
+
+# Batches queued for writing before add() blocks, so a slow database bounds memory instead of growing it
+MAX_PENDING_BATCHES = 2
+
+DOCUMENTS_QUERY = """
+UNWIND $rows AS row
+MERGE (d:Document {id: row.id})
+SET d.text = row.text
+SET d += row.properties
+"""
+
+NODES_QUERY = """
+UNWIND $rows AS row
+MERGE (n:__Entity__ {id: row.id})
+SET n:`%s`
+SET n += row.properties
+SET n.aliases = coalesce(n.aliases, []) + [a IN row.aliases WHERE NOT a IN coalesce(n.aliases, [])]
+"""
+
+MENTIONS_QUERY = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.document})
+MATCH (n:__Entity__ {id: row.id})
+MERGE (d)-[:MENTIONS]->(n)
+"""
+
+RELATIONSHIPS_QUERY = """
+UNWIND $rows AS row
+MATCH (s:__Entity__ {id: row.source})
+MATCH (t:__Entity__ {id: row.target})
+MERGE (s)-[r:`%s`]->(t)
+SET r += row.properties
+"""
+
+
+def _sanitize(name: str) -> str:
+    """
+    Make a label or relationship type safe to interpolate between backticks.
+    :param name: The label or relationship type.
+    :return: The name without backticks.
+    """
+    return name.replace("`", "")
+
+
+def _properties(properties: dict[str, Any]) -> dict[str, Any]:
+    """
+    Keep only the properties Neo4j can store.
+    :param properties: The properties of a node, relationship or document.
+    :return: The properties with primitive or list values.
+    """
+    return {k: v for k, v in properties.items() if v is not None and not isinstance(v, dict)}
+
+
+class GraphWriter:
+    def __init__(
+        self,
+        graph: Neo4jGraph,
+        batch_size: int = env.GRAPH_WRITE_BATCH_SIZE,
+        max_sessions: int = env.GRAPH_WRITE_SESSIONS,
+    ):
+        """
+        Write graph documents to Neo4j in batched UNWIND statements while extraction is still running.
+        Batches are written in the background, in order; within a batch the nodes of labels
+        that do not share ids are written in parallel sessions.
+        The nodes are merged under the __Entity__ base label and linked to their source Document
+        with MENTIONS, like Neo4jGraph.add_graph_documents(include_source=True, baseEntityLabel=True).
+        :param graph: The Neo4j graph whose driver is used.
+        :param batch_size: The number of graph documents written per batch.
+        :param max_sessions: The maximum number of parallel sessions.
+        """
+        self._graph = graph
+        self._batch_size = batch_size
+        self._max_sessions = max_sessions
+        self._buffer: list[GraphDocument] = []
+        self._lock = Lock()
+        # A single writer thread keeps the batches ordered and off the caller's event loop
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._sessions = ThreadPoolExecutor(max_workers=max_sessions)
+        self._futures: list[Future] = []
+        self._started_at: Optional[float] = None
+        self.nodes_written = 0
+        self.relationships_written = 0
+        # Time spent in the writer thread, which overlaps with the extraction
+        self.write_seconds = 0.0
+
+    def __enter__(self) -> "GraphWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def add(self, graph_document: GraphDocument) -> None:
+        """
+        Queue a graph document, writing a batch in the background once enough are queued.
+        :param graph_document: The graph document of a chunk.
+        """
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+            self._buffer.append(graph_document)
+            if len(self._buffer) < self._batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+        pending = [future for future in self._futures if not future.done()]
+        if len(pending) >= MAX_PENDING_BATCHES:
+            pending[0].result()
+        self._futures.append(self._writer.submit(self._write, batch))
+
+    def close(self) -> None:
+        """
+        Write the remaining graph documents and wait for every batch, raising the first write error.
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._futures.append(self._writer.submit(self._write, batch))
+        try:
+            for future in self._futures:
+                future.result()
+        finally:
+            self._writer.shutdown()
+            self._sessions.shutdown()
+        self._report("Graph written")
+
+    def _run(self, query: str, rows: list[dict]) -> None:
+        """
+        Run a write statement in its own session, retrying transient errors such as deadlocks.
+        :param query: The Cypher statement.
+        :param rows: The rows to unwind.
+        """
+        with self._graph._driver.session(database=self._graph._database) as session:  # noqa
+            session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+    def _write(self, batch: list[GraphDocument]) -> None:
+        """
+        Write a batch of graph documents.
+        :param batch: The graph documents.
+        """
+        started_at = time.monotonic()
+        documents: dict[str, dict] = {}
+        nodes: dict[tuple[str, str], dict] = {}
+        aliases: dict[tuple[str, str], list[str]] = defaultdict(list)
+        mentions: set[tuple[str, str]] = set()
+        relationships: dict[tuple[str, str, str], dict] = {}
+        for graph_document in batch:
+            source = graph_document.source
+            # The chunk ID, also the Qdrant point ID; the text hash only for sources without one
+            document_id = (
+                source.id or source.metadata.get("id") or hashlib.md5(source.page_content.encode()).hexdigest()
+            )
+            documents[document_id] = {
+                "id": document_id,
+                "text": source.page_content,
+                "properties": _properties(source.metadata),
+            }
+            for node in graph_document.nodes:
+                key = (_sanitize(node.type), str(node.id))
+                properties = _properties(node.properties)
+                # Aliases accumulate across chunks and ingestions instead of being overwritten
+                for alias in properties.pop("aliases", []):
+                    if alias not in aliases[key]: aliases[key].append(alias)
+                nodes.setdefault(key, {}).update(properties)
+                mentions.add((document_id, str(node.id)))
+            for rel in graph_document.relationships:
+                key = (str(rel.source.id), _sanitize(rel.type), str(rel.target.id))
+                relationships.setdefault(key, {}).update(_properties(rel.properties))
+                # Endpoints missing from the node list are still created, as in add_graph_documents
+                nodes.setdefault((_sanitize(rel.source.type), str(rel.source.id)), {})
+                nodes.setdefault((_sanitize(rel.target.type), str(rel.target.id)), {})
+
+        self._run(DOCUMENTS_QUERY, list(documents.values()))
+
+        by_label: dict[str, list[dict]] = defaultdict(list)
+        for (label, node_id), properties in nodes.items():
+            by_label[label].append({"id": node_id, "properties": properties, "aliases": aliases[(label, node_id)]})
+        # Ids typed with several labels would make parallel sessions contend for the same node
+        labels_of: dict[str, int] = defaultdict(int)
+        for label, node_id in nodes:
+            labels_of[node_id] += 1
+        shared = {node_id for node_id, count in labels_of.items() if count > 1}
+        for label, rows in by_label.items():
+            rows_ = [row for row in rows if row["id"] in shared]
+            if rows_: self._run(NODES_QUERY % label, rows_)
+        futures = [
+            self._sessions.submit(self._run, NODES_QUERY % label, rows_)
+            for label, rows in by_label.items()
+            if (rows_ := [row for row in rows if row["id"] not in shared])
+        ]
+        for future in futures:
+            future.result()
+
+        self._run(MENTIONS_QUERY, [{"document": d, "id": n} for d, n in mentions])
+        by_type: dict[str, list[dict]] = defaultdict(list)
+        for (source, type_, target), properties in relationships.items():
+            by_type[type_].append({"source": source, "target": target, "properties": properties})
+        # Relationships lock both endpoints, so they are written in a single session
+        for type_, rows in by_type.items():
+            self._run(RELATIONSHIPS_QUERY % type_, rows)
+
+        with self._lock:
+            self.nodes_written += len(nodes)
+            self.relationships_written += len(relationships)
+            self.write_seconds += time.monotonic() - started_at
+        self._report("Graph batch written")
+
+    def _report(self, message: str) -> None:
+        """
+        Print the totals and rates written so far.
+        :param message: The message prefix.
+        """
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        rate = max(elapsed, 1e-6)
+        print(
+            f"{message}: {self.nodes_written} nodes, {self.relationships_written} relationships in {elapsed:.1f}s "
+            f"({self.nodes_written / rate:.1f} nodes/s, {self.relationships_written / rate:.1f} relationships/s)."
+        )
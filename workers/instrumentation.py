@@ -0,0 +1,54 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator
+
+# Stages timed during an ingestion, in pipeline order
+TIMED_STAGES: tuple[str, ...] = ("read", "split", "extract", "graph_write", "metadata", "embed", "upsert")
+# Counters summed over the tasks of a job
+COUNTERS: tuple[str, ...] = (
+    "chunks_processed", "queue_wait_seconds", "llm_calls", "input_tokens", "output_tokens",
+    "cache_read_input_tokens", "cache_creation_input_tokens",
+)
+METRIC_NAMES: tuple[str, ...] = tuple(f"{stage}_seconds" for stage in TIMED_STAGES) + COUNTERS
+
+
+class IngestionMetrics:
+    def __init__(self):
+        """
+        Accumulate the timings and counters of an ingestion task, to be added to its job in a single update.
+        Thread-safe, as extraction and indexing run in different threads.
+        """
+        self._lock = Lock()
+        self._values: dict[str, float] = defaultdict(float)
+
+    def add(self, name: str, value: float) -> None:
+        """
+        Add to a counter.
+        :param name: The counter name, e.g. chunks_processed or input_tokens.
+        :param value: The amount to add.
+        """
+        with self._lock:
+            self._values[name] += value
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """
+        Add the wall time of the block to the seconds of a stage.
+        :param stage: The stage name, one of TIMED_STAGES.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{stage}_seconds", time.perf_counter() - started_at)
+
+    def pop(self) -> dict[str, float]:
+        """
+        Get the accumulated values and reset them.
+        :return: The values accumulated since the last call.
+        """
+        with self._lock:
+            values, self._values = dict(self._values), defaultdict(float)
+        return values
@@ -1,34 +1,48 @@
+import asyncio
 import hashlib
 import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import batched
+from threading import Lock
+from typing import (
+    Optional, cast, Dict, Any, Tuple, List, Union, Type, Literal, Callable, Iterable, Iterator, Awaitable,
+)
+from uuid import uuid5, UUID, NAMESPACE_OID
 
-from typing import Optional, cast, Dict, Any, Tuple, List, Union, Type, Literal
-from uuid import uuid4, UUID
-
-from langchain_community.document_loaders import S3FileLoader, AmazonTextractPDFLoader
+from langchain_community.document_loaders import S3FileLoader
 from langchain_community.graphs.graph_document import GraphDocument, Node, Relationship
-from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.messages import SystemMessage, BaseMessage
+from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate, HumanMessagePromptTemplate
 from langchain_core.runnables import RunnableConfig
 from langchain_experimental.graph_transformers import LLMGraphTransformer
 from langchain_experimental.graph_transformers.llm import UnstructuredRelation
 from langchain_openai import ChatOpenAI
-from langchain_text_splitters import CharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_aws import ChatBedrock
 from langchain_neo4j import Neo4jGraph
 from pydantic import BaseModel, Field
 
 from config import env
-from core.prompt import EXTRACT_ENTITIES_PROMPT
-from schemas import LegalDocumentMetadata
-from services import S3Client
-from vectorstore import QdrantClientManager
+from core.metrics import LLMUsageMetrics, llm_usage_metrics
+from core.prompt import cache_checkpoint
+from schemas import LegalChunkExtraction, LegalDocumentMetadata, LegalTriple, NODE_LABELS, RELATIONSHIP_TYPES
+from services import S3Client, DocumentMetadataStore, provision_graph
+from vectorstore import QdrantClientManager, FILTER_METADATA_KEYS
+from .checkpoint import ChunkCache, IngestionCheckpoint
+from .communities import mark_graph_updated
+from .entities import EntityCanonicalizer
+from .graph_writer import GraphWriter
+from .instrumentation import IngestionMetrics
+from .pdf_reader import PdfReader
+from .splitter import LegalTextSplitter, format_path
 
 from tenacity import (
-    retry,
+    AsyncRetrying,
     stop_after_attempt,
     wait_random_exponential,
 )
@@ -118,41 +132,14 @@ examples_: list[dict[str, str]] = [
     },
 ]
 
-nodes_: list[str] = [
-    "Person",
-    "Organization",
-    "Court",
-    "Legal_Case",
-    "Legal_Action",
-    "Legal_Document",
-    "Law",
-    "Law_Article",
-    "Legal_Concept",
-    "Evidence",
-    "Event",
-    "Location",
-    "Contract",
-    "Penalty",
-    "Appeal",
-]
+nodes_: list[str] = NODE_LABELS
 
-relationships_: list[str] = [
-    "PARTY_TO",
-    "REPRESENTS",
-    "EMPLOYED_BY",
-    "HANDLED_BY",
-    "LOCATED_IN",
-    "REFERS_TO",
-    "EVIDENCE_IN",
-    "DOCUMENT_OF",
-    "HAS_ACTION",
-    "HELD_ON",
-    "RELATED_TO",
-    "DECIDED_BY",
-    "APPEALED_TO",
-    "RESULTS_IN",
-    "CITES",
-]
+relationships_: list[str] = RELATIONSHIP_TYPES
+
+# Metadata fields holding a list of values, the others are single strings
+LIST_METADATA_KEYS: set[str] = {
+    name for name, field in LegalDocumentMetadata.model_fields.items() if "list" in str(field.annotation)
+}
 
 legal_document_metadata_keys_: list[str] = [
     # Document Identification
@@ -620,160 +607,296 @@ def _convert_to_graph_document(
     return _format_nodes(nodes), _format_relationships(relationships)
 
 
-BATCH_SIZE = 10 # Number of documents to process in a batch
+def _convert_triples(triples: List[LegalTriple]) -> Tuple[List[Node], List[Relationship]]:
+    """
+    Convert the triples of a combined extraction into nodes and relationships,
+    formatted like the output of the function-calling path.
+    :param triples: The extracted triples.
+    :return: The deduplicated nodes and the relationships.
+    """
+    nodes: dict[tuple[str, str], Node] = {}
+    relationships: List[Relationship] = []
+    for triple in triples:
+        # Skip triples the model left incomplete
+        if not triple.head or not triple.tail or not triple.relation:
+            continue
+        source = nodes.setdefault(
+            (triple.head, triple.head_type), Node(id=triple.head, type=triple.head_type or DEFAULT_NODE_TYPE))
+        target = nodes.setdefault(
+            (triple.tail, triple.tail_type), Node(id=triple.tail, type=triple.tail_type or DEFAULT_NODE_TYPE))
+        relationships.append(Relationship(source=source, target=target, type=triple.relation))
+    return _format_nodes(list(nodes.values())), _format_relationships(relationships)
+
+
+def _print_progress(processed: int, failed: int, total: int) -> None:
+    """
+    Default progress callback of the graph extraction.
+    :param processed: The number of chunks processed so far.
+    :param failed: The number of chunks that failed after their retries.
+    :param total: The total number of chunks.
+    """
+    if processed == total or processed % 10 == 0:
+        print(f"{processed}/{total} chunks extracted ({failed} failed).")
 
 
-class CallBackHandler(BaseCallbackHandler):
-    def on_chat_model_start(
-        self,
-        serialized: dict[str, Any],
-        messages: list[list[BaseMessage]],
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        tags: Optional[list[str]] = None,           # noqa
-        metadata: Optional[dict[str, Any]] = None,  # noqa
-        **kwargs: Any,
-    ) -> Any:
-        """
-        Handle the start of a chat model run.
-        :param serialized: The serialized representation of the chat model.
-        :param messages: The messages being processed.
-        :param run_id: The unique identifier for the run.
-        :param parent_run_id: The parent run identifier, if any.
-        """
-        print(f"{run_id}: {messages}")
+def _dump_graph_document(graph_document: GraphDocument) -> dict:
+    """
+    Serialize the nodes and relationships of a graph document, without its source.
+    :param graph_document: The graph document.
+    :return: A JSON-serializable representation.
+    """
+    return {
+        "nodes": [node.model_dump() for node in graph_document.nodes],
+        "relationships": [relationship.model_dump() for relationship in graph_document.relationships],
+    }
+
+
+def _load_graph_document(data: dict, source: Document) -> GraphDocument:
+    """
+    Rebuild a graph document serialized with _dump_graph_document.
+    :param data: The serialized nodes and relationships.
+    :param source: The chunk the graph was extracted from.
+    :return: The graph document.
+    """
+    return GraphDocument(
+        nodes=[Node(**node) for node in data["nodes"]],
+        relationships=[
+            Relationship(
+                source=Node(**rel["source"]),
+                target=Node(**rel["target"]),
+                type=rel["type"],
+                properties=rel.get("properties", {}),
+            )
+            for rel in data["relationships"]
+        ],
+        source=source,
+    )
+
 
 class LLMGraph(LLMGraphTransformer):
-    def __init__(self, llm: BaseLanguageModel, prompt: Optional[ChatPromptTemplate] = None):
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        prompt: Optional[ChatPromptTemplate] = None,
+        extract_metadata: bool = False,
+    ):
         """
         Initialize the LLMGraph with a language model.
         :param llm: The language model to use for processing.
+        :param prompt: Optional extraction prompt.
+        :param extract_metadata: Extract the triples and the LegalDocumentMetadata of a chunk in a single call.
         """
         super().__init__(llm=llm, allowed_nodes=nodes_, allowed_relationships=relationships_, prompt=prompt)
+        if extract_metadata:
+            self.chain = self.chain.first | llm.with_structured_output(LegalChunkExtraction)
+
+    def _to_graph_document(self, raw_schema: Any, document: Document) -> GraphDocument:
+        """
+        Convert the raw LLM output for a chunk into a graph document.
+        :param raw_schema: The raw output of the extraction chain.
+        :param document: The chunk the output was extracted from.
+        :return: The graph document.
+        """
+        if isinstance(raw_schema, LegalChunkExtraction):
+            # Structured output is already parsed, whether or not the model supports function calling
+            nodes, relationships = _convert_triples(raw_schema.triples)
+        elif self._function_call and not isinstance(raw_schema, str):
+            raw_schema = cast(Dict[Any, Any], raw_schema)
+            nodes, relationships = _convert_to_graph_document(raw_schema)
+        else:
+            nodes_set = set()
+            relationships = []
+            if not isinstance(raw_schema, str):
+                raw_schema = raw_schema.content
+            parsed_json = self.json_repair.loads(raw_schema)
+            if isinstance(parsed_json, dict):
+                parsed_json = [parsed_json]
+            for rel in parsed_json:
+                # Check if mandatory properties are there
+                if (
+                    not isinstance(rel, dict)
+                    or not rel.get("head")
+                    or not rel.get("tail")
+                    or not rel.get("relation")
+                ):
+                    continue
+                # Nodes need to be deduplicated using a set
+                # Use default Node label for nodes if missing
+                nodes_set.add((rel["head"], rel.get("head_type", DEFAULT_NODE_TYPE)))
+                nodes_set.add((rel["tail"], rel.get("tail_type", DEFAULT_NODE_TYPE)))
+
+                source_node = Node(
+                    id=rel["head"], type=rel.get("head_type", DEFAULT_NODE_TYPE)
+                )
+                target_node = Node(
+                    id=rel["tail"], type=rel.get("tail_type", DEFAULT_NODE_TYPE)
+                )
+                relationships.append(
+                    Relationship(
+                        source=source_node, target=target_node, type=rel["relation"]
+                    )
+                )
+            # Create nodes list
+            nodes = [Node(id=el[0], type=el[1]) for el in list(nodes_set)]
+
+        # Strict mode filtering
+        if self.strict_mode and (self.allowed_nodes or self.allowed_relationships):
+            if self.allowed_nodes:
+                lower_allowed_nodes = [el.lower() for el in self.allowed_nodes]
+                nodes = [
+                    node for node in nodes if node.type.lower() in lower_allowed_nodes
+                ]
+                relationships = [
+                    rel
+                    for rel in relationships
+                    if rel.source.type.lower() in lower_allowed_nodes
+                       and rel.target.type.lower() in lower_allowed_nodes
+                ]
+            if self.allowed_relationships:
+                # Filter by type and direction
+                if self._relationship_type == "tuple":
+                    relationships = [
+                        rel
+                        for rel in relationships
+                        if (
+                                (
+                                    rel.source.type.lower(),
+                                    rel.type.lower(),
+                                    rel.target.type.lower(),
+                                )
+                                in [  # type: ignore
+                                    (s_t.lower(), r_t.lower(), t_t.lower())
+                                    for s_t, r_t, t_t in self.allowed_relationships
+                                ]
+                        )
+                    ]
+                else:  # Filter by type only
+                    relationships = [
+                        rel
+                        for rel in relationships
+                        if rel.type.lower()
+                           in [el.lower() for el in self.allowed_relationships]  # type: ignore
+                    ]
+        return GraphDocument(nodes=nodes, relationships=relationships, source=document)
+
+    async def aextract_document(
+        self, document: Document, config: Optional[RunnableConfig] = None
+    ) -> Tuple[GraphDocument, Dict[str, Any]]:
+        """
+        Extract graph information and, in combined mode, document metadata from a single chunk,
+        retrying only this chunk on failure.
+        :param document: The chunk to process.
+        :param config: Optional runnable configuration.
+        :return: The graph document and the metadata of the chunk (empty unless in combined mode).
+        """
+        async for attempt in AsyncRetrying(
+            wait=wait_random_exponential(min=1, max=60),
+            stop=stop_after_attempt(env.EXTRACTION_MAX_ATTEMPTS),
+            reraise=True,
+        ):
+            with attempt:
+                raw_schema = await self.chain.ainvoke({"input": document.page_content}, config=config)
+                # A structured output the model failed to fill is retried like any other error
+                if raw_schema is None:
+                    raise ValueError("Empty extraction result.")
+        metadata: Dict[str, Any] = {}
+        if isinstance(raw_schema, LegalChunkExtraction):
+            metadata = raw_schema.metadata.model_dump(exclude_none=True)
+        return self._to_graph_document(raw_schema, document), metadata
+
+    async def aprocess_document(
+        self, document: Document, config: Optional[RunnableConfig] = None
+    ) -> GraphDocument:
+        """
+        Extract graph information from a single chunk, retrying only this chunk on failure.
+        :param document: The chunk to process.
+        :param config: Optional runnable configuration.
+        :return: The graph document of the chunk.
+        """
+        graph_document, _ = await self.aextract_document(document, config)
+        return graph_document
+
+    async def aprocess_batch(
+        self,
+        documents: list[Document],
+        config: Optional[RunnableConfig] = None,
+        max_concurrency: int = env.EXTRACTION_CONCURRENCY,
+        on_progress: Optional[Callable[[int, int, int], None]] = None,
+        on_result: Optional[Callable[[GraphDocument, Dict[str, Any]], Awaitable[None]]] = None,
+    ) -> list[GraphDocument]:
+        """
+        Extract graph information from the chunks concurrently, each chunk with its own retries.
+        A chunk that still fails after its retries yields an empty graph document.
+        :param documents: The chunks to process.
+        :param config: Optional runnable configuration.
+        :param max_concurrency: The maximum number of chunks extracted at once.
+        :param on_progress: Optional callback receiving the processed, failed and total chunk counts.
+        :param on_result: Optional coroutine function receiving the graph document and metadata of each chunk
+            extracted successfully. It runs on the event loop, so blocking work must be moved to a thread.
+        :return: The graph documents, in the same order as the chunks.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        processed, failed = 0, 0
+
+        async def _process(document: Document) -> GraphDocument:
+            nonlocal processed, failed
+            try:
+                async with semaphore:
+                    graph_document, metadata = await self.aextract_document(document, config)
+                # The callback does not hold a slot, so the next chunk is extracted meanwhile
+                if on_result is not None:
+                    await on_result(graph_document, metadata)
+            except Exception as e:
+                print(f"Error extracting graph from chunk {document.id}: {e}")
+                failed += 1
+                graph_document = GraphDocument(nodes=[], relationships=[], source=document)
+            processed += 1
+            (on_progress or _print_progress)(processed, failed, len(documents))
+            return graph_document
+
+        return list(await asyncio.gather(*(_process(document) for document in documents)))
 
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
     def process_batch(
-        self, documents: list[Document], config: Optional[RunnableConfig] = None
+        self,
+        documents: list[Document],
+        config: Optional[RunnableConfig] = None,
+        on_result: Optional[Callable[[GraphDocument, Dict[str, Any]], Awaitable[None]]] = None,
     ) -> list[GraphDocument]:
         """
-        Process a batch of documents and extract graph information.
+        Synchronous wrapper for the aprocess_batch method.
         :param documents:
         :param config:
+        :param on_result:
         :return:
         """
-        graph_documents: list[GraphDocument] = []
-        for batch in range(0, len(documents), BATCH_SIZE):
-            docs = documents[batch:batch + BATCH_SIZE]
-            results_batch = self.chain.batch(
-                docs,
-                config=config,
-            )
-            for i, raw_schema in enumerate(results_batch):
-                if self._function_call:
-                    raw_schema = cast(Dict[Any, Any], raw_schema)
-                    nodes, relationships = _convert_to_graph_document(raw_schema)
-                else:
-                    nodes_set = set()
-                    relationships = []
-                    if not isinstance(raw_schema, str):
-                        raw_schema = raw_schema.content
-                    parsed_json = self.json_repair.loads(raw_schema)
-                    if isinstance(parsed_json, dict):
-                        parsed_json = [parsed_json]
-                    for rel in parsed_json:
-                        # Check if mandatory properties are there
-                        if (
-                            not isinstance(rel, dict)
-                            or not rel.get("head")
-                            or not rel.get("tail")
-                            or not rel.get("relation")
-                        ):
-                            continue
-                        # Nodes need to be deduplicated using a set
-                        # Use default Node label for nodes if missing
-                        nodes_set.add((rel["head"], rel.get("head_type", DEFAULT_NODE_TYPE)))
-                        nodes_set.add((rel["tail"], rel.get("tail_type", DEFAULT_NODE_TYPE)))
-
-                        source_node = Node(
-                            id=rel["head"], type=rel.get("head_type", DEFAULT_NODE_TYPE)
-                        )
-                        target_node = Node(
-                            id=rel["tail"], type=rel.get("tail_type", DEFAULT_NODE_TYPE)
-                        )
-                        relationships.append(
-                            Relationship(
-                                source=source_node, target=target_node, type=rel["relation"]
-                            )
-                        )
-                    # Create nodes list
-                    nodes = [Node(id=el[0], type=el[1]) for el in list(nodes_set)]
-
-                # Strict mode filtering
-                if self.strict_mode and (self.allowed_nodes or self.allowed_relationships):
-                    if self.allowed_nodes:
-                        lower_allowed_nodes = [el.lower() for el in self.allowed_nodes]
-                        nodes = [
-                            node for node in nodes if node.type.lower() in lower_allowed_nodes
-                        ]
-                        relationships = [
-                            rel
-                            for rel in relationships
-                            if rel.source.type.lower() in lower_allowed_nodes
-                               and rel.target.type.lower() in lower_allowed_nodes
-                        ]
-                    if self.allowed_relationships:
-                        # Filter by type and direction
-                        if self._relationship_type == "tuple":
-                            relationships = [
-                                rel
-                                for rel in relationships
-                                if (
-                                        (
-                                            rel.source.type.lower(),
-                                            rel.type.lower(),
-                                            rel.target.type.lower(),
-                                        )
-                                        in [  # type: ignore
-                                            (s_t.lower(), r_t.lower(), t_t.lower())
-                                            for s_t, r_t, t_t in self.allowed_relationships
-                                        ]
-                                )
-                            ]
-                        else:  # Filter by type only
-                            relationships = [
-                                rel
-                                for rel in relationships
-                                if rel.type.lower()
-                                   in [el.lower() for el in self.allowed_relationships]  # type: ignore
-                            ]
-                graph_documents.append(GraphDocument(nodes=nodes, relationships=relationships, source=documents[i]))
-        return graph_documents
+        return asyncio.run(self.aprocess_batch(documents, config, on_result=on_result))
 
 class KnowledgeService:
     def __init__(self):
-        self._splitter = CharacterTextSplitter.from_tiktoken_encoder(
-            encoding_name="cl100k_base",
-            chunk_size=300,
-            chunk_overlap=50,
+        self._splitter = LegalTextSplitter(
+            chunk_size=env.CHUNK_SIZE,
+            min_chunk_size=env.CHUNK_MIN_SIZE,
+            chunk_overlap=env.CHUNK_OVERLAP,
         )
 
     @staticmethod
-    def calc_document_hash(contents: str) -> str:
+    def get_document_id(document_hash: str) -> str:
         """
-        Calculate a hash for the document contents.
-        :param contents: The document contents as bytes.
-        :return: A string representing the hash of the document.
+        Generate a deterministic document ID from the document hash.
+        :param document_hash: The hash of the document contents.
+        :return: A string representing the document ID.
         """
-        return hashlib.sha256(contents.encode()).hexdigest()
+        return uuid5(NAMESPACE_OID, document_hash).hex
 
     @staticmethod
-    def get_document_id() -> str:
+    def get_chunk_id(document_hash: str, index: int) -> str:
         """
-        Generate a unique document ID based on the current timestamp.
-        :return: A string representing the document ID.
+        Generate a deterministic chunk ID, so re-processing a document overwrites its chunks.
+        :param document_hash: The hash of the document contents.
+        :param index: The position of the chunk in the document.
+        :return: A string representing the chunk ID.
         """
-        return uuid4().hex
+        return uuid5(NAMESPACE_OID, f"{document_hash}:{index}").hex
 
     def process_response(
         self, document: list[Document], config: Optional[RunnableConfig] = None
@@ -786,6 +909,7 @@ class KnowledgeService:
         rel_types: Optional[list[str] | list[tuple[str, str, str]]] = None,
         relationship_type: Optional[str] = None,
         additional_instructions: Optional[str] = "",
+        metadata_keys: Optional[list[str]] = None,
     ) -> ChatPromptTemplate:
         node_labels_str = str(node_labels) if node_labels else ""
         if rel_types:
@@ -820,13 +944,18 @@ class KnowledgeService:
             "Maintain entity consistency: if an entity, like \"Maria Silva\", appears "
             "multiple times under different names or pronouns, always use the most complete "
             "identifier. The knowledge graph must remain coherent and easy to interpret.",
+            "In the same answer, also extract the legal document fields found in the text, using only "
+            f"these keys: {', '.join(metadata_keys)}. If a field is missing, leave it null. Do not guess "
+            "or hallucinate, use only the explicit information in the text. The output must then be a "
+            "single JSON object with the key \"triples\", holding the list of relation objects described "
+            "above, and the key \"metadata\", holding the document fields." if metadata_keys else "",
             "IMPORTANT:\n- Do not add any explanation or extra text. Output JSON only.\n",
             additional_instructions,
         ]
         system_prompt = "\n".join(filter(None, base_string_parts))
 
         system_message = SystemMessage(content=system_prompt)
-        parser = JsonOutputParser(pydantic_object=UnstructuredRelation)
+        parser = JsonOutputParser(pydantic_object=LegalChunkExtraction if metadata_keys else UnstructuredRelation)
 
         human_string_parts = [
             "Based on the example below, extract legal entities and "
@@ -842,37 +971,37 @@ class KnowledgeService:
             "{examples}\n",
             additional_instructions,
             "For the text below, extract entities and relations exactly as shown in the example:\n"
-            "{format_instructions}\nText: {input}",
+            "{format_instructions}",
         ]
 
         human_prompt_string = "\n".join(filter(None, human_string_parts))
-        human_prompt = PromptTemplate(
-            template=human_prompt_string,
-            input_variables=["input"],
-            partial_variables={
-                "format_instructions": parser.get_format_instructions(),
-                "node_labels": node_labels,
-                "rel_types": rel_types,
-                "examples": examples_,
-            },
+        # The instructions, examples and schema are identical for every chunk, so they are
+        # formatted once and sent as a cached prefix ahead of the chunk text.
+        human_prompt_static = PromptTemplate.from_template(human_prompt_string).format(
+            format_instructions=parser.get_format_instructions(),
+            node_labels=node_labels,
+            rel_types=rel_types,
+            examples=examples_,
         )
-
-        human_message_prompt = HumanMessagePromptTemplate(prompt=human_prompt)
+        human_message_prompt = HumanMessagePromptTemplate.from_template("Text: {input}")
 
         chat_prompt = ChatPromptTemplate.from_messages(
-            [system_message, human_message_prompt]
+            [system_message, HumanMessage(content=cache_checkpoint(human_prompt_static)), human_message_prompt]
         )
         return chat_prompt
 
     @staticmethod
-    def _read(key: str) -> str:
+    def _read(key: str) -> Iterator[str]:
+        """
+        Read the pages of a document from S3 lazily, one page at a time.
+        :param key: The S3 object key.
+        :return: An iterator of page texts.
+        """
         _ext = key.split('.')[-1].lower()
         if _ext == 'pdf':
-            loader = AmazonTextractPDFLoader(
-                f"s3://{env.S3_BUCKET_NAME}/{key}",
-                region_name=env.AWS_REGION,
-            )
-            return "\n".join([page.page_content for page in loader.load()])
+            # Text layers are read locally, only scanned pages go to OCR
+            yield from PdfReader().read(key)
+            return
         elif _ext == 'txt' or _ext == 'md':
             loader = S3FileLoader(
                 env.S3_BUCKET_NAME,
@@ -881,11 +1010,49 @@ class KnowledgeService:
                 aws_access_key_id=env.AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=env.AWS_SECRET_ACCESS_KEY,
             )
-            return "\n".join([page.page_content for page in loader.load()])
-        raise RuntimeError(f"Unsupported file type: {_ext}")
+        else:
+            raise RuntimeError(f"Unsupported file type: {_ext}")
+        for page in loader.lazy_load():
+            yield page.page_content
+
+    def _read_pages(self, key: str, checkpoint: IngestionCheckpoint) -> Iterator[str]:
+        """
+        Read the pages of a document, from the checkpoint if a previous attempt read them all.
+        Pages read from S3 are saved as they come.
+        :param key: The S3 object key.
+        :param checkpoint: The checkpoint of the job.
+        :return: An iterator of page texts.
+        """
+        if checkpoint.reached("read"):
+            yield from checkpoint.pages()
+            return
+        for i, page in enumerate(self._read(key)):
+            checkpoint.save_page(i, page)
+            yield page
+        checkpoint.save("read")
+
+    def _split_pages(self, pages: Iterable[str]) -> Iterator[tuple[str, str]]:
+        """
+        Split a stream of pages into chunks, keeping only the unfinished tail in memory.
+        The last chunk of each page is carried over with its section path, so chunks and
+        sections still span page breaks.
+        :param pages: The page texts.
+        :return: An iterator of chunk texts with their section path.
+        """
+        buffer, path = "", ()
+        for page in pages:
+            buffer = f"{buffer}\n{page}" if buffer else page
+            sections = self._splitter.split_sections(buffer, path)
+            if len(sections) > 1:
+                for text, path_ in sections[:-1]:
+                    yield text, format_path(path_)
+                buffer, path = sections[-1]
+        if buffer:
+            for text, path_ in self._splitter.split_sections(buffer, path):
+                yield text, format_path(path_)
 
     @staticmethod
-    def _get_llm(llm_name: Literal['openai', 'bedrock'] = 'bedrock') -> BaseLanguageModel:
+    def get_llm(llm_name: Literal['openai', 'bedrock'] = 'bedrock') -> BaseLanguageModel:
         """
         Get the LLM instance based on the specified type.
         :param llm_name: The type of LLM to use ('openai' or 'bedrock').
@@ -896,6 +1063,7 @@ class KnowledgeService:
                 temperature=0,
                 model=env.BEDROCK_MODEL_ID,
                 max_tokens=2048,
+                callbacks=[llm_usage_metrics],
             )
         elif llm_name == 'bedrock':
             return ChatBedrock(
@@ -905,86 +1073,376 @@ class KnowledgeService:
                 aws_access_key_id=env.AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=env.AWS_SECRET_ACCESS_KEY,
                 max_tokens=2048,
+                callbacks=[llm_usage_metrics],
             )
         raise ValueError("Unsupported LLM type. Use 'openai' or 'bedrock'.")
 
-    def process(self, key: str):
+    @staticmethod
+    def merge_metadata(metadatas: Iterable[dict]) -> dict[str, list[str]]:
         """
-        Process a document from S3, split it into chunks, and add it to the knowledge base.
-        :param key:
-        :return:
+        Merge the metadata extracted from the chunks of a document, dropping repeated values.
+        :param metadatas: The metadata of each chunk.
+        :return: The distinct values of each field, in order of appearance.
+        """
+        merged: dict[str, list[str]] = {}
+        seen: dict[str, set[str]] = {}
+        for metadata in metadatas:
+            for k, v in metadata.items():
+                for value in v if isinstance(v, list) else [v]:
+                    value = " ".join(str(value).split())
+                    if not value or value.casefold() in seen.setdefault(k, set()):
+                        continue
+                    seen[k].add(value.casefold())
+                    merged.setdefault(k, []).append(value)
+        return merged
+
+    @staticmethod
+    def _save_extraction(
+        graph_document: GraphDocument, metadata: dict, checkpoint: IngestionCheckpoint, cache: ChunkCache
+    ) -> None:
+        """
+        Save the graph and metadata of a chunk in the job checkpoint and in the chunk cache.
+        :param graph_document: The graph document of the chunk.
+        :param metadata: The document metadata found in the chunk.
+        :param checkpoint: The checkpoint of the job.
+        :param cache: The extraction chunk cache.
+        """
+        extraction = {"graph": _dump_graph_document(graph_document), "metadata": metadata}
+        checkpoint.save_chunk(graph_document.source.id, **extraction)
+        cache.set_many({graph_document.source.page_content: extraction})
+
+    @staticmethod
+    def _skip_duplicate(key: str, checkpoint: IngestionCheckpoint, **hashes: str) -> bool:
+        """
+        Complete the job without processing when the same content was already ingested.
+        :param key: The S3 object key.
+        :param checkpoint: The checkpoint of the job.
+        :param hashes: The content hashes to look up, e.g. file_hash or document_hash.
+        :return: True if the document is a duplicate and was skipped.
+        """
+        duplicate = checkpoint.find_ingested(**hashes)
+        if duplicate is None:
+            return False
+        print(f"{key} has the same content as {duplicate['_id']}, skipping.")
+        checkpoint.complete(
+            duplicate_of=duplicate["_id"],
+            document_id=duplicate.get("document_id"),
+            **hashes,
+        )
+        S3Client().delete_object(key)
+        return True
+
+    def _extract_window(
+        self,
+        window: list[Document],
+        llm_graph: LLMGraph,
+        config: RunnableConfig,
+        checkpoint: IngestionCheckpoint,
+        cache: ChunkCache,
+        canonicalizer: EntityCanonicalizer,
+        writer: GraphWriter,
+    ) -> dict[str, dict]:
+        """
+        Extract the graph and metadata of a window of chunks, reusing saved or cached extractions,
+        and queue the canonicalized graphs for writing as soon as each chunk is done.
+        :param window: The chunks of the window.
+        :param llm_graph: The graph extractor.
+        :param config: The runnable configuration of the extraction.
+        :param checkpoint: The checkpoint of the job.
+        :param cache: The extraction chunk cache.
+        :param canonicalizer: The entity canonicalizer.
+        :param writer: The graph writer.
+        :return: The metadata extracted from each chunk, by chunk ID.
+        """
+        saved = checkpoint.chunks([doc.id for doc in window])
+        cached = cache.get_many([doc.page_content for doc in window if "graph" not in saved.get(doc.id, {})])
+        chunk_metadata: dict[str, dict] = {}
+        for doc in window:
+            extraction = saved[doc.id] if "graph" in saved.get(doc.id, {}) else cached.get(doc.page_content)
+            if extraction is not None:
+                writer.add(canonicalizer.canonicalize(_load_graph_document(extraction["graph"], doc)))
+                chunk_metadata[doc.id] = extraction.get("metadata", {})
+        # Cache hits are saved in the job too, the final stage reads the metadata of every chunk from it
+        checkpoint.save_chunks({
+            doc.id: {"graph": cached[doc.page_content]["graph"], "metadata": chunk_metadata[doc.id]}
+            for doc in window if doc.id in chunk_metadata and "graph" not in saved.get(doc.id, {})
+        })
+
+        # The canonicalizer is not thread-safe, so the results are handled one at a time
+        lock = Lock()
+
+        def _handle_result(graph_document: GraphDocument, metadata: dict) -> None:
+            with lock:
+                self._save_extraction(graph_document, metadata, checkpoint, cache)
+                chunk_metadata[graph_document.source.id] = metadata
+                writer.add(canonicalizer.canonicalize(graph_document))
+
+        async def _on_result(graph_document: GraphDocument, metadata: dict) -> None:
+            # Neo4j lookups, Mongo writes and the writer backpressure block, so they run off the event loop
+            await asyncio.to_thread(_handle_result, graph_document, metadata)
+
+        pending = [doc for doc in window if doc.id not in chunk_metadata]
+        for graph_document in llm_graph.process_batch(pending, config, on_result=_on_result):
+            # Chunks that failed extraction still get their Document node
+            if graph_document.source.id not in chunk_metadata:
+                writer.add(graph_document)
+        return chunk_metadata
+
+    @staticmethod
+    def _index_window(
+        window: list[Document],
+        metadata: dict,
+        checkpoint: IngestionCheckpoint,
+        cache: ChunkCache,
+        vectorstore: QdrantClientManager,
+        metrics: IngestionMetrics,
+    ) -> None:
         """
-        # Load the document from S3
-        contents = self._read(key)
-        # Split the document into smaller chunks
-        texts = self._splitter.split_text(contents)
-        # Create Document objects from the split texts
-        source = key.split('/')[-1]
-        documents = [Document(id=uuid4().hex, page_content=text, source=source) for text in texts]
-        print(f"{len(documents)} Chunks created from {key}.")
-
-        # Convert the documents to graph documents using LLMGraphTransformer
-        llm = self._get_llm()
-        # Create the LLMGraphTransformer with the allowed nodes and relationships
-        llm_graph = LLMGraph(llm, prompt=self._create_unstructured_relationships_prompt(
+        Embed a window of chunks, reusing saved or cached embeddings, and upsert it to the vector database.
+        :param window: The chunks of the window.
+        :param metadata: The metadata shared by every chunk of the document.
+        :param checkpoint: The checkpoint of the job.
+        :param cache: The embedding chunk cache.
+        :param vectorstore: The vector database.
+        :param metrics: The metrics of the task.
+        """
+        saved = checkpoint.chunks([doc.id for doc in window])
+        vectors = {doc.id: saved[doc.id]["embedding"] for doc in window if "embedding" in saved.get(doc.id, {})}
+        cached = cache.get_many([doc.page_content for doc in window if doc.id not in vectors])
+        for doc in window:
+            if doc.id not in vectors and doc.page_content in cached:
+                vectors[doc.id] = cached[doc.page_content]
+        pending = [doc for doc in window if doc.id not in vectors]
+        if pending:
+            with metrics.timed("embed"):
+                embeddings_ = vectorstore.embed_documents([doc.page_content for doc in pending])
+            checkpoint.save_chunks({doc.id: {"embedding": vector} for doc, vector in zip(pending, embeddings_)})
+            cache.set_many({doc.page_content: vector for doc, vector in zip(pending, embeddings_)})
+            vectors.update({doc.id: vector for doc, vector in zip(pending, embeddings_)})
+        # Upsert the chunks, overwriting the points of a previous attempt
+        with metrics.timed("upsert"):
+            vectorstore.add_embeddings(
+                [
+                    Document(
+                        id=doc.id,
+                        page_content=doc.page_content,
+                        metadata={**doc.metadata, **metadata},
+                    ) for doc in window
+                ],
+                [vectors[doc.id] for doc in window],
+            )
+
+    def _get_llm_graph(self) -> LLMGraph:
+        """
+        Create the LLMGraphTransformer with the allowed nodes and relationships,
+        extracting the document metadata in the same call.
+        :return: The graph extractor.
+        """
+        return LLMGraph(self.get_llm(), prompt=self._create_unstructured_relationships_prompt(
             node_labels=nodes_,
             rel_types=relationships_,
-        ))
-        config = RunnableConfig(callbacks=[CallBackHandler()])
-        graph_documents = llm_graph.process_batch(documents, config)
-
-        # Connect to Neo4j and add the graph documents
-        graph = Neo4jGraph(url=env.NEO4J_URL, username=env.NEO4J_USERNAME, password=env.NEO4J_PASSWORD)
-        graph.add_graph_documents(graph_documents, include_source=True)
-        # Refresh the schema to ensure the new documents are indexed
-        graph.refresh_schema()
-
-        # Calculate the document hash
-        document_hash = self.calc_document_hash(contents)
-        document_id = self.get_document_id()
-        # Update the metadata with the extracted information
-        metadatas: dict[str, list[str]|str] = {
-            "document_id": document_id,
-            "document_hash": document_hash,
-            "source": source,
-        }
-        # Extract metadata from the document using the LLM
-        structured = llm.with_structured_output(LegalDocumentMetadata)
-        chain_legal_document = EXTRACT_ENTITIES_PROMPT | structured
-        # Iterate over the texts and extract metadata
-        for text in texts:
-            try:
-                # Extract metadata from the document
-                metadata_extraction_result: LegalDocumentMetadata = chain_legal_document.invoke( # type: ignore
-                    {"entities": ", ".join(legal_document_metadata_keys_), "text": text})
-                # Parse the metadata extraction result
-                metadata: dict = metadata_extraction_result.model_dump(exclude_none=True)
-                for k in metadata.keys():
-                    if k in ['document_id', 'document_hash', 'source']: continue
-                    if k in list(metadatas.keys()):
-                        if isinstance(metadatas[k], list):
-                            metadatas[k].extend(metadata[k])
-                            continue
-                        if isinstance(metadatas[k], str):
-                            metadatas[k] += "\n" + metadata[k]
-                    else:
-                        metadatas[k] = metadata[k]
-            except Exception as e_:
-                print(f"Error extracting metadata from text chunk: {e_}")
-
-        # Add the document to the vector database
-        vectorstore = QdrantClientManager()
-        # Build the Document objects with the metadata
-        documents = [
+            metadata_keys=legal_document_metadata_keys_,
+        ), extract_metadata=True)
+
+    @staticmethod
+    @contextmanager
+    def _instrumented(checkpoint: IngestionCheckpoint, enqueued_at: Optional[float]) -> Iterator[IngestionMetrics]:
+        """
+        Collect the metrics of an ingestion task and add them to its job when the task ends, even if it fails.
+        :param checkpoint: The checkpoint of the job.
+        :param enqueued_at: The UNIX time at which the task was enqueued, to measure its queue wait.
+        :return: The metrics of the task.
+        """
+        metrics = IngestionMetrics()
+        if enqueued_at is not None:
+            metrics.add("queue_wait_seconds", max(time.time() - enqueued_at, 0.0))
+        try:
+            yield metrics
+        finally:
+            checkpoint.add_metrics(metrics.pop())
+
+    def prepare(self, key: str, enqueued_at: Optional[float] = None) -> Optional[list[tuple[int, int]]]:
+        """
+        First stage: deduplicate the document, read its pages and split them into chunks,
+        saving the chunks in the job so the windows can be processed anywhere.
+        :param key: The S3 object key.
+        :param enqueued_at: The UNIX time at which the task was enqueued.
+        :return: The (start, stop) chunk ranges of the windows, or None if the document is skipped.
+        """
+        IngestionCheckpoint.create_indexes()
+        checkpoint = IngestionCheckpoint(key)
+        if checkpoint.reached("done"):
+            print(f"{key} was already ingested, skipping.")
+            S3Client().delete_object(key)
+            return None
+        checkpoint.resume()
+        with self._instrumented(checkpoint, enqueued_at) as metrics:
+            if "started_at" not in checkpoint.job:
+                checkpoint.save(started_at=time.time())
+            if not checkpoint.reached("split"):
+                # Identical files are recognized before paying for the text extraction
+                file_hash = checkpoint.job.get("file_hash")
+                if file_hash is None:
+                    file_hash = S3Client().calc_object_hash(key)
+                    if self._skip_duplicate(key, checkpoint, file_hash=file_hash):
+                        return None
+                    checkpoint.save(file_hash=file_hash)
+                source = key.split('/')[-1]
+                # Hash the text as it streams by, as the SHA-256 of the pages joined by newlines
+                digest = hashlib.sha256()
+                # Reading (and OCR) is interleaved with splitting, so it is timed page by page
+                read_seconds = 0.0
+
+                def _pages() -> Iterator[str]:
+                    nonlocal read_seconds
+                    pages = iter(self._read_pages(key, checkpoint))
+                    i = 0
+                    while True:
+                        started_at = time.perf_counter()
+                        page = next(pages, None)
+                        read_seconds += time.perf_counter() - started_at
+                        if page is None:
+                            return
+                        digest.update((f"\n{page}" if i else page).encode())
+                        i += 1
+                        yield page
+
+                total = 0
+                started_at = time.perf_counter()
+                for window in batched(enumerate(self._split_pages(_pages())), env.INGESTION_WINDOW_SIZE):
+                    # The file hash seeds the chunk IDs, so a redelivered task splits into the same chunks
+                    checkpoint.save_chunks({
+                        self.get_chunk_id(file_hash, i): {"index": i, "text": text, "section": section}
+                        for i, (text, section) in window
+                    })
+                    total += len(window)
+                metrics.add("read_seconds", read_seconds)
+                metrics.add("split_seconds", time.perf_counter() - started_at - read_seconds)
+                # Files with the same text but different bytes (re-saved PDFs) are caught before any LLM call
+                document_hash = digest.hexdigest()
+                if self._skip_duplicate(key, checkpoint, document_hash=document_hash):
+                    return None
+                checkpoint.save(
+                    "split",
+                    document_id=self.get_document_id(file_hash),
+                    document_hash=document_hash,
+                    source=source,
+                    total_chunks=total,
+                )
+                print(f"{total} Chunks created from {key}.")
+        total = checkpoint.job["total_chunks"]
+        size = env.INGESTION_WINDOW_SIZE
+        return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+    def process_window(self, key: str, start: int, stop: int, enqueued_at: Optional[float] = None) -> int:
+        """
+        Second stage: extract, write and index a window of chunks. Windows are independent,
+        so they can run in parallel on different workers.
+        :param key: The S3 object key.
+        :param start: The index of the first chunk of the window.
+        :param stop: The index after the last chunk of the window.
+        :param enqueued_at: The UNIX time at which the task was enqueued.
+        :return: The number of chunks processed.
+        """
+        checkpoint = IngestionCheckpoint(key)
+        job = checkpoint.job
+        window = [
             Document(
-                id=doc.id,
-                page_content=doc.page_content,
-                metadata=metadatas
-            ) for doc in documents
+                id=chunk["chunk_id"],
+                page_content=chunk["text"],
+                metadata={"source": job["source"], "section": chunk["section"], "chunk_index": chunk["index"]},
+            )
+            for chunk in checkpoint.chunk_range(start, stop)
         ]
-        # Add the documents to the vector database
-        vectorstore.add_documents(documents=documents)
+        with self._instrumented(checkpoint, enqueued_at) as metrics:
+            # Chunks shared with other documents (templates, quoted rulings) reuse their cached results
+            extraction_cache = ChunkCache("extraction", env.BEDROCK_MODEL_ID)
+            embedding_cache = ChunkCache("embedding", env.BEDROCK_EMBEDDING_MODEL_ID)
+            # Token usage of this window only, on top of the process-wide counters
+            usage = LLMUsageMetrics()
+            config = RunnableConfig(callbacks=[usage])
+            # Connect to Neo4j and make sure the MERGEs are backed by constraints and indexes
+            graph = Neo4jGraph(url=env.NEO4J_URL, username=env.NEO4J_USERNAME, password=env.NEO4J_PASSWORD)
+            provision_graph(graph)
+            # Entity variants are resolved to canonical names between extraction and the write
+            canonicalizer = EntityCanonicalizer(graph)
+            # Chunks only carry the document ID and their own fields, the filter keys are set by the final stage
+            metadata = {"document_id": job["document_id"]}
+            with GraphWriter(graph) as writer, ThreadPoolExecutor(max_workers=1) as indexer:
+                # Embeddings do not depend on the extraction, so both run at once
+                indexing = indexer.submit(
+                    self._index_window, window, metadata, checkpoint, embedding_cache, QdrantClientManager(), metrics)
+                with metrics.timed("extract"):
+                    self._extract_window(
+                        window, self._get_llm_graph(), config, checkpoint, extraction_cache, canonicalizer, writer)
+                indexing.result()
+            metrics.add("graph_write_seconds", writer.write_seconds)
+            metrics.add("chunks_processed", len(window))
+            for name, value in usage.snapshot().items():
+                metrics.add("llm_calls" if name == "calls" else name, value)
+        print(
+            f"Chunks {start}-{stop} of {key} processed, {canonicalizer.merged} entity names merged, "
+            f"LLM usage: {usage.snapshot()}."
+        )
+        return len(window)
+
+    def finalize(self, key: str, enqueued_at: Optional[float] = None) -> None:
+        """
+        Last stage: merge and store the document metadata, set the filter keys on its chunks
+        and complete the job.
+        :param key: The S3 object key.
+        :param enqueued_at: The UNIX time at which the task was enqueued.
+        """
+        checkpoint = IngestionCheckpoint(key)
+        if checkpoint.reached("done"):
+            return
+        job = checkpoint.job
+        document_id = job["document_id"]
+        with self._instrumented(checkpoint, enqueued_at) as metrics:
+            with metrics.timed("metadata"):
+                # Merge the metadata extracted from each chunk along with its triples
+                values = self.merge_metadata(checkpoint.chunk_metadata())
+                # Refresh the schema to ensure the new documents are indexed
+                graph = Neo4jGraph(url=env.NEO4J_URL, username=env.NEO4J_USERNAME, password=env.NEO4J_PASSWORD)
+                graph.refresh_schema()
+                mark_graph_updated(graph)
+                # The indexed filter keys are only known once every chunk is extracted
+                QdrantClientManager().set_document_payload(
+                    document_id, {k: values[k] for k in FILTER_METADATA_KEYS if k in values})
+                # Store the document metadata once per document
+                DocumentMetadataStore().save(
+                    document_id,
+                    document_hash=job["document_hash"],
+                    source=job["source"],
+                    chunks=job["total_chunks"],
+                    metadata={
+                        k: v if k in LIST_METADATA_KEYS else "\n".join(v)
+                        for k, v in values.items()
+                    },
+                )
+            checkpoint.complete(
+                document_id=document_id,
+                document_hash=job["document_hash"],
+                chunks=job["total_chunks"],
+                finished_at=time.time(),
+            )
         # Delete object from S3
         S3Client().delete_object(key)
         # Log the update
-        print(f"Knowledge base updated with {len(documents)} documents from {key}.")
\ No newline at end of file
+        print(f"Knowledge base updated with {job['total_chunks']} documents from {key}.")
+        print(f"LLM usage: {llm_usage_metrics.snapshot()}")
+
+    def process(self, key: str):
+        """
+        Process a document from S3, split it into chunks, and add it to the knowledge base,
+        running every stage in this process. Results are checkpointed under deterministic chunk IDs,
+        so a redelivered task skips the work already done and its writes overwrite instead of duplicating.
+        :param key:
+        :return:
+        """
+        windows = self.prepare(key)
+        if windows is None:
+            return
+        for start, stop in windows:
+            self.process_window(key, start, stop)
+        self.finalize(key)
@@ -0,0 +1,174 @@
+import multiprocessing
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Iterator, Optional
+
+import boto3
+import pypdfium2 as pdfium
+
+from config import env
+from services import S3Client
+
+# Pages handed to a worker process at a time
+PAGES_PER_TASK = 8
+# Scale used to render scanned pages for OCR (72 dpi * 3 = 216 dpi)
+RENDER_SCALE = 3.0
+
+
+class OCRBackend(ABC):
+    @abstractmethod
+    def ocr(self, image: bytes) -> str:
+        """
+        Recognize the text of a rendered page.
+        :param image: The page rendered as PNG.
+        :return: The page text.
+        """
+        pass
+
+
+class TextractOCR(OCRBackend):
+    def __init__(self):
+        """
+        OCR backend using the synchronous Amazon Textract text detection.
+        """
+        self._client = boto3.Session(
+            aws_access_key_id=env.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=env.AWS_SECRET_ACCESS_KEY,
+            region_name=env.AWS_REGION,
+        ).client("textract")
+
+    def ocr(self, image: bytes) -> str:
+        response = self._client.detect_document_text(Document={"Bytes": image})
+        return "\n".join(block["Text"] for block in response["Blocks"] if block["BlockType"] == "LINE")
+
+
+class NoOCR(OCRBackend):
+    def ocr(self, image: bytes) -> str:
+        """
+        OCR backend that leaves scanned pages empty, for environments without an OCR service.
+        """
+        return ""
+
+
+OCR_BACKENDS: dict[str, type[OCRBackend]] = {
+    "textract": TextractOCR,
+    "none": NoOCR,
+}
+
+
+def get_ocr_backend(name: str = env.OCR_BACKEND) -> OCRBackend:
+    """
+    Get an OCR backend by name.
+    :param name: The backend name, one of OCR_BACKENDS.
+    :return: An instance of the backend.
+    """
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unsupported OCR backend: {name}. Use one of {list(OCR_BACKENDS)}.")
+    return OCR_BACKENDS[name]()
+
+
+def has_text_layer(text: str, min_chars: int = env.PDF_MIN_TEXT_CHARS) -> bool:
+    """
+    Check whether the text layer of a page is usable, rather than empty or OCR garbage.
+    :param text: The text extracted from the page.
+    :param min_chars: The minimum number of alphanumeric characters.
+    :return: True if the page text can be used as is.
+    """
+    stripped = "".join(text.split())
+    alnum = sum(c.isalnum() for c in stripped)
+    return alnum >= min_chars and alnum >= 0.5 * len(stripped)
+
+
+def _extract_pages(path: str, start: int, stop: int) -> list[tuple[str, Optional[bytes]]]:
+    """
+    Extract the text layer of a range of pages, in a worker process.
+    Pages without a usable text layer are rendered for OCR instead.
+    :param path: The path of the PDF file.
+    :param start: The first page index.
+    :param stop: The page index after the last one.
+    :return: For each page, its text and, if it needs OCR, its PNG rendering.
+    """
+    pdf = pdfium.PdfDocument(path)
+    try:
+        pages: list[tuple[str, Optional[bytes]]] = []
+        for index in range(start, stop):
+            page = pdf[index]
+            text = page.get_textpage().get_text_range().replace("\r\n", "\n")
+            if has_text_layer(text):
+                pages.append((text, None))
+                continue
+            image = BytesIO()
+            page.render(scale=RENDER_SCALE).to_pil().save(image, format="PNG")
+            pages.append((text, image.getvalue()))
+        return pages
+    finally:
+        pdf.close()
+
+
+class PdfReader:
+    def __init__(self, ocr: Optional[OCRBackend] = None, max_workers: int = env.PDF_WORKERS):
+        """
+        Read PDFs page by page from their text layer, in parallel worker processes,
+        sending only the pages without a usable text layer to the OCR backend.
+        :param ocr: The OCR backend for scanned pages, by default the one set in OCR_BACKEND.
+        :param max_workers: The number of worker processes.
+        """
+        self._ocr = ocr or get_ocr_backend()
+        self._max_workers = max_workers
+
+    def read_file(self, path: str) -> Iterator[str]:
+        """
+        Read the pages of a local PDF, in order, with a bounded number of page ranges in flight.
+        :param path: The path of the PDF file.
+        :return: An iterator of page texts.
+        """
+        pdf = pdfium.PdfDocument(path)
+        total = len(pdf)
+        pdf.close()
+        ranges = iter([(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)])
+        scanned = 0
+        # Daemonic processes, such as Celery prefork workers, cannot start children: pdfium is not
+        # thread-safe, so the pages are then read by a single thread
+        if multiprocessing.current_process().daemon:
+            pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            pool = ProcessPoolExecutor(max_workers=self._max_workers)
+        with pool, ThreadPoolExecutor(max_workers=self._max_workers) as ocr_pool:
+            tasks: deque[Future] = deque()
+
+            def _submit() -> None:
+                next_range = next(ranges, None)
+                if next_range is not None:
+                    tasks.append(pool.submit(_extract_pages, path, *next_range))
+
+            for _ in range(self._max_workers * 2):
+                _submit()
+            while tasks:
+                pages = tasks.popleft().result()
+                _submit()
+                # Scanned pages of the range are recognized concurrently, then yielded in order
+                ocr_tasks = {
+                    i: ocr_pool.submit(self._ocr.ocr, image) for i, (_, image) in enumerate(pages) if image is not None
+                }
+                scanned += len(ocr_tasks)
+                for i, (text, _) in enumerate(pages):
+                    yield ocr_tasks[i].result() if i in ocr_tasks else text
+        print(f"{total} pages read, {scanned} sent to OCR.")
+
+    def read(self, key: str) -> Iterator[str]:
+        """
+        Read the pages of a PDF stored in S3.
+        :param key: The S3 object key.
+        :return: An iterator of page texts.
+        """
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            S3Client().download_file(key, path)
+            yield from self.read_file(path)
+        finally:
+            os.remove(path)
@@ -0,0 +1,168 @@
+import re
+from typing import Any, NamedTuple, Optional
+
+import tiktoken
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+# Structural markers, from the outermost to the innermost level
+HEADING_PATTERN = re.compile(
+    r"^(EMENTA|RELAT[ÓO]RIO|VOTO|FUNDAMENTA[ÇC][ÃA]O|DISPOSITIVO|AC[ÓO]RD[ÃA]O|SENTEN[ÇC]A|DECIS[ÃA]O|"
+    r"DOS?\s+FATOS|DO\s+DIREITO|DOS?\s+PEDIDOS?|CONCLUS[ÃA]O|CAP[ÍI]TULO|T[ÍI]TULO|SE[ÇC][ÃA]O|LIVRO)\b",
+    re.IGNORECASE,
+)
+ARTICLE_PATTERN = re.compile(r"^(Art\.?|Artigo)\s*\d+(\.\d+)*\s*[º°o]?(-[A-Z])?", re.IGNORECASE)
+PARAGRAPH_PATTERN = re.compile(r"^(§+\s*\d+\s*[º°o]?|Par[áa]grafo\s+[úu]nico)", re.IGNORECASE)
+INCISO_PATTERN = re.compile(r"^([IVXLCDM]+)\s*[-–—.)]\s")
+ALINEA_PATTERN = re.compile(r"^([a-z])\)\s")
+
+HEADING, ARTICLE, PARAGRAPH, INCISO, ALINEA = range(5)
+# Level given to text that does not start a new structural unit
+BODY = 5
+
+
+# Section path of a unit: the (level, label) of each enclosing structural unit
+SectionPath = tuple[tuple[int, str], ...]
+
+
+class _Unit(NamedTuple):
+    text: str
+    path: SectionPath
+    level: int
+
+
+def format_path(path: SectionPath) -> str:
+    """
+    Format a section path for chunk metadata.
+    :param path: The section path.
+    :return: The labels joined from the outermost to the innermost, e.g. "EMENTA > Art. 5º > § 1º".
+    """
+    return " > ".join(label for _, label in path)
+
+
+def _marker(line: str) -> Optional[tuple[int, str]]:
+    """
+    Detect whether a line starts a structural unit.
+    :param line: The stripped line.
+    :return: The level and label of the unit, or None for body text.
+    """
+    if HEADING_PATTERN.match(line) or _is_heading(line):
+        return HEADING, line[:60]
+    for level, pattern in ((ARTICLE, ARTICLE_PATTERN), (PARAGRAPH, PARAGRAPH_PATTERN)):
+        match = pattern.match(line)
+        if match:
+            return level, " ".join(match.group(0).split())
+    match = INCISO_PATTERN.match(line)
+    if match:
+        return INCISO, match.group(1)
+    match = ALINEA_PATTERN.match(line)
+    if match:
+        return ALINEA, f"{match.group(1)})"
+    return None
+
+
+def _is_heading(line: str) -> bool:
+    """
+    Check whether a line looks like a heading: short and in upper case.
+    :param line: The stripped line.
+    :return: True if the line is a heading.
+    """
+    letters = [c for c in line if c.isalpha()]
+    return len(line) <= 80 and len(letters) >= 4 and sum(c.isupper() for c in letters) >= 0.8 * len(letters)
+
+
+class LegalTextSplitter(TextSplitter):
+    def __init__(
+        self,
+        chunk_size: int = 800,
+        min_chunk_size: int = 200,
+        chunk_overlap: int = 50,
+        encoding_name: str = "cl100k_base",
+        **kwargs: Any,
+    ):
+        """
+        Split Brazilian legal documents along their structure: headings (EMENTA, DISPOSITIVO, ...),
+        articles, paragraphs (§), incisos and alíneas. Consecutive units are packed up to the target
+        size, a new heading starts a new chunk once the current one has the minimum size, and only
+        units larger than the target are cut further.
+        :param chunk_size: The maximum size of a chunk, in tokens.
+        :param min_chunk_size: The size, in tokens, from which a new heading closes the current chunk.
+        :param chunk_overlap: The overlap, in tokens, used when a single unit must be cut.
+        :param encoding_name: The tiktoken encoding used to count tokens.
+        """
+        encoding = tiktoken.get_encoding(encoding_name)
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=lambda text: len(encoding.encode(text, disallowed_special=())),
+            **kwargs,
+        )
+        self._min_chunk_size = min_chunk_size
+        self._fallback = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=encoding_name,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+        )
+
+    def _units(self, text: str, path: SectionPath) -> list[_Unit]:
+        """
+        Cut the text into structural units, tracking the section path of each one.
+        :param text: The text to cut.
+        :param path: The section path in effect at the start of the text.
+        :return: The units, in order.
+        """
+        levels: list[tuple[int, str]] = list(path)
+        units: list[_Unit] = []
+        lines: list[str] = []
+        level = BODY
+        for line in text.splitlines():
+            marker = _marker(line.strip()) if line.strip() else None
+            if marker is not None:
+                if lines:
+                    units.append(_Unit("\n".join(lines).strip(), tuple(levels), level))
+                    lines = []
+                level, label = marker
+                levels = [(level_, label_) for level_, label_ in levels if level_ < level] + [(level, label)]
+            lines.append(line)
+        if lines and "\n".join(lines).strip():
+            units.append(_Unit("\n".join(lines).strip(), tuple(levels), level))
+        return units
+
+    def split_sections(self, text: str, path: SectionPath = ()) -> list[tuple[str, SectionPath]]:
+        """
+        Split the text into chunks along its legal structure.
+        :param text: The text to split.
+        :param path: The section path in effect at the start of the text, e.g. when the text
+            continues a previous page.
+        :return: The chunks with the section path where each one starts.
+        """
+        chunks: list[tuple[str, SectionPath]] = []
+        current: list[str] = []
+        current_size = 0
+        current_path: SectionPath = path
+
+        def _flush() -> None:
+            nonlocal current, current_size
+            if current:
+                chunks.append(("\n".join(current), current_path))
+            current, current_size = [], 0
+
+        for unit in self._units(text, path):
+            size = self._length_function(unit.text)
+            if size > self._chunk_size:
+                _flush()
+                chunks.extend((piece, unit.path) for piece in self._fallback.split_text(unit.text))
+                continue
+            if current and (
+                current_size + size > self._chunk_size
+                or (unit.level == HEADING and current_size >= self._min_chunk_size)
+            ):
+                _flush()
+            if not current:
+                current_path = unit.path
+            current.append(unit.text)
+            current_size += size
+        _flush()
+        return chunks
+
+    def split_text(self, text: str) -> list[str]:
+        return [chunk for chunk, _ in self.split_sections(text)]
@@ -1,20 +1,162 @@
 import asyncio
+import time
+from typing import Any, Optional
+
+from celery import chord
+
+from config import env
+from .communities import CommunityService
+from .checkpoint import FAILED_STAGE, IngestionCheckpoint
+from .instrumentation import TIMED_STAGES
 from .knowledge import KnowledgeService
-from .connection import app
+from .connection import app, ingestion_queue
 
 
-@app.task(name="knowledge.upload_knowledge_base")
-def _upload_knowledge_base(key: str):
+# Acknowledged only once done, so a crashed worker's message is redelivered and the job resumes from its checkpoint
+@app.task(name="knowledge.upload_knowledge_base", bind=True, acks_late=True, reject_on_worker_lost=True)
+def _upload_knowledge_base(self, key: str, enqueued_at: Optional[float] = None, queue: Optional[str] = None):
     """
     Synchronous task to update the knowledge base with the given S3 object ID.
+    Reads and splits the document, then replaces itself with a chord: the windows of chunks are
+    processed in parallel across the workers and the document is finalized once all of them are done.
+    Safe to run again for the same key: completed stages are skipped and writes are idempotent.
+    The windows and the final step stay in the queue the upload was routed to.
+    """
+    service = KnowledgeService()
+    windows = service.prepare(key, enqueued_at=enqueued_at)
+    if windows is None:
+        return
+    if not windows:
+        return _finalize_document(key)
+    # The queue wait of each window is measured from the moment the chord is sent
+    now = time.time()
+    queue = queue or ingestion_queue(None)
+    finalize = _finalize_document.si(key, enqueued_at=now).set(queue=queue)
+    # Once a window exhausts its retries the chord fails, and the job is marked as failed instead of hanging
+    finalize.link_error(_ingestion_failed.si(key).set(queue=queue))
+    return self.replace(chord(
+        [_process_window.si(key, start, stop, enqueued_at=now).set(queue=queue) for start, stop in windows],
+        finalize,
+    ))
+
+
+# Transient errors (throttling, timeouts) are retried with backoff; done chunks are skipped on the next attempt
+@app.task(
+    name="knowledge.process_window", acks_late=True, reject_on_worker_lost=True,
+    autoretry_for=(Exception,), retry_backoff=True, max_retries=env.INGESTION_MAX_RETRIES,
+)
+def _process_window(key: str, start: int, stop: int, enqueued_at: Optional[float] = None) -> int:
+    """
+    Synchronous task to extract, write and index a window of chunks of a document.
+    Retried with exponential backoff on errors, up to INGESTION_MAX_RETRIES times.
+    """
+    service = KnowledgeService()
+    return service.process_window(key, start, stop, enqueued_at=enqueued_at)
+
+
+@app.task(name="knowledge.finalize_document", acks_late=True, reject_on_worker_lost=True)
+def _finalize_document(key: str, enqueued_at: Optional[float] = None):
+    """
+    Synchronous task to store the metadata of a document once all its windows are processed.
     """
     service = KnowledgeService()
-    service.process(key)
+    service.finalize(key, enqueued_at=enqueued_at)
+    # Refresh the community summaries once the current burst of uploads is over
+    _build_communities.apply_async(kwargs={"requested_at": time.time()}, countdown=env.COMMUNITY_REBUILD_DELAY)
+
+
+@app.task(name="knowledge.ingestion_failed")
+def _ingestion_failed(key: str):
+    """
+    Synchronous task to mark a job as failed when its chord fails, so its status does not stay running.
+    Uploading the same key again resumes the job from its last completed stage.
+    """
+    IngestionCheckpoint(key).fail(failed_at=time.time())
+    print(f"Ingestion of {key} failed.")
 
 
-async def aupload_knowledge_base(key: str) -> str:
+@app.task(name="knowledge.build_communities")
+def _build_communities(requested_at: Optional[float] = None):
+    """
+    Synchronous task to rebuild the graph communities and their summaries.
+    """
+    service = CommunityService(llm=KnowledgeService.get_llm())
+    service.process(requested_at)
+
+
+async def aupload_knowledge_base(key: str, size: Optional[int] = None) -> str:
     """
     Asynchronous wrapper for updating the knowledge base.
     :param key: The S3 object ID to update the knowledge base with.
+    :param size: The size of the file in bytes, used to route it to the interactive or the bulk queue.
+    :return: The task ID, which identifies the job in aget_job_status.
+    """
+    enqueued_at = time.time()
+    queue = ingestion_queue(size)
+    task_id = (await asyncio.to_thread(
+        _upload_knowledge_base.apply_async,
+        kwargs={"key": key, "enqueued_at": enqueued_at, "queue": queue},
+        queue=queue,
+    )).id
+    # The job is visible as queued until a worker picks it up
+    await asyncio.to_thread(IngestionCheckpoint.create_indexes)
+    await asyncio.to_thread(lambda: IngestionCheckpoint(key).save(task_id=task_id, enqueued_at=enqueued_at))
+    return task_id
+
+
+def _job_status(job: dict[str, Any]) -> str:
+    """
+    Get the status of a job from its stage.
+    :param job: The job document.
+    :return: The status: failed, done, running or queued.
+    """
+    stage = job.get("stage")
+    if stage in (FAILED_STAGE, "done"):
+        return stage
+    return "running" if job.get("started_at") is not None else "queued"
+
+
+async def aget_job_status(task_id: str) -> Optional[dict[str, Any]]:
+    """
+    Get the progress and metrics of an ingestion job.
+    :param task_id: The task ID returned when the upload was enqueued.
+    :return: The job status, or None if the job is unknown.
+    """
+    job = await asyncio.to_thread(IngestionCheckpoint.find_by_task, task_id)
+    if job is None:
+        return None
+    metrics: dict[str, float] = job.get("metrics", {})
+    total = job.get("total_chunks")
+    processed = metrics.get("chunks_processed", 0)
+    started_at, finished_at = job.get("started_at"), job.get("finished_at")
+    elapsed = ((finished_at or time.time()) - started_at) if started_at is not None else None
+    return {
+        "job_id": task_id,
+        "key": job["_id"],
+        "status": _job_status(job),
+        "stage": job.get("stage"),
+        "duplicate_of": job.get("duplicate_of"),
+        "total_chunks": total,
+        # Redelivered windows are counted again, so the progress is capped at the total
+        "processed_chunks": min(processed, total) if total is not None else processed,
+        "elapsed_seconds": elapsed,
+        "chunks_per_second": processed / elapsed if elapsed else None,
+        "metrics": metrics,
+    }
+
+
+async def aget_ingestion_metrics() -> dict[str, Any]:
+    """
+    Get the ingestion metrics of the whole fleet: jobs by stage, and for completed documents
+    the time per chunk of each stage, useful to size the workers.
+    :return: The job counts and metric totals.
     """
-    return (await asyncio.to_thread(_upload_knowledge_base.delay, key=key)).id
+    summary = await asyncio.to_thread(IngestionCheckpoint.summary)
+    totals: dict[str, float] = summary["totals"]
+    chunks = totals.get("chunks_processed", 0)
+    return {
+        **summary,
+        "seconds_per_chunk": {
+            stage: totals.get(f"{stage}_seconds", 0) / chunks for stage in TIMED_STAGES
+        } if chunks else {},
+    }